@@ -1,30 +1,18 @@
+import time
+_import_started = time.perf_counter()
 import streamlit as st
+import contextvars
 import os
-import sys
-from pathlib import Path
-import tempfile
-import time
-import sounddevice as sd
-import soundfile as sf
-import numpy as np
-import pygame
-from modules.audio_processor import AudioProcessor
-from modules.text_processor import TextProcessor
-from modules.vector_store import VectorStore
-from modules.llm_processor import LLMProcessor
-from modules.voice_qa import VoiceQA
-import pyttsx3
-import subprocess
-
-# 初始化 pygame 音頻
-try:
-    pygame.mixer.init()
-    pygame.init()
-    pygame_initialized = True
-    print("Pygame 初始化成功")
-except Exception as e:
-    pygame_initialized = False
-    print(f"Pygame 初始化失敗: {str(e)}")
+import queue
+import threading
+# 只導入輕量的模塊；Whisper、向量存儲、LLM 和語音組件在第一次使用時才導入
+from modules.startup_profile import profiler
+from modules.tts_worker import get_tts_worker
+from modules.ingest_queue import STAGES
+from modules.text_processor import SentenceSplitter
+from modules.text_normalize import detect_language, majority_language, script_counts
+from modules.tracing import tracer, STAGES as TRACE_STAGES
+profiler.record("app", "import", time.perf_counter() - _import_started)
 
 # 設定頁面
 st.set_page_config(
@@ -37,83 +25,237 @@ st.set_page_config(
 TRANSCRIBED_DATA_DIR = "transcribed_data"
 VECTOR_STORE_DIR = "vector_store"
 VOICE_QUESTIONS_DIR = "voice_questions"
+# 向量存儲後端：chroma 或 faiss（FAISS 索引類型：flat、ivf、hnsw）
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat")
+# 問答檢索方式：hybrid（關鍵詞 + 向量）或 similarity（只用向量）
+SEARCH_TYPE = os.getenv("SEARCH_TYPE", "hybrid")
+# 每次提問發送給 LLM 的參考內容的 token 預算
+CONTEXT_TOKENS = int(os.getenv("CONTEXT_TOKENS", "3000"))
+# 後台轉錄音檔的工作進程數量
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# 各階段耗時的 JSONL 記錄文件，以及 Prometheus 指標端點的端口（默認不啟動，例如設為 9464 時啟動）
+TRACE_LOG = os.getenv("TRACE_LOG", os.path.join(TRANSCRIBED_DATA_DIR, "traces.jsonl"))
+METRICS_PORT = os.getenv("METRICS_PORT", "")
 os.makedirs(TRANSCRIBED_DATA_DIR, exist_ok=True)
 os.makedirs(VECTOR_STORE_DIR, exist_ok=True)
 os.makedirs(VOICE_QUESTIONS_DIR, exist_ok=True)
 
-# 初始化組件
-@st.cache_resource
-def load_components():
-    audio_processor = AudioProcessor(TRANSCRIBED_DATA_DIR)
-    text_processor = TextProcessor()
-    vector_store = VectorStore(VECTOR_STORE_DIR)
-    llm_processor = LLMProcessor()
-    voice_qa = VoiceQA(use_local_tts=True)
-    
-    # 創建問答鏈
-    qa_chain = llm_processor.create_qa_chain(
+# 各組件的創建方式：(需要導入的模塊, 創建函數)
+def _build_vector_store(module, components):
+    backend_options = {"index_type": FAISS_INDEX_TYPE} if VECTOR_BACKEND == "faiss" else {}
+    return module.VectorStore(VECTOR_STORE_DIR, backend=VECTOR_BACKEND, search_type=SEARCH_TYPE, **backend_options)
+
+def _build_ingest_service(module, components):
+    # 上傳的音檔在後台處理，任務保存在數據庫中，刷新頁面不會丟失
+    ingest_service = module.IngestService(
+        components["ingest_queue"], TRANSCRIBED_DATA_DIR, components["vector_store"],
+        components["audio_processor"], num_workers=INGEST_WORKERS
+    )
+    ingest_service.start()
+    import atexit
+    atexit.register(ingest_service.stop)
+    return ingest_service
+
+def _build_qa_chain(module, components):
+    vector_store = components["vector_store"]
+    return components["llm_processor"].create_qa_chain(
         vector_store.as_retriever(
-            search_type="similarity",
+            search_type=vector_store.search_type,
             search_kwargs={"k": 3}
         )
     )
+
+COMPONENT_FACTORIES = {
+    "audio_processor": ("modules.audio_processor", lambda module, components: module.AudioProcessor(TRANSCRIBED_DATA_DIR)),
+    "text_processor": ("modules.text_processor", lambda module, components: module.TextProcessor()),
+    "vector_store": ("modules.vector_store", _build_vector_store),
+    "llm_processor": ("modules.llm_processor", lambda module, components: module.LLMProcessor(context_tokens=CONTEXT_TOKENS)),
+    "voice_qa": ("modules.voice_qa", lambda module, components: module.VoiceQA(use_local_tts=True)),
+    "answer_cache": ("modules.answer_cache", lambda module, components: module.AnswerCache(os.path.join(TRANSCRIBED_DATA_DIR, "answer_cache.json"))),
+    "ingest_queue": ("modules.ingest_queue", lambda module, components: module.IngestQueue(os.path.join(TRANSCRIBED_DATA_DIR, "ingest_jobs.sqlite3"))),
+    "ingest_service": ("modules.ingest_queue", _build_ingest_service),
+    "qa_chain": (None, _build_qa_chain)
+}
+
+class Components:
+    def __init__(self):
+        """
+        按需創建的應用組件，用法與字典相同，例如 components["vector_store"]
+
+        組件在第一次使用時才導入所需的模塊並初始化，頁面無需等待 Whisper、嵌入模型或 TTS 引擎加載就能顯示；
+        導入和初始化耗時記錄在啟動分析器中。
+        """
+        self._instances = {}
+        # 每個組件單獨加鎖，創建較慢的組件時不阻塞其他組件
+        self._locks = {name: threading.Lock() for name in COMPONENT_FACTORIES}
+        self._warm_up_started = False
+
+    def __getitem__(self, name):
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        with self._locks[name]:
+            if name not in self._instances:
+                module_name, build = COMPONENT_FACTORIES[name]
+                module = profiler.import_module(name, module_name) if module_name else None
+                with profiler.measure(name, "init"):
+                    self._instances[name] = build(module, self)
+            return self._instances[name]
+
+    def is_loaded(self, name) -> bool:
+        return name in self._instances
+
+    def warm_up(self, names):
+        """在後台線程中依次創建組件，只在第一次調用時執行"""
+        if self._warm_up_started:
+            return
+        self._warm_up_started = True
+
+        def load():
+            for name in names:
+                try:
+                    self[name]
+                except Exception as e:
+                    print(f"預先加載 {name} 失敗：{str(e)}")
+
+        threading.Thread(target=load, name="component-warm-up", daemon=True).start()
+
+@st.cache_resource
+def load_components():
+    return Components()
+
+# 設置追蹤記錄的導出，每個進程只執行一次
+@st.cache_resource
+def setup_tracing():
+    tracer.configure(TRACE_LOG)
+    if METRICS_PORT:
+        tracer.serve(int(METRICS_PORT))
+    return tracer
+
+# 處理任務的狀態名稱
+INGEST_STATUS_LABELS = {
+    "queued": "⏳ 排隊中",
+    "running": "🔄 轉錄和索引中",
+    "chunked": "🔄 索引中",
+    "done": "✅ 完成",
+    "failed": "❌ 失敗"
+}
+
+# 顯示處理任務的進度
+def render_ingest_jobs(components):
+    jobs = components["ingest_queue"].list_jobs()
+    if not jobs:
+        st.caption("目前沒有處理任務")
+        return
     
-    return {
-        "audio_processor": audio_processor,
-        "text_processor": text_processor,
-        "vector_store": vector_store,
-        "llm_processor": llm_processor,
-        "voice_qa": voice_qa,
-        "qa_chain": qa_chain
-    }
-
-# 處理音頻文件
-def process_audio_file(components, audio_path):
-    # 轉錄音頻
-    content, output_path = components["audio_processor"].transcribe(audio_path)
-    if not content or not output_path:
-        return False, "音頻轉錄失敗"
-        
-    # 清理文本
-    cleaned_content = components["text_processor"].clean_text(content)
-    
-    # 分塊處理
-    chunks = components["text_processor"].split_text(cleaned_content)
-    
-    # 添加每個塊到向量存儲
-    success = True
-    chunk_count = 0
-    for chunk in chunks:
-        metadata = {
-            "source": str(output_path),
-            "timestamp": output_path.stem.split("_")[-1]
-        }
-        if components["vector_store"].add_content(chunk, metadata):
-            chunk_count += 1
-        else:
-            success = False
-            break
-    
-    if success:
-        return True, f"處理成功! 文本已分為 {chunk_count} 個塊並存儲到向量數據庫"
-    else:
-        return False, "向量存儲失敗"
+    for job in jobs:
+        st.write(f"**{job['filename']}** — {INGEST_STATUS_LABELS.get(job['status'], job['status'])}")
+        columns = st.columns(len(STAGES))
+        for column, (stage, label) in zip(columns, STAGES):
+            with column:
+                st.progress(job["progress"].get(stage, 0.0), text=label)
+        if job["message"]:
+            if job["status"] == "failed":
+                st.error(job["message"])
+            else:
+                st.caption(job["message"])
+
+# 支持局部刷新時定時輪詢任務進度，不影響其他選項卡
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+if _fragment is not None:
+    render_ingest_jobs = _fragment(run_every=2)(render_ingest_jobs)
 
 # 回答問題
 def answer_question(components, question):
     try:
-        result = components["qa_chain"]({"query": question})
+        result = components["llm_processor"].answer_with_cache(
+            components["qa_chain"], components["vector_store"], question, components["answer_cache"]
+        )
         return result["result"]
     except Exception as e:
         st.error(f"問答失敗：{str(e)}")
         return "抱歉，我無法回答這個問題。"
 
-# 語音合成並播放
-def speak_answer(components, text):
-    voice_qa = components["voice_qa"]
+# 流式回答問題
+def stream_answer(components, question):
+    try:
+        yield from components["llm_processor"].stream_answer(
+            components["qa_chain"], components["vector_store"], question, components["answer_cache"]
+        )
+    except Exception as e:
+        st.error(f"問答失敗：{str(e)}")
+        yield "抱歉，我無法回答這個問題。"
+
+# 流式顯示答案，並在每句話完成後立即開始朗讀
+def stream_and_speak_answer(components, question):
+    # 語言檢測只需文本處理，不必創建 VoiceQA（加載音頻設備和 TTS 引擎）
+    question_lang = detect_language(question)
+    
+    # 日文和韓文需要在線服務，只能在完整答案生成後朗讀
+    if question_lang in ['ja', 'ko']:
+        answer = st.write_stream(stream_answer(components, question))
+        speak_answer(components, answer)
+        return answer
+    
+    # 後台線程按順序朗讀句子；排隊的句子合併為一次朗讀請求
+    sentences = queue.Queue()
+    local_failed = threading.Event()
+    
+    def speak_worker():
+        while True:
+            batch = [sentences.get()]
+            while not sentences.empty():
+                batch.append(sentences.get())
+            done = None in batch
+            text = "".join(sentence for sentence in batch if sentence)
+            if text and not local_failed.is_set():
+                try:
+                    ok, stderr = run_local_tts(text)
+                except Exception as e:
+                    ok, stderr = False, str(e)
+                if not ok:
+                    print(f"本地TTS未正確執行: {stderr}")
+                    local_failed.set()
+            if done:
+                return
     
-    # 檢測語言
-    lang = voice_qa.detect_language(text)
+    # 朗讀線程沿用當前的追蹤上下文，朗讀耗時記錄在同一次提問中
+    speaker = threading.Thread(target=contextvars.copy_context().run, args=(speak_worker,), daemon=True)
+    speaker.start()
+    
+    def tokens():
+        splitter = SentenceSplitter()
+        try:
+            for token in stream_answer(components, question):
+                for sentence in splitter.feed(token):
+                    sentences.put(sentence)
+                yield token
+            for sentence in splitter.flush():
+                sentences.put(sentence)
+        finally:
+            sentences.put(None)
+    
+    answer = st.write_stream(tokens())
+    
+    with st.spinner("正在播放語音..."):
+        speaker.join()
+    if local_failed.is_set():
+        speak_answer(components, answer, force_online=True)
+    return answer
+
+# 使用本地 TTS 引擎朗讀（不調用 Streamlit，可在後台線程中使用）
+def run_local_tts(text):
+    """交給常駐的 TTS 工作進程朗讀，返回 (是否成功, 錯誤訊息)"""
+    worker = get_tts_worker()
+    with tracer.span("speak", engine="pyttsx3", chars=len(text)):
+        ok = worker.speak(text)
+    return ok, "" if ok else (worker.last_error or "朗讀未完成")
+
+# 語音合成並播放
+def speak_answer(components, text, force_online=False):
+    # 檢測語言，混合多種語言時按字符最多的語言朗讀
+    lang = majority_language(script_counts(text))
     st.info(f"檢測到語言: {lang}")
     
     # 顯示處理訊息
@@ -121,7 +263,7 @@ def speak_answer(components, text):
     status_msg.info("正在生成語音...")
     
     # 日文和韓文使用在線服務
-    if lang in ['ja', 'ko']:
+    if force_online or lang in ['ja', 'ko']:
         use_online_tts = True
     else:
         use_online_tts = False
@@ -131,81 +273,11 @@ def speak_answer(components, text):
         try:
             status_msg.info("使用本地語音引擎...")
             
-            # 創建一個獨立的 Python 腳本來運行 TTS
-            with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.py', encoding='utf-8') as script_file:
-                script_path = script_file.name
-                script_file.write("""# -*- coding: utf-8 -*-
-import sys
-import pyttsx3
-import os
-
-def speak_text(text_file_path):
-    try:
-        # 讀取文本文件
-        with open(text_file_path, 'r', encoding='utf-8') as f:
-            text = f.read().strip()
-            
-        engine = pyttsx3.init()
-        engine.setProperty('rate', 180)
-        engine.setProperty('volume', 0.9)
-        
-        # 嘗試設置中文語音
-        try:
-            voices = engine.getProperty('voices')
-            for voice in voices:
-                if "chinese" in voice.name.lower() or "zh" in voice.id.lower():
-                    engine.setProperty('voice', voice.id)
-                    break
-        except Exception as e:
-            print(f"設置語音失敗: {str(e)}")
-        
-        # 播放語音
-        engine.say(text)
-        engine.runAndWait()
-        
-        # 釋放資源
-        engine.stop()
-        
-        print("TTS播放完成")
-        return True
-    except Exception as e:
-        print(f"TTS錯誤: {str(e)}")
-        return False
-
-if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        text_file_path = sys.argv[1]
-        speak_text(text_file_path)
-""")
-            
-            # 創建文本臨時文件
-            with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.txt', encoding='utf-8') as text_file:
-                text_file_path = text_file.name
-                text_file.write(text)
-            
-            # 執行腳本(使用子進程而非線程)
             status_msg.info("正在播放語音...")
-            
-            # 使用子進程執行腳本，傳遞文本文件路徑
-            process = subprocess.Popen(
-                [sys.executable, script_path, text_file_path],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-            
-            # 等待進程完成
-            stdout, stderr = process.communicate(timeout=30)
-            
-            # 刪除臨時文件
-            try:
-                os.unlink(script_path)
-                os.unlink(text_file_path)
-            except Exception as e:
-                print(f"刪除臨時文件失敗: {str(e)}")
+            ok, stderr = run_local_tts(text)
             
             # 檢查執行結果
-            if process.returncode == 0 and "TTS播放完成" in stdout:
+            if ok:
                 status_msg.success("本地語音播放完成")
                 return
             else:
@@ -221,13 +293,6 @@ if __name__ == "__main__":
         try:
             status_msg.info("使用在線語音服務...")
             
-            # 創建臨時文件
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as temp_file:
-                temp_path = temp_file.name
-                
-            # 生成語音
-            from gtts import gTTS
-            
             # 對於中文，使用zh-TW標記
             if lang == 'zh-tw':
                 tts_lang = 'zh-TW'
@@ -240,43 +305,42 @@ if __name__ == "__main__":
             # 其他語言（包括英語）
             else:
                 tts_lang = 'en'
-                
-            tts = gTTS(text=text, lang=tts_lang, slow=False)
-            tts.save(temp_path)
             
-            # 顯示音頻播放器
-            st.audio(temp_path, format="audio/mp3")
-            status_msg.success("語音生成成功！請點擊上方播放按鈕收聽。")
+            # 從語音緩存中取得語音，重播和相同的答案無需再次合成
+            speech_path = components["voice_qa"].synthesize_speech(text, tts_lang)
+            if speech_path is None:
+                raise RuntimeError("gTTS 語音合成失敗")
             
-            # 刪除臨時文件（延遲刪除）
-            import threading
-            def delete_file_later():
-                import time
-                time.sleep(10)  # 等待 10 秒再刪除
-                try:
-                    os.unlink(temp_path)
-                    print(f"臨時文件已刪除: {temp_path}")
-                except Exception as e:
-                    print(f"刪除臨時文件失敗: {str(e)}")
-                    
-            threading.Thread(target=delete_file_later).start()
+            # 顯示音頻播放器（緩存文件由語音緩存按大小淘汰，無需刪除）
+            st.audio(speech_path, format="audio/mp3")
+            status_msg.success("語音生成成功！請點擊上方播放按鈕收聽。")
             
         except Exception as e:
             status_msg.error(f"所有語音生成方法均失敗: {str(e)}")
             st.exception(e)
 
 # 錄製音頻
-def record_audio(duration=5, fs=16000):
+def record_audio(components, duration=5):
+    """錄製 16kHz 單聲道 float32 音頻，返回 (音頻數據, 後台保存的文件路徑)"""
+    voice_qa = components["voice_qa"]
     st.write("正在錄音...")
-    recording = sd.rec(int(duration * fs), samplerate=fs, channels=1)
-    sd.wait()
+    audio = voice_qa.record_question_audio(duration)
     st.write("錄音完成!")
     
-    timestamp = time.strftime("%Y%m%d_%H%M%S")
-    audio_path = os.path.join(VOICE_QUESTIONS_DIR, f"question_{timestamp}.wav")
-    sf.write(audio_path, recording, fs)
+    # 錄音文件在後台寫入，不阻塞轉錄
+    audio_path = voice_qa.save_recording(audio) if voice_qa.save_recordings else None
+    
+    return audio, audio_path
+
+# 錄音直到說話結束，並同時轉錄
+def listen_and_transcribe(components, max_seconds=30):
+    """返回 (轉錄的問題, 後台保存的文件路徑)"""
+    voice_qa = components["voice_qa"]
+    with st.spinner("正在聆聽，說完後稍停片刻即可..."):
+        content, audio = voice_qa.listen_question(max_seconds)
     
-    return audio_path
+    audio_path = voice_qa.save_recording(audio) if voice_qa.save_recordings and len(audio) else None
+    return content, audio_path
 
 # 主應用程序
 def main():
@@ -285,9 +349,9 @@ def main():
     # 確保 TTS 環境正確
     ensure_tts_environment()
     
-    # 加載組件
-    with st.spinner("正在加載模型和組件..."):
-        components = load_components()
+    # 組件在第一次使用時才創建，不阻塞頁面顯示
+    components = load_components()
+    setup_tracing()
     
     # 檢查 TTS 設定
     check_tts_status(components)
@@ -299,30 +363,27 @@ def main():
     with tab1:
         st.header("上傳課程音檔")
         
-        uploaded_file = st.file_uploader("選擇音檔文件", type=["mp3", "wav", "m4a", "ogg"], help="上傳音檔文件，支持多種格式")
+        uploaded_files = st.file_uploader(
+            "選擇音檔文件", type=["mp3", "wav", "m4a", "ogg"],
+            accept_multiple_files=True, help="上傳音檔文件，支持多種格式，可同時上傳多個"
+        )
         
-        if uploaded_file is not None:
+        if uploaded_files:
             # 顯示音頻播放器
-            st.audio(uploaded_file, format="audio/wav")
+            for uploaded_file in uploaded_files:
+                st.audio(uploaded_file, format="audio/wav")
             
-            # 處理按鈕
+            # 處理按鈕：音檔加入後台隊列，處理期間可以繼續使用問答
             if st.button("處理音檔", type="primary"):
-                with st.spinner("正在處理音檔..."):
-                    # 保存上傳的文件到臨時文件
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{uploaded_file.name.split('.')[-1]}") as tmp_file:
-                        tmp_file.write(uploaded_file.getvalue())
-                        audio_path = tmp_file.name
-                    
-                    # 處理音頻文件
-                    success, message = process_audio_file(components, audio_path)
-                    
-                    # 刪除臨時文件
-                    os.unlink(audio_path)
-                    
-                    if success:
-                        st.success(message)
-                    else:
-                        st.error(message)
+                for uploaded_file in uploaded_files:
+                    components["ingest_service"].submit(uploaded_file.name, uploaded_file.getvalue())
+                st.success(f"已將 {len(uploaded_files)} 個音檔加入處理隊列")
+        
+        st.subheader("處理進度")
+        if _fragment is None:
+            # 不支持局部刷新的 Streamlit 版本，點擊按鈕重新載入進度
+            st.button("重新整理進度")
+        render_ingest_jobs(components)
     
     # 選項卡2：語音問答
     with tab2:
@@ -343,12 +404,9 @@ def main():
                 if 'current_answer' not in st.session_state:
                     st.session_state.current_answer = ""
                     
-                with st.spinner("正在思考..."):
-                    answer = answer_question(components, question)
-                    st.session_state.current_answer = answer
-                    
                 st.write("### 答案")
-                st.write(answer)
+                answer = st.write_stream(stream_answer(components, question))
+                st.session_state.current_answer = answer
                 
                 # 顯示朗讀按鈕
                 with col2:
@@ -372,38 +430,43 @@ def main():
             col1, col2 = st.columns(2)
             
             with col1:
-                duration = st.slider("錄音時長（秒）", min_value=3, max_value=30, value=5)
+                use_vad = st.checkbox("說完自動停止錄音", value=True, help="偵測到說話結束後立即停止錄音並開始回答")
+                if use_vad:
+                    duration = st.slider("最長錄音時間（秒）", min_value=3, max_value=60, value=30)
+                else:
+                    duration = st.slider("錄音時長（秒）", min_value=3, max_value=30, value=5)
                 
             with col2:
                 record_button = st.button("開始錄音", type="primary")
                 
             if record_button:
-                # 保存錄音狀態到 session_state
-                st.session_state.recording_done = True
-                st.session_state.recording_path = record_audio(duration)
-                
-                # 轉錄問題
-                with st.spinner("正在轉錄您的問題..."):
-                    content, _ = components["audio_processor"].transcribe(st.session_state.recording_path)
-                    st.session_state.question_content = content
-                    
-                if content:
-                    st.write("### 您的問題")
-                    st.write(content)
+                # 錄音、轉錄、回答和朗讀的耗時記錄在同一次追蹤中
+                with tracer.span("ask_question", vad=use_vad):
+                    # 保存錄音狀態到 session_state
+                    st.session_state.recording_done = True
+                    if use_vad:
+                        # 邊錄音邊轉錄，說話結束時只需轉錄最後一段
+                        content, st.session_state.recording_path = listen_and_transcribe(components, duration)
+                        st.session_state.question_content = content
+                    else:
+                        audio, st.session_state.recording_path = record_audio(components, duration)
                     
-                    # 獲取答案
-                    with st.spinner("正在思考..."):
-                        answer = answer_question(components, content)
-                        st.session_state.voice_answer = answer
+                        # 轉錄問題（直接使用內存中的音頻，無需臨時文件和 ffmpeg）
+                        with st.spinner("正在轉錄您的問題..."):
+                            content = components["voice_qa"].transcribe_question(audio)
+                            st.session_state.question_content = content
                     
-                    st.write("### 答案")
-                    st.write(answer)
+                    if content:
+                        st.write("### 您的問題")
+                        st.write(content)
                     
-                    # 自動朗讀答案
-                    speak_answer(components, answer)
-                else:
-                    st.error("無法識別您的問題，請重試。")
-                    st.session_state.recording_done = False
+                        # 流式獲取答案，並在第一句完成後就開始朗讀
+                        st.write("### 答案")
+                        answer = stream_and_speak_answer(components, content)
+                        st.session_state.voice_answer = answer
+                    else:
+                        st.error("無法識別您的問題，請重試。")
+                        st.session_state.recording_done = False
             
             # 如果已經錄音並有答案，但頁面重新加載
             elif 'recording_done' in st.session_state and st.session_state.recording_done:
@@ -418,6 +481,66 @@ def main():
                     # 添加重新播放按鈕
                     if st.button("重新朗讀答案"):
                         speak_answer(components, st.session_state.voice_answer)
+    
+    # 頁面顯示後在後台恢復未完成的處理任務，並預先加載問答所需的組件，首次提問無需等待
+    components.warm_up(["ingest_service", "qa_chain"])
+    if "first_render" not in st.session_state:
+        st.session_state.first_render = True
+        profiler.record("app", "first_render", time.perf_counter() - profiler.started)
+    render_startup_profile(components)
+    render_latency_panel()
+
+# 顯示各組件的導入和初始化耗時
+def render_startup_profile(components):
+    with st.sidebar.expander("啟動耗時", expanded=False):
+        rows = profiler.summary()
+        st.dataframe(rows, hide_index=True, use_container_width=True)
+        pending = [name for name in COMPONENT_FACTORIES if not components.is_loaded(name)]
+        if pending:
+            st.caption(f"尚未加載：{', '.join(pending)}")
+
+# 顯示問答各階段的耗時分佈和最近一次提問的耗時明細
+def render_latency_panel():
+    with st.sidebar.expander("延遲診斷", expanded=False):
+        stats = tracer.stats()
+        if not stats:
+            st.caption("尚未記錄任何提問")
+            return
+        
+        rows = [
+            {
+                "階段": TRACE_STAGES.get(name, name),
+                "次數": stat["count"],
+                "p50 (ms)": round(stat["p50"] * 1000, 1),
+                "p95 (ms)": round(stat["p95"] * 1000, 1),
+                "p99 (ms)": round(stat["p99"] * 1000, 1),
+                "最大 (ms)": round(stat["max"] * 1000, 1),
+                "合計 (s)": round(stat["total"], 2),
+                "失敗": stat["errors"]
+            }
+            for name, stat in sorted(stats.items(), key=lambda item: item[1]["total"], reverse=True)
+        ]
+        st.dataframe(rows, hide_index=True, use_container_width=True)
+        
+        traces = tracer.recent_traces(1)
+        if traces:
+            st.write("最近一次提問")
+            spans = traces[0]
+            started = spans[0]["start"]
+            st.dataframe([
+                {
+                    "階段": TRACE_STAGES.get(span["name"], span["name"]),
+                    "開始 (ms)": round((span["start"] - started) * 1000, 1),
+                    "耗時 (ms)": round(span["duration"] * 1000, 1),
+                    "失敗": span["error"] or ""
+                }
+                for span in spans
+            ], hide_index=True, use_container_width=True)
+        
+        exports = [f"記錄文件：{TRACE_LOG}"]
+        if METRICS_PORT:
+            exports.append(f"指標端點：http://127.0.0.1:{METRICS_PORT}/metrics")
+        st.caption("；".join(exports))
 
 # 檢查 TTS 設定
 def check_tts_status(components):
@@ -430,35 +553,30 @@ def check_tts_status(components):
     with st.expander("語音合成資訊", expanded=False):
         st.write("### 語音合成系統狀態")
         
-        # 檢查本地引擎
-        try:
-            import pyttsx3
-            engine = pyttsx3.init()
+        # 檢查本地引擎（由常駐的 TTS 工作進程報告，不在此重新初始化，也不等待其啟動完成）
+        worker = get_tts_worker()
+        health = worker.health()
+        if not health["ready"] and health["alive"] and not health["last_error"]:
+            st.info("⏳ 本地 TTS 引擎正在啟動，重新整理頁面後可查看狀態")
+            # 引擎就緒後再檢查一次
+            return
+        if health["ready"]:
+            voice_names = health["voices"]
             
-            try:
-                voices = engine.getProperty('voices')
-                voice_names = [v.name for v in voices if v.name]
-                
-                st.success("✅ 本地 TTS 引擎可用")
-                st.write(f"平台: {system}")
-                st.write(f"語音引擎: pyttsx3 (基於 {engine.proxy._name if hasattr(engine, 'proxy') and hasattr(engine.proxy, '_name') else '未知'})")
-                st.write(f"發現 {len(voices)} 個語音")
-                
-                if voice_names:
-                    with st.expander("可用語音列表"):
-                        for i, name in enumerate(voice_names):
-                            st.write(f"{i+1}. {name}")
-                
-                # 清理資源
-                engine.stop()
-                del engine
-                
-                st.info("系統會優先使用本地 TTS 引擎，僅在特定語言（如日文、韓文）或本地引擎失敗時才使用在線服務")
-            except Exception as e:
-                st.warning(f"本地 TTS 引擎初始化成功，但無法獲取語音列表: {str(e)}")
-                st.info("將使用在線語音服務作為備選")
-        except Exception as e:
-            st.error(f"❌ 本地 TTS 引擎不可用: {str(e)}")
+            st.success("✅ 本地 TTS 引擎可用")
+            st.write(f"平台: {system}")
+            st.write(f"語音引擎: pyttsx3 (基於 {health['driver'] or '未知'})")
+            st.write(f"工作進程: PID {health['pid']}，使用語音 {health['voice'] or '預設語音'}")
+            st.write(f"發現 {len(voice_names)} 個語音")
+            
+            if voice_names:
+                with st.expander("可用語音列表"):
+                    for i, name in enumerate(voice_names):
+                        st.write(f"{i+1}. {name}")
+            
+            st.info("系統會優先使用本地 TTS 引擎，僅在特定語言（如日文、韓文）或本地引擎失敗時才使用在線服務")
+        else:
+            st.error(f"❌ 本地 TTS 引擎不可用: {health['last_error']}")
             st.info("將完全使用在線語音服務")
         
         # 在線服務資訊
@@ -472,34 +590,24 @@ def check_tts_status(components):
 
 # 重置 TTS 引擎
 def reset_tts_engine():
-    """強制重置 pyttsx3 引擎，解決重複使用問題"""
+    """啟動常駐的 TTS 工作進程，進程退出時由 get_tts_worker 註冊的處理函數關閉"""
     try:
-        import pyttsx3
-        import atexit
-        
         if 'tts_engine_initialized' not in st.session_state:
-            # 清理任何可能存在的 pyttsx3 引擎實例
-            try:
-                engine = pyttsx3.init()
-                engine.stop()
-                del engine
-            except:
-                pass
-            
-            # 註冊退出時的清理函數
-            def cleanup_tts():
-                try:
-                    engine = pyttsx3.init()
-                    engine.stop()
-                    del engine
-                    print("TTS 引擎已清理")
-                except:
-                    pass
+            worker = get_tts_worker()
+            # 取消上一次會話遺留的朗讀
+            worker.cancel()
             
-            atexit.register(cleanup_tts)
+            # pyttsx3 引擎的初始化較慢，在後台線程中等待，不阻塞頁面顯示
+            def start_worker():
+                with profiler.measure("tts_worker", "init"):
+                    started = worker.start()
+                if started:
+                    print("TTS 引擎重置成功")
+                else:
+                    print(f"TTS 工作進程啟動失敗: {worker.last_error}")
             
+            threading.Thread(target=start_worker, name="tts-start", daemon=True).start()
             st.session_state.tts_engine_initialized = True
-            print("TTS 引擎重置成功")
     except Exception as e:
         print(f"重置 TTS 引擎失敗: {str(e)}")
 
@@ -510,9 +618,10 @@ def ensure_tts_environment():
         # 重置 TTS 引擎
         reset_tts_engine()
         
-        # 在 Windows 上進行額外檢查
+        # 在 Windows 上進行額外檢查（每個會話只檢查一次，頁面重新運行時不再重複）
         import platform
-        if platform.system() == 'Windows':
+        if platform.system() == 'Windows' and 'sapi_checked' not in st.session_state:
+            st.session_state.sapi_checked = True
             try:
                 # 檢查 Windows 的 SAPI 可用性
                 import win32com.client
@@ -1,84 +1,172 @@
 from pathlib import Path
+from functools import cached_property
 import argparse
-from modules.audio_processor import AudioProcessor
-from modules.text_processor import TextProcessor
-from modules.vector_store import VectorStore
-from modules.llm_processor import LLMProcessor
-from modules.voice_qa import VoiceQA
+import asyncio
+from typing import AsyncIterator, Iterator
+from modules.chunk_index import span_metadata
+from modules.startup_profile import profiler
+from modules.tracing import tracer
 
 class AudioQASystem:
-    def __init__(self, output_dir: str, vector_store_dir: str, use_local_tts: bool = True):
-        """初始化音頻問答系統"""
-        self.audio_processor = AudioProcessor(output_dir)
-        self.text_processor = TextProcessor()
-        self.vector_store = VectorStore(vector_store_dir)
-        self.llm_processor = LLMProcessor()
-        self.voice_qa = VoiceQA(use_local_tts=use_local_tts)
-        
-        # 創建問答鏈
-        self.qa_chain = self.llm_processor.create_qa_chain(
-            self.vector_store.as_retriever(
-                search_type="similarity",
-                search_kwargs={"k": 3}
-            )
+    def __init__(self, output_dir: str, vector_store_dir: str, use_local_tts: bool = True,
+                 vector_backend: str = "chroma", faiss_index_type: str = "flat", search_type: str = "hybrid",
+                 context_tokens: int = 3000):
+        """
+        初始化音頻問答系統
+
+        各組件在第一次使用時才導入和創建，例如處理已轉錄過的音頻時不會加載 Whisper，
+        只處理音頻時也不會加載 LLM 和語音組件。
+        """
+        self.output_dir = output_dir
+        self.vector_store_dir = vector_store_dir
+        self.use_local_tts = use_local_tts
+        self.vector_backend = vector_backend
+        self.faiss_index_type = faiss_index_type
+        self.search_type = search_type
+        self.context_tokens = context_tokens
+    
+    @staticmethod
+    def _create(component: str, module_name: str, class_name: str, *args, **kwargs):
+        """導入並創建組件，記錄導入和初始化耗時"""
+        module = profiler.import_module(component, module_name)
+        with profiler.measure(component, "init"):
+            return getattr(module, class_name)(*args, **kwargs)
+    
+    @cached_property
+    def audio_processor(self):
+        return self._create("audio_processor", "modules.audio_processor", "AudioProcessor", self.output_dir)
+    
+    @cached_property
+    def text_processor(self):
+        return self._create("text_processor", "modules.text_processor", "TextProcessor")
+    
+    @cached_property
+    def vector_store(self):
+        backend_options = {"index_type": self.faiss_index_type} if self.vector_backend == "faiss" else {}
+        return self._create(
+            "vector_store", "modules.vector_store", "VectorStore", self.vector_store_dir,
+            backend=self.vector_backend, search_type=self.search_type, **backend_options
         )
     
+    @cached_property
+    def llm_processor(self):
+        return self._create("llm_processor", "modules.llm_processor", "LLMProcessor", context_tokens=self.context_tokens)
+    
+    @cached_property
+    def voice_qa(self):
+        return self._create("voice_qa", "modules.voice_qa", "VoiceQA", use_local_tts=self.use_local_tts)
+    
+    @cached_property
+    def answer_cache(self):
+        return self._create("answer_cache", "modules.answer_cache", "AnswerCache", str(Path(self.output_dir) / "answer_cache.json"))
+    
+    @cached_property
+    def qa_chain(self):
+        """問答鏈"""
+        with profiler.measure("qa_chain", "init"):
+            return self.llm_processor.create_qa_chain(
+                self.vector_store.as_retriever(
+                    search_type=self.search_type,
+                    search_kwargs={"k": 3}
+                )
+            )
+    
     def process_audio(self, audio_path: str) -> bool:
-        """處理音頻文件"""
-        # 轉錄音頻
-        content, output_path = self.audio_processor.transcribe(audio_path)
-        if not content or not output_path:
-            return False
-            
-        # 清理文本
-        cleaned_content = self.text_processor.clean_text(content)
+        """
+        處理音頻文件
         
-        # 分塊處理
-        chunks = self.text_processor.split_text(cleaned_content)
+        轉錄片段邊生成邊清理、分塊並分批加入向量存儲，
+        長音頻的前面部分在整段轉錄完成前就可以檢索。
+        """
+        # 同一音頻已經轉錄並索引過時直接跳過
+        cached = self.audio_processor.cached_result(audio_path)
+        if cached and self.vector_store.has_documents(cached["chunk_ids"]):
+            print(f"音頻已處理過，使用已有的轉錄結果：{cached['transcript_path']}")
+            return True
         
-        # 添加每個塊到向量存儲
-        success = True
-        for chunk in chunks:
+        try:
+            # 流式轉錄
+            output_path, segments = self.audio_processor.transcribe_stream(audio_path)
+            
+            # 清理並分塊，每塊記錄其在音頻中的起止時間
+            chunks = self.text_processor.iter_timed_chunks(segments)
+            
+            # 分批添加到向量存儲
             metadata = {
                 "source": str(output_path),
                 "timestamp": output_path.stem.split("_")[-1]
             }
-            if not self.vector_store.add_content(chunk, metadata):
-                success = False
-                break
+            lecture_id = self.audio_processor.lecture_id(audio_path)
+            doc_ids = []
+            for batch_ids in self.vector_store.add_stream(
+                (chunk["text"], span_metadata(metadata, lecture_id, chunk["start"], chunk["end"]))
+                for chunk in chunks
+            ):
+                doc_ids.extend(batch_ids)
+                print(f"已索引 {len(doc_ids)} 個文本塊")
+        except Exception as e:
+            print(f"處理音頻失敗：{str(e)}")
+            return False
+        
+        if not doc_ids or not all(doc_ids):
+            return False
         
-        return success
+        self.audio_processor.remember_chunk_ids(audio_path, doc_ids)
+        return True
     
     def answer_question(self, question: str) -> str:
         """回答問題"""
         try:
-            result = self.qa_chain({"query": question})
+            result = self.llm_processor.answer_with_cache(
+                self.qa_chain, self.vector_store, question, self.answer_cache
+            )
             return result["result"]
         except Exception as e:
             print(f"問答失敗：{str(e)}")
             return "抱歉，我無法回答這個問題。"
+    
+    def stream_answer(self, question: str) -> Iterator[str]:
+        """以流式方式回答問題，逐段返回答案文本"""
+        try:
+            yield from self.llm_processor.stream_answer(
+                self.qa_chain, self.vector_store, question, self.answer_cache
+            )
+        except Exception as e:
+            print(f"問答失敗：{str(e)}")
+            yield "抱歉，我無法回答這個問題。"
             
-    def voice_qa_loop(self):
-        """語音問答循環"""
+    async def astream_answer(self, question: str) -> AsyncIterator[str]:
+        """stream_answer 的協程版本，供異步語音問答管線使用"""
+        try:
+            async for token in self.llm_processor.astream_answer(
+                self.qa_chain, self.vector_store, question, self.answer_cache
+            ):
+                yield token
+        except Exception as e:
+            print(f"問答失敗：{str(e)}")
+            yield "抱歉，我無法回答這個問題。"
+            
+    def voice_qa_loop(self, barge_in: bool = False):
+        """語音問答循環：持續收音，barge_in 為 True 時播放答案時大聲開口可打斷"""
         print("\n歡迎使用語音問答系統！")
-        print("你可以用語音問問題，輸入 'q' 退出程序。")
+        if barge_in:
+            print("你可以用語音問問題，播放答案時大聲開口即可打斷，按 Ctrl+C 退出程序。")
+        else:
+            print("你可以用語音問問題，答案播放完後再提出下一個問題，按 Ctrl+C 退出程序。")
         
-        while True:
-            try:
-                # 錄音並獲取答案
-                answer = self.voice_qa.ask_question(self)
-                
-                # 詢問是否繼續
-                choice = input("\n要繼續問問題嗎？(y/n): ").strip().lower()
-                if choice != 'y':
-                    break
-                    
-            except KeyboardInterrupt:
-                print("\n程序已停止")
-                break
-            except Exception as e:
-                print(f"發生錯誤：{str(e)}")
-                break
+        # 進入問答循環前創建問答所需的組件，避免第一個問題在事件循環中等待加載
+        self.qa_chain
+        self.answer_cache
+        
+        from modules.voice_pipeline import VoicePipeline
+        pipeline = VoicePipeline(self.voice_qa, self, barge_in=barge_in)
+        try:
+            asyncio.run(pipeline.run())
+        except KeyboardInterrupt:
+            pipeline.stop()
+            print("\n程序已停止")
+        except Exception as e:
+            print(f"發生錯誤：{str(e)}")
 
 def main():
     parser = argparse.ArgumentParser(description="音頻問答系統")
@@ -86,18 +174,42 @@ def main():
     parser.add_argument("--output-dir", default="transcribed_data", help="輸出目錄")
     parser.add_argument("--vector-store-dir", default="vector_store", help="向量存儲目錄")
     parser.add_argument("--use-online-tts", action="store_true", help="使用在線TTS服務(gTTS)而非本地TTS")
+    parser.add_argument("--vector-backend", choices=["chroma", "faiss"], default="chroma", help="向量存儲後端")
+    parser.add_argument("--faiss-index-type", choices=["flat", "ivf", "hnsw"], default="flat", help="FAISS 索引類型")
+    parser.add_argument("--search-type", choices=["hybrid", "similarity"], default="hybrid",
+                        help="檢索方式：hybrid 結合關鍵詞和向量檢索，similarity 只使用向量檢索")
+    parser.add_argument("--context-tokens", type=int, default=3000, help="每次提問發送給 LLM 的參考內容的 token 預算")
+    parser.add_argument("--barge-in", action="store_true",
+                        help="播放答案時大聲開始說話可打斷播放（默認播放期間不收音，避免外放的答案觸發打斷）")
+    parser.add_argument("--profile-startup", action="store_true", help="處理音頻後輸出各組件的導入和初始化耗時")
+    parser.add_argument("--trace-log", default=None, help="各階段耗時的 JSONL 記錄文件，默認為輸出目錄下的 traces.jsonl")
+    parser.add_argument("--metrics-port", type=int, default=None, help="啟動 Prometheus 指標端點的端口，默認不啟動")
     args = parser.parse_args()
     
+    tracer.configure(args.trace_log or str(Path(args.output_dir) / "traces.jsonl"))
+    if args.metrics_port:
+        tracer.serve(args.metrics_port)
+    
     # 初始化系統
-    qa_system = AudioQASystem(args.output_dir, args.vector_store_dir, use_local_tts=not args.use_online_tts)
+    qa_system = AudioQASystem(
+        args.output_dir, args.vector_store_dir,
+        use_local_tts=not args.use_online_tts,
+        vector_backend=args.vector_backend,
+        faiss_index_type=args.faiss_index_type,
+        search_type=args.search_type,
+        context_tokens=args.context_tokens
+    )
     
     # 處理音頻
     print(f"正在處理音頻文件：{args.audio_path}")
     if qa_system.process_audio(args.audio_path):
         print("音頻處理完成")
+        if args.profile_startup:
+            print(profiler.report())
         
-        # 開始語音問答循環
-        qa_system.voice_qa_loop()
+        # 開始語音問答循環，結束後輸出各階段的耗時
+        qa_system.voice_qa_loop(barge_in=args.barge_in)
+        print(tracer.report())
     else:
         print("音頻處理失敗")
 
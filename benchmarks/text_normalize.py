@@ -0,0 +1,63 @@
+"""
+modules.text_normalize 與原先逐個字符掃描和逐個 re.sub 的實現的比較
+
+原實現同時作為 tests/test_text_normalize.py 中結果一致性的參照。
+"""
+import re
+import timeit
+from modules.text_normalize import clean_text, detect_language, language_from_counts, script_counts
+
+def legacy_clean_text(text: str) -> str:
+    """TextProcessor.clean_text 原先的實現"""
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'[^\w\s\u4e00-\u9fff。，！？、]', '', text)
+    return text.strip()
+
+def legacy_detect_language(text: str) -> str:
+    """VoiceQA.detect_language 原先的實現"""
+    if any('\u3040' <= char <= '\u309F' for char in text) or any('\u30A0' <= char <= '\u30FF' for char in text):
+        return 'ja'
+    if any('\uac00' <= char <= '\ud7a3' for char in text) or any('\u1100' <= char <= '\u11ff' for char in text):
+        return 'ko'
+    if any('\u4e00' <= char <= '\u9fff' for char in text):
+        if any('\u3040' <= char <= '\u309F' for char in text) or any('\u30A0' <= char <= '\u30FF' for char in text):
+            return 'ja'
+        return 'zh-tw'
+    return 'en'
+
+SAMPLES = {
+    "zh": "今天我們學習了光合作用，植物利用陽光把二氧化碳和水變成葡萄糖和氧氣。 老師說：「這是生命的基礎！」",
+    "en": "Photosynthesis converts light energy into chemical energy (stored in glucose); plants release O2 as a by-product.",
+    "ja": "光合作用は、植物が光エネルギーを使って二酸化炭素と水からブドウ糖を作る過程です。",
+    "ko": "광합성은 식물이 빛 에너지를 이용해 이산화탄소와 물로 포도당을 만드는 과정입니다.",
+    "mixed": "DNA 複製（replication）是細胞分裂前的重要步驟 - see chapter 3!"
+}
+
+def benchmark(number: int = 2000, scale: int = 20):
+    """
+    比較新舊實現的耗時，並確認兩者的結果相同
+
+    在項目根目錄運行 python -m benchmarks.text_normalize
+
+    Args:
+        number: 每項測試的重複次數
+        scale: 清理文本時將樣本重複的次數，模擬整段轉錄
+    """
+    print(f"{'樣本':<8}{'函數':<20}{'原實現 (µs)':>14}{'新實現 (µs)':>14}{'加速':>8}")
+    for name, sample in SAMPLES.items():
+        transcript = " ".join([sample] * scale)
+        cases = [
+            ("clean_text", legacy_clean_text, clean_text, transcript),
+            ("detect_language", legacy_detect_language, detect_language, sample),
+            ("script_counts*", legacy_detect_language, lambda text: language_from_counts(script_counts(text)), sample),
+            ("script_counts* xN", legacy_detect_language, lambda text: language_from_counts(script_counts(text)), transcript)
+        ]
+        for label, legacy, current, text in cases:
+            assert legacy(text) == current(text), f"{label} 在樣本 {name} 上的結果不一致"
+            legacy_time = timeit.timeit(lambda: legacy(text), number=number) / number * 1e6
+            current_time = timeit.timeit(lambda: current(text), number=number) / number * 1e6
+            print(f"{name:<8}{label:<20}{legacy_time:>14.2f}{current_time:>14.2f}{legacy_time / current_time:>7.1f}x")
+    print(f"* 與原實現判斷語言比較，新實現同時得到各文字系統的字符數量；xN 為樣本重複 {scale} 次的整段轉錄")
+
+if __name__ == "__main__":
+    benchmark()
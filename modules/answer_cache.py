@@ -0,0 +1,200 @@
+from pathlib import Path
+from collections import OrderedDict
+import atexit
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import weakref
+from typing import Any, Dict, List, Optional
+import numpy as np
+
+# 仍在使用的緩存，進程退出時保存其尚未寫入的修改
+_open_caches: "weakref.WeakSet[AnswerCache]" = weakref.WeakSet()
+
+@atexit.register
+def _flush_open_caches():
+    for cache in list(_open_caches):
+        cache.flush()
+
+class AnswerCache:
+    def __init__(
+        self,
+        cache_path: str,
+        similarity_threshold: float = 0.95,
+        ttl: Optional[float] = 24 * 3600,
+        max_entries: int = 500,
+        save_delay: float = 2.0
+    ):
+        """
+        初始化問答緩存
+
+        緩存鍵包含檢索到的文檔ID，向量存儲內容變化導致檢索結果不同時舊答案自然失效。
+        相同文檔下，問題完全相同或問題向量的餘弦相似度不低於閾值時視為命中。
+
+        Args:
+            cache_path: 緩存文件路徑，重啟後從該文件恢復
+            similarity_threshold: 語義命中的最低餘弦相似度
+            ttl: 答案的有效秒數，None 表示永不過期
+            max_entries: 最多保留的答案數量，超出時淘汰最近最少使用的答案
+            save_delay: 寫入後延遲多少秒在後台保存，期間的多次寫入合併為一次；
+                        flush 立即保存，進程退出時自動 flush
+        """
+        self.cache_path = Path(cache_path)
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.save_delay = save_delay
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._save_timer: Optional[threading.Timer] = None
+        self._dirty = False
+        self._load()
+        # 有未保存的修改時後台保存的定時器持有實例，不再使用的實例可以被回收而不丟失修改
+        _open_caches.add(self)
+
+    @staticmethod
+    def normalize_question(question: str) -> str:
+        """統一大小寫、空白和句末標點，讓寫法略有不同的相同問題得到相同的鍵"""
+        question = re.sub(r'\s+', ' ', question).strip().lower()
+        return question.rstrip("?？。.!！ ")
+
+    @staticmethod
+    def _chunk_signature(chunk_ids: List[str]) -> str:
+        return "|".join(sorted(chunk_ids))
+
+    def _make_key(self, question: str, chunk_ids: List[str]) -> str:
+        raw = f"{self.normalize_question(question)}\x00{self._chunk_signature(chunk_ids)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _expired(self, entry: Dict[str, Any], now: float) -> bool:
+        return self.ttl is not None and now - entry["created"] > self.ttl
+
+    def lookup(self, question: str, embedding: Optional[List[float]], chunk_ids: List[str]) -> Optional[str]:
+        """
+        查找緩存的答案
+
+        Args:
+            question: 問題
+            embedding: 問題的向量，為 None 時只做精確匹配
+            chunk_ids: 該問題檢索到的文檔ID
+
+        Returns:
+            str: 命中的答案，未命中時為 None
+        """
+        now = time.time()
+        key = self._make_key(question, chunk_ids)
+        signature = self._chunk_signature(chunk_ids)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry, now):
+                del self._entries[key]
+                entry = None
+
+            if entry is None and embedding is not None:
+                query = np.asarray(embedding, dtype=np.float32)
+                norm = np.linalg.norm(query)
+                if norm > 0:
+                    query = query / norm
+                    best_score = self.similarity_threshold
+                    for candidate_key, candidate in self._entries.items():
+                        if candidate["signature"] != signature or self._expired(candidate, now):
+                            continue
+                        score = float(np.dot(query, candidate["vector"]))
+                        if score >= best_score:
+                            best_score = score
+                            key, entry = candidate_key, candidate
+
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry["answer"]
+
+    def store(self, question: str, embedding: Optional[List[float]], chunk_ids: List[str], answer: str):
+        """保存答案，磁盤寫入在後台延遲進行，不阻塞回答"""
+        vector = None
+        if embedding is not None:
+            vector = np.asarray(embedding, dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            vector = vector / norm if norm > 0 else None
+
+        with self._lock:
+            key = self._make_key(question, chunk_ids)
+            self._entries[key] = {
+                "question": question,
+                "signature": self._chunk_signature(chunk_ids),
+                "vector": vector,
+                "answer": answer,
+                "created": time.time()
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._schedule_save()
+
+    def clear(self):
+        """清空緩存"""
+        with self._lock:
+            self._entries.clear()
+            self._schedule_save()
+
+    def flush(self):
+        """立即將尚未保存的修改寫入磁盤"""
+        # 快照和寫入都在 _save_lock 內進行，較舊的快照不會覆蓋較新的文件
+        with self._save_lock:
+            with self._lock:
+                if self._save_timer is not None:
+                    self._save_timer.cancel()
+                    self._save_timer = None
+                if not self._dirty:
+                    return
+                self._dirty = False
+                snapshot = [(key, dict(entry)) for key, entry in self._entries.items()]
+            # 序列化和寫入不持有 self._lock，查詢和寫入緩存不必等待磁盤
+            self._save(snapshot)
+
+    def _schedule_save(self):
+        """標記有未保存的修改並安排後台保存（需持有 self._lock）"""
+        self._dirty = True
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(self.save_delay, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def _load(self):
+        """從磁盤恢復未過期的答案"""
+        if not self.cache_path.exists():
+            return
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            now = time.time()
+            for key, entry in data.items():
+                if entry.get("vector") is not None:
+                    entry["vector"] = np.asarray(entry["vector"], dtype=np.float32)
+                if not self._expired(entry, now):
+                    self._entries[key] = entry
+        except Exception as e:
+            print(f"讀取問答緩存失敗: {str(e)}")
+
+    def _save(self, snapshot):
+        """以臨時文件加替換的方式原子地寫入緩存快照"""
+        try:
+            data = OrderedDict()
+            for key, entry in snapshot:
+                if entry["vector"] is not None:
+                    entry["vector"] = [round(float(x), 6) for x in entry["vector"]]
+                data[key] = entry
+
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_path.parent, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.cache_path)
+        except Exception as e:
+            print(f"寫入問答緩存失敗: {str(e)}")
@@ -1,18 +1,125 @@
 from pathlib import Path
-import whisper
 import json
+import os
+import time
+import uuid
 from datetime import datetime
-from typing import Tuple, Optional
+from collections import Counter
+from typing import Tuple, Optional, Dict, Any, Iterator, List
+from modules.model_registry import ModelRegistry, get_whisper_model, use_whisper_model
+from modules.long_audio import SAMPLE_RATE, iter_transcribe, probe_duration, transcribe_parallel
+from modules.transcription_cache import TranscriptionCache
+from modules.tracing import tracer
 
 class AudioProcessor:
-    def __init__(self, output_dir: str):
-        """初始化音頻處理器"""
+    def __init__(
+        self,
+        output_dir: str,
+        model_name: str = "base",
+        device: Optional[str] = None,
+        compute_type: Optional[str] = None,
+        num_workers: Optional[int] = None,
+        long_audio_threshold: float = 600.0,
+        cache_dir: Optional[str] = None,
+        cache_max_bytes: int = 256 * 1024 * 1024
+    ):
+        """
+        初始化音頻處理器
+        
+        Args:
+            output_dir: 轉錄結果的輸出目錄
+            model_name: Whisper 模型名稱
+            device: 運行設備，默認自動選擇
+            compute_type: 計算精度，默認 CPU 為 float32、GPU 為 float16
+            num_workers: 長音頻模式的並行進程數，默認為 CPU 核心數，設為 1 則關閉長音頻模式
+            long_audio_threshold: 超過多少秒的音頻使用長音頻模式
+            cache_dir: 轉錄緩存目錄，默認為輸出目錄下的 .cache
+            cache_max_bytes: 轉錄緩存的最大磁盤佔用，包括緩存條目引用的轉錄文件和片段文件，淘汰條目時一起刪除
+        """
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
         
-        # 加載 Whisper 模型
-        print("正在加載 Whisper 模型...")
-        self.model = whisper.load_model("base")
+        # Whisper 模型由共享註冊表在首次轉錄時加載
+        self.model_name, self.device, self.compute_type = ModelRegistry.resolve_key(model_name, device, compute_type)
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.long_audio_threshold = long_audio_threshold
+        
+        # 以音頻內容為鍵的轉錄緩存，重複上傳同一音頻時無需再次轉錄
+        self.cache = TranscriptionCache(cache_dir or str(self.output_dir / ".cache"), cache_max_bytes)
+        self._cache_keys: Dict[Tuple[str, int, int], str] = {}
+    
+    @property
+    def model(self):
+        """共享的 Whisper 模型"""
+        return get_whisper_model(self.model_name, self.device, self.compute_type)
+    
+    def _run_whisper(self, audio_path: str) -> Dict[str, Any]:
+        """運行 Whisper，長音頻在 CPU 上切分為窗口並行轉錄"""
+        import whisper
+        # 先解碼再轉錄（transcribe 傳入路徑時內部同樣會解碼），分別記錄兩者的耗時
+        with tracer.span("decode", source="lecture"):
+            audio = whisper.load_audio(audio_path)
+        duration = len(audio) / SAMPLE_RATE
+        with tracer.span("whisper", source="lecture", model=self.model_name, audio_seconds=round(duration, 1)):
+            if self.num_workers > 1 and self.device == "cpu":
+                if duration > self.long_audio_threshold:
+                    return transcribe_parallel(
+                        audio, self.model_name, self.device, self.compute_type,
+                        num_workers=self.num_workers
+                    )
+                with use_whisper_model(self.model_name, self.device, self.compute_type) as model:
+                    return model.transcribe(audio, fp16=False)
+            with use_whisper_model(self.model_name, self.device, self.compute_type) as model:
+                return model.transcribe(audio, fp16=self.compute_type == "float16")
+    
+    def new_output_path(self) -> Path:
+        """
+        生成新的轉錄文件路徑
+
+        多個工作進程可能在同一秒內開始轉錄，時間戳後加上隨機後綴，避免互相覆蓋轉錄文件，
+        以及以文件路徑作為來源的文檔 ID 相同。
+        """
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        return self.output_dir / f"transcript_{timestamp}_{uuid.uuid4().hex[:8]}.txt"
+    
+    def cache_key(self, audio_path: str) -> str:
+        """計算音頻的緩存鍵，同一文件未修改時只計算一次哈希"""
+        stat = os.stat(audio_path)
+        file_id = (os.path.abspath(audio_path), stat.st_size, stat.st_mtime_ns)
+        key = self._cache_keys.get(file_id)
+        if key is None:
+            decode_options = {"compute_type": self.compute_type}
+            key = TranscriptionCache.make_key(audio_path, self.model_name, decode_options)
+            self._cache_keys[file_id] = key
+        return key
+    
+    def lecture_id(self, audio_path: str) -> str:
+        """講座ID，由音頻內容決定，重新上傳同一音頻時不變"""
+        return self.cache_key(audio_path)[:16]
+    
+    def cached_result(self, audio_path: str) -> Optional[Dict[str, Any]]:
+        """
+        查詢音頻是否已經轉錄並索引過
+        
+        Returns:
+            dict: 包含 transcript_path 和 chunk_ids 的緩存條目，未命中時為 None
+        """
+        try:
+            entry = self.cache.get(self.cache_key(audio_path))
+        except Exception as e:
+            print(f"查詢轉錄緩存失敗：{str(e)}")
+            return None
+        if not entry or not entry.get("chunk_ids"):
+            return None
+        return entry
+    
+    def remember_chunk_ids(self, audio_path: str, chunk_ids: List[str]) -> bool:
+        """記錄音頻轉錄內容在向量存儲中的文檔ID"""
+        try:
+            return self.cache.update(self.cache_key(audio_path), chunk_ids=chunk_ids)
+        except Exception as e:
+            print(f"更新轉錄緩存失敗：{str(e)}")
+            return False
     
     def transcribe(self, audio_path: str) -> Tuple[Optional[str], Optional[Path]]:
         """
@@ -25,21 +132,126 @@ class AudioProcessor:
             tuple: (轉錄內容, 輸出文件路徑)
         """
         try:
+            # 命中緩存時直接返回已有的轉錄結果
+            key = self.cache_key(audio_path)
+            entry = self.cache.get(key)
+            text = self._cached_text(entry) if entry else None
+            if text is not None:
+                output_path = Path(entry["transcript_path"])
+                print(f"使用緩存的轉錄結果：{output_path}")
+                return text, output_path
+            
             # 轉錄音頻
             print(f"正在轉錄音頻：{audio_path}")
-            result = self.model.transcribe(audio_path)
+            result = self._run_whisper(audio_path)
             
             # 生成輸出文件名
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_path = self.output_dir / f"transcript_{timestamp}.txt"
+            output_path = self.new_output_path()
             
             # 保存轉錄結果
             with open(output_path, "w", encoding="utf-8") as f:
                 f.write(result["text"])
             
+            self.cache.put(key, {
+                "text": result["text"],
+                "transcript_path": str(output_path),
+                "language": result.get("language", ""),
+                "chunk_ids": []
+            })
+            
             print(f"轉錄完成，結果已保存到：{output_path}")
             return result["text"], output_path
             
         except Exception as e:
             print(f"轉錄失敗：{str(e)}")
-            return None, None 
\ No newline at end of file
+            return None, None 
+    
+    def _cached_text(self, entry: Dict[str, Any]) -> Optional[str]:
+        """讀取緩存條目的轉錄文本；流式轉錄的條目只保存了轉錄文件路徑"""
+        output_path = Path(entry["transcript_path"])
+        if "text" in entry:
+            if not output_path.exists():
+                with open(output_path, "w", encoding="utf-8") as f:
+                    f.write(entry["text"])
+            return entry["text"]
+        if output_path.exists():
+            return output_path.read_text(encoding="utf-8")
+        return None
+    
+    def transcribe_stream(self, audio_path: str) -> Tuple[Path, Iterator[Dict[str, Any]]]:
+        """
+        流式轉錄音頻文件，Whisper 每轉錄完一個窗口就返回其中的片段
+        
+        音頻邊解碼邊轉錄，轉錄文本和片段邊轉錄邊寫入磁盤，內存佔用與音頻長度無關；
+        全部片段完成後才寫入轉錄緩存，命中緩存時直接讀取已保存的片段。
+        
+        Args:
+            audio_path: 音頻文件路徑
+            
+        Returns:
+            tuple: (轉錄文件路徑, 按時間順序返回片段的迭代器，片段包含 start、end（秒）和 text)
+        """
+        key = self.cache_key(audio_path)
+        entry = self.cache.get(key)
+        if entry:
+            segments_path = entry.get("segments_path")
+            if segments_path and Path(segments_path).exists():
+                print(f"使用緩存的轉錄結果：{entry['transcript_path']}")
+                return Path(entry["transcript_path"]), self._read_segments(segments_path)
+            text = self._cached_text(entry)
+            if text is not None:
+                # 舊版緩存沒有保存片段，整段文本作為一個沒有時間信息的片段
+                print(f"使用緩存的轉錄結果：{entry['transcript_path']}")
+                return Path(entry["transcript_path"]), iter([{"id": 0, "text": text}])
+        
+        output_path = self.new_output_path()
+        return output_path, self._stream_segments(audio_path, key, output_path)
+    
+    @staticmethod
+    def _read_segments(segments_path: str) -> Iterator[Dict[str, Any]]:
+        with open(segments_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    
+    def _stream_segments(self, audio_path: str, key: str, output_path: Path) -> Iterator[Dict[str, Any]]:
+        """轉錄並逐個返回片段，同時追加寫入轉錄文件和片段文件"""
+        segments_path = output_path.with_suffix(".segments.jsonl")
+        # 與 _run_whisper 相同，只有 CPU 上的長音頻才以多個進程並行轉錄後續窗口；
+        # 短音頻和無法讀取時長的音頻在當前進程中使用共享的模型轉錄
+        num_workers = 1
+        if self.num_workers > 1 and self.device == "cpu":
+            duration = probe_duration(audio_path)
+            if duration is not None and duration > self.long_audio_threshold:
+                num_workers = self.num_workers
+        languages = Counter()
+        
+        print(f"正在流式轉錄音頻：{audio_path}")
+        # 只累計等待轉錄結果的時間，不包括調用方處理片段的時間
+        busy = 0.0
+        count = 0
+        with open(output_path, "w", encoding="utf-8") as text_file, \
+             open(segments_path, "w", encoding="utf-8") as segments_file:
+            started = time.perf_counter()
+            for segment in iter_transcribe(audio_path, self.model_name, self.device, self.compute_type,
+                                           num_workers=num_workers):
+                busy += time.perf_counter() - started
+                count += 1
+                text_file.write(segment["text"])
+                segments_file.write(json.dumps(segment, ensure_ascii=False) + "\n")
+                text_file.flush()
+                segments_file.flush()
+                if segment.get("language"):
+                    languages[segment["language"]] += 1
+                yield segment
+                started = time.perf_counter()
+            busy += time.perf_counter() - started
+        tracer.record("whisper", busy, source="lecture_stream", model=self.model_name, segments=count)
+        
+        self.cache.put(key, {
+            "transcript_path": str(output_path),
+            "segments_path": str(segments_path),
+            "language": languages.most_common(1)[0][0] if languages else "",
+            "chunk_ids": []
+        })
+        print(f"轉錄完成，結果已保存到：{output_path}")
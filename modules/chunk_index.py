@@ -0,0 +1,125 @@
+from pathlib import Path
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional
+
+def span_metadata(metadata: Dict[str, Any], lecture_id: Optional[str], start: Optional[float], end: Optional[float]) -> Dict[str, Any]:
+    """
+    在文本塊的元數據中加入講座ID和音頻時間範圍
+
+    向量存儲的元數據不能包含 None，沒有時間信息的文本塊（如舊版緩存的整段轉錄）只記錄講座ID。
+    """
+    metadata = dict(metadata)
+    if lecture_id:
+        metadata["lecture_id"] = lecture_id
+    if start is not None and end is not None:
+        metadata["start"] = round(float(start), 2)
+        metadata["end"] = round(float(end), 2)
+    return metadata
+
+def span_filter(lecture_id: Optional[str] = None, start: Optional[float] = None, end: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """
+    生成按講座和時間範圍過濾文本塊的檢索條件（Chroma 的 where 格式）
+
+    Args:
+        lecture_id: 只檢索該講座的文本塊
+        start: 只檢索在此時間（秒）之後結束的文本塊
+        end: 只檢索在此時間（秒）之前開始的文本塊
+
+    Returns:
+        dict: 檢索條件，沒有任何條件時為 None
+    """
+    conditions = []
+    if lecture_id:
+        conditions.append({"lecture_id": lecture_id})
+    if start is not None:
+        conditions.append({"end": {"$gte": float(start)}})
+    if end is not None:
+        conditions.append({"start": {"$lte": float(end)}})
+    if not conditions:
+        return None
+    if len(conditions) == 1:
+        return conditions[0]
+    return {"$and": conditions}
+
+class ChunkIndex:
+    def __init__(self, db_path: str):
+        """
+        從講座的音頻時間到文本塊的索引
+
+        記錄每個文本塊所屬的講座及其在音頻中的起止時間，
+        可以直接查出某一時刻或某段時間對應的文本塊，無需掃描向量存儲。
+
+        Args:
+            db_path: 索引數據庫路徑
+        """
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS spans (
+                doc_id TEXT PRIMARY KEY,
+                lecture_id TEXT NOT NULL,
+                start REAL NOT NULL,
+                end REAL NOT NULL,
+                source TEXT
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS spans_lecture ON spans (lecture_id, start)")
+        self._conn.commit()
+
+    def add(self, doc_ids: List[str], metadatas: List[Dict[str, Any]]):
+        """記錄文本塊的時間範圍，沒有講座ID或時間的文本塊會被忽略"""
+        rows = [
+            (doc_id, metadata["lecture_id"], metadata["start"], metadata["end"], metadata.get("source"))
+            for doc_id, metadata in zip(doc_ids, metadatas)
+            if doc_id and metadata.get("lecture_id") and "start" in metadata and "end" in metadata
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO spans (doc_id, lecture_id, start, end, source) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+    def remove(self, doc_ids: List[str]):
+        """刪除文本塊的記錄"""
+        with self._lock:
+            # SQLite 單條語句的參數數量有限，分批刪除
+            for start in range(0, len(doc_ids), 500):
+                batch = doc_ids[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                self._conn.execute(f"DELETE FROM spans WHERE doc_id IN ({placeholders})", batch)
+            self._conn.commit()
+
+    def between(self, lecture_id: str, start: float, end: float) -> List[Dict[str, Any]]:
+        """
+        查詢與時間範圍重疊的文本塊
+
+        Returns:
+            list: 按開始時間排序的 doc_id、start、end
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT doc_id, start, end FROM spans WHERE lecture_id = ? AND start <= ? AND end >= ? ORDER BY start",
+                (lecture_id, end, start)
+            ).fetchall()
+        return [{"doc_id": doc_id, "start": span_start, "end": span_end} for doc_id, span_start, span_end in rows]
+
+    def at(self, lecture_id: str, offset: float) -> List[Dict[str, Any]]:
+        """查詢包含某一時刻的文本塊，相鄰文本塊重疊時可能有多個"""
+        return self.between(lecture_id, offset, offset)
+
+    def lectures(self) -> List[Dict[str, Any]]:
+        """列出已索引的講座及其文本塊數量和時長"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT lecture_id, MAX(source), COUNT(*), MAX(end) FROM spans GROUP BY lecture_id ORDER BY MAX(rowid)"
+            ).fetchall()
+        return [
+            {"lecture_id": lecture_id, "source": source, "chunks": chunks, "duration": duration}
+            for lecture_id, source, chunks, duration in rows
+        ]
@@ -0,0 +1,150 @@
+from typing import Any, Dict, List, Optional
+import tiktoken
+from langchain.schema import Document
+
+class ContextPacker:
+    def __init__(self, max_tokens: int = 3000, model: str = "gpt-4", min_overlap: int = 20):
+        """
+        將檢索到的文本塊整理為不超過 token 預算的上下文
+
+        相鄰文本塊之間有重疊（TextProcessor 默認 200 個字符），直接拼接會重複發送重疊部分。
+        打包時按相關性順序處理文本塊：同一來源中首尾重疊的文本塊合併為一段並去掉重疊，
+        已被其他文本塊完整包含的文本塊直接丟棄，再按相關性依次放入，直到用完 token 預算。
+
+        Args:
+            max_tokens: 上下文的 token 預算
+            model: 用於選擇 tiktoken 編碼的模型名稱
+            min_overlap: 判定兩個文本塊首尾相連所需的最少重疊字符數
+        """
+        self.max_tokens = max_tokens
+        self.min_overlap = min_overlap
+        try:
+            self.encoding = tiktoken.encoding_for_model(model)
+        except Exception as e:
+            # 編碼文件需要在首次使用時下載，無法下載時按字符數估算
+            print(f"無法加載 tiktoken 編碼，改為按字符數估算 token：{str(e)}")
+            self.encoding = None
+
+    def count_tokens(self, text: str) -> int:
+        """計算文本的 token 數量"""
+        if self.encoding is None:
+            return len(text)
+        return len(self.encoding.encode(text))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """截取文本的前 max_tokens 個 token"""
+        if self.encoding is None:
+            return text[:max_tokens]
+        tokens = self.encoding.encode(text)
+        if len(tokens) <= max_tokens:
+            return text
+        # 截斷處可能落在多字節字符中間，丟棄不完整的字符
+        return self.encoding.decode(tokens[:max_tokens]).rstrip("�")
+
+    @staticmethod
+    def _source_key(metadata: Dict[str, Any]) -> Optional[str]:
+        return metadata.get("lecture_id") or metadata.get("source")
+
+    def _overlap(self, first: str, second: str) -> int:
+        """first 的結尾與 second 的開頭重疊的最大字符數，不足 min_overlap 時為 0"""
+        probe = second[:self.min_overlap]
+        if len(probe) < self.min_overlap:
+            return 0
+        # 重疊部分不會比 second 長，只需在 first 的末尾查找
+        position = first.find(probe, max(len(first) - len(second), 0))
+        while position >= 0:
+            if second.startswith(first[position:]):
+                return len(first) - position
+            position = first.find(probe, position + 1)
+        return 0
+
+    def _join(self, passage: Dict[str, Any], document: Document) -> bool:
+        """嘗試將文本塊併入段落，成功時返回 True"""
+        text = document.page_content
+        if text in passage["text"]:
+            pass
+        elif passage["text"] in text:
+            passage["text"] = text
+        else:
+            overlap = self._overlap(passage["text"], text)
+            if overlap:
+                passage["text"] += text[overlap:]
+            else:
+                overlap = self._overlap(text, passage["text"])
+                if not overlap:
+                    return False
+                passage["text"] = text + passage["text"][overlap:]
+
+        metadata = passage["metadata"]
+        for key, pick in (("start", min), ("end", max)):
+            if key in document.metadata:
+                metadata[key] = pick(metadata[key], document.metadata[key]) if key in metadata else document.metadata[key]
+        passage["chunks"] += 1
+        return True
+
+    def merge(self, documents: List[Document]) -> List[Dict[str, Any]]:
+        """
+        合併同一來源中首尾重疊或重複的文本塊
+
+        Returns:
+            list: 按相關性排序的段落，text 為合併後的文本，metadata 為第一個文本塊的元數據
+                  （start、end 擴展為整段的時間範圍），chunks 為合併的文本塊數量
+        """
+        passages: List[Dict[str, Any]] = []
+        for document in documents:
+            key = self._source_key(document.metadata)
+            target = None
+            if key is not None:
+                for passage in passages:
+                    if passage["key"] == key and self._join(passage, document):
+                        target = passage
+                        break
+            if target is None:
+                passages.append({
+                    "key": key,
+                    "text": document.page_content,
+                    "metadata": dict(document.metadata),
+                    "chunks": 1
+                })
+                continue
+
+            # 新加入的文本塊可能把兩個原本不相連的段落接在一起
+            for passage in passages:
+                if passage is target or passage["key"] != key:
+                    continue
+                merged = Document(page_content=passage["text"], metadata=passage["metadata"])
+                if self._join(target, merged):
+                    target["chunks"] += passage["chunks"] - 1
+                    passages.remove(passage)
+                    break
+        return passages
+
+    def _passage_tokens(self, documents: List[Document]) -> int:
+        return sum(self.count_tokens(passage["text"]) for passage in self.merge(documents))
+
+    def pack(self, documents: List[Document], max_tokens: Optional[int] = None) -> List[Document]:
+        """
+        將按相關性排序的文本塊打包為不超過 token 預算的文檔列表
+
+        按相關性依次選取文本塊，每個文本塊佔用的是與已選文本塊合併、去掉重疊後增加的 token；
+        放不下的文本塊跳過，最相關的文本塊本身就超出預算時截斷。
+
+        Args:
+            documents: 按相關性從高到低排列的文本塊
+            max_tokens: token 預算，默認使用 self.max_tokens
+
+        Returns:
+            list: 合併後的文檔，按其中最相關的文本塊排序
+        """
+        budget = self.max_tokens if max_tokens is None else max_tokens
+        selected: List[Document] = []
+        for document in documents:
+            if self._passage_tokens(selected + [document]) <= budget:
+                selected.append(document)
+            elif not selected:
+                text = self.truncate(document.page_content, budget)
+                selected.append(Document(page_content=text, metadata=document.metadata))
+        return [
+            Document(page_content=passage["text"], metadata=passage["metadata"])
+            for passage in self.merge(selected)
+        ]
@@ -0,0 +1,147 @@
+from pathlib import Path
+import hashlib
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+class EmbeddingModel(Embeddings):
+    def __init__(
+        self,
+        model_name: str = "all-MiniLM-L6-v2",
+        device: Optional[str] = None,
+        batch_size: int = 64,
+        num_threads: Optional[int] = None,
+        cache_path: Optional[str] = None,
+        normalize: bool = True,
+        encoder: Optional[Embeddings] = None
+    ):
+        """
+        初始化帶有磁盤緩存的本地嵌入模型
+
+        默認使用 sentence-transformers 的 all-MiniLM-L6-v2，與 Chroma 默認的嵌入函數是同一個模型，
+        已有集合中的向量可以繼續使用。模型在第一次需要計算向量時才加載。
+
+        Args:
+            model_name: sentence-transformers 模型名稱
+            device: 運行設備，默認自動選擇
+            batch_size: 每批計算的文本數量
+            num_threads: CPU 推理使用的線程數，默認不限制
+            cache_path: 緩存數據庫路徑，為 None 時不使用磁盤緩存
+            normalize: 是否將向量歸一化
+            encoder: 使用其他 LangChain Embeddings 計算向量，此時仍然使用緩存
+        """
+        self.model_name = model_name if encoder is None else f"{type(encoder).__name__}:{getattr(encoder, 'model_name', '')}"
+        self.device = device
+        self.batch_size = batch_size
+        self.num_threads = num_threads
+        self.normalize = normalize
+        self.encoder = encoder
+        self._model = None
+        self._model_lock = threading.Lock()
+
+        self._cache_lock = threading.Lock()
+        self._cache: Optional[sqlite3.Connection] = None
+        if cache_path:
+            Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+            self._cache = sqlite3.connect(cache_path, check_same_thread=False)
+            self._cache.execute("PRAGMA journal_mode=WAL")
+            self._cache.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+            self._cache.commit()
+
+    @property
+    def model(self):
+        """sentence-transformers 模型，第一次使用時加載"""
+        with self._model_lock:
+            if self._model is None:
+                from sentence_transformers import SentenceTransformer
+                if self.num_threads:
+                    import torch
+                    torch.set_num_threads(self.num_threads)
+                print(f"正在加載嵌入模型：{self.model_name}")
+                self._model = SentenceTransformer(self.model_name, device=self.device)
+            return self._model
+
+    def _cache_key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\x00{self.normalize}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _read_cache(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        if self._cache is None or not keys:
+            return {}
+        found = {}
+        with self._cache_lock:
+            # SQLite 單條語句的參數數量有限，分批查詢
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._cache.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def _write_cache(self, items: Dict[str, np.ndarray]):
+        if self._cache is None or not items:
+            return
+        with self._cache_lock:
+            self._cache.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items.items()]
+            )
+            self._cache.commit()
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """計算未命中緩存的文本向量"""
+        if self.encoder is not None:
+            vectors = np.asarray(self.encoder.embed_documents(texts), dtype=np.float32)
+            if self.normalize:
+                norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+                vectors = vectors / np.where(norms > 0, norms, 1)
+            return vectors
+        return np.asarray(self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            normalize_embeddings=self.normalize,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        ), dtype=np.float32)
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """
+        計算文本向量
+
+        相同的文本只計算一次，已緩存的文本直接讀取，其餘文本按 batch_size 分批計算並寫入緩存。
+        """
+        keys = [self._cache_key(text) for text in texts]
+        vectors = self._read_cache(list(dict.fromkeys(keys)))
+
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+
+        if missing:
+            missing_keys = list(missing)
+            computed = {}
+            for start in range(0, len(missing_keys), self.batch_size):
+                batch_keys = missing_keys[start:start + self.batch_size]
+                encoded = self._encode([missing[key] for key in batch_keys])
+                computed.update(zip(batch_keys, encoded))
+            self._write_cache(computed)
+            vectors.update(computed)
+
+        return [vectors[key].tolist() for key in keys]
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        """Chroma 嵌入函數接口"""
+        return self.embed(list(input))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """LangChain 嵌入接口"""
+        return self.embed(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        """LangChain 嵌入接口"""
+        return self.embed([text])[0]
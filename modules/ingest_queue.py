@@ -0,0 +1,496 @@
+from pathlib import Path
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+from modules.chunk_index import span_metadata
+
+# 處理階段及其顯示名稱
+STAGES = [("upload", "上傳"), ("transcription", "轉錄"), ("chunking", "分塊"), ("indexing", "索引")]
+
+# 任務狀態：queued 等待轉錄 → running 轉錄和分塊中（已生成的文本塊同時在索引）→ chunked 分塊完成 → done / failed
+ACTIVE_STATUSES = ("queued", "running", "chunked")
+
+# 文本塊不在向量存儲中時最多重新轉錄並索引的次數，仍然失敗則標記任務失敗
+MAX_REINDEX_ATTEMPTS = 1
+
+class IngestQueue:
+    def __init__(self, db_path: str, jobs_dir: Optional[str] = None):
+        """
+        基於 SQLite 的音檔處理任務隊列
+
+        任務及其各階段的進度保存在數據庫中，瀏覽器刷新或應用重啟後仍可查詢和繼續處理。
+        多個進程可以同時打開同一個隊列。
+
+        Args:
+            db_path: 數據庫文件路徑
+            jobs_dir: 上傳音檔的保存目錄，默認為數據庫所在目錄下的 uploads
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.jobs_dir = Path(jobs_dir) if jobs_dir else self.db_path.parent / "uploads"
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                audio_path TEXT NOT NULL,
+                status TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                progress TEXT NOT NULL,
+                message TEXT,
+                metadata TEXT,
+                worker_pid INTEGER,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        # 轉錄過程中逐個生成的文本塊，doc_id 為 NULL 表示尚未索引，空字符串表示索引失敗
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                job_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                doc_id TEXT,
+                start REAL,
+                end REAL,
+                PRIMARY KEY (job_id, seq)
+            )
+        """)
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(chunks)")}
+        for column in ("start", "end"):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE chunks ADD COLUMN {column} REAL")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_pending ON chunks (doc_id, job_id, seq)")
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        job = {key: row[key] for key in row.keys()}
+        job["progress"] = json.loads(job["progress"])
+        job["metadata"] = json.loads(job["metadata"]) if job["metadata"] else {}
+        return job
+
+    def submit(self, filename: str, data: bytes) -> str:
+        """保存上傳的音檔並加入隊列，返回任務ID"""
+        job_id = uuid.uuid4().hex
+        suffix = Path(filename).suffix or ".wav"
+        audio_path = self.jobs_dir / f"{job_id}{suffix}"
+        with open(audio_path, "wb") as f:
+            f.write(data)
+
+        progress = {stage: 0.0 for stage, _ in STAGES}
+        progress["upload"] = 1.0
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, filename, audio_path, status, stage, progress, message, created_at, updated_at) "
+                "VALUES (?, ?, ?, 'queued', 'transcription', ?, '等待處理', ?, ?)",
+                (job_id, filename, str(audio_path), json.dumps(progress), now, now)
+            )
+        return job_id
+
+    def claim(self, worker_pid: int) -> Optional[Dict[str, Any]]:
+        """原子地取出最早的一個等待轉錄的任務"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'running', stage = 'transcription', worker_pid = ?, updated_at = ? WHERE id = ?",
+                    (worker_pid, time.time(), row["id"])
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        job = self._to_dict(row)
+        job.update(status="running", stage="transcription")
+        return job
+
+    def update_progress(self, job_id: str, stage: str, progress: float, message: Optional[str] = None):
+        """更新任務當前階段及其進度（0 到 1）"""
+        with self._lock:
+            row = self._conn.execute("SELECT progress FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            stages = json.loads(row["progress"])
+            stages[stage] = round(min(max(progress, 0.0), 1.0), 4)
+            self._conn.execute(
+                "UPDATE jobs SET stage = ?, progress = ?, message = COALESCE(?, message), updated_at = ? WHERE id = ?",
+                (stage, json.dumps(stages), message, time.time(), job_id)
+            )
+
+    def set_metadata(self, job_id: str, metadata: Dict[str, Any]):
+        """保存文本塊的元數據，需在添加文本塊之前調用；任務已重新索引的次數會保留"""
+        with self._lock:
+            row = self._conn.execute("SELECT metadata FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            previous = json.loads(row["metadata"]) if row is not None and row["metadata"] else {}
+            if "reindex_attempts" in previous:
+                metadata = dict(metadata, reindex_attempts=previous["reindex_attempts"])
+            self._conn.execute(
+                "UPDATE jobs SET metadata = ?, updated_at = ? WHERE id = ?",
+                (json.dumps(metadata, ensure_ascii=False), time.time(), job_id)
+            )
+
+    def add_chunk(self, job_id: str, seq: int, content: str, start: Optional[float] = None, end: Optional[float] = None):
+        """添加一個已生成的文本塊及其在音頻中的起止時間，等待索引"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO chunks (job_id, seq, content, start, end) VALUES (?, ?, ?, ?, ?)",
+                (job_id, seq, content, start, end)
+            )
+
+    def mark_chunked(self, job_id: str):
+        """標記任務已完成轉錄和分塊"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'chunked', stage = 'indexing', updated_at = ? WHERE id = ? AND status = 'running'",
+                (time.time(), job_id)
+            )
+
+    def pending_chunks(self, limit: int) -> List[Dict[str, Any]]:
+        """按任務提交順序取出尚未索引的文本塊"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT c.job_id, c.seq, c.content, c.start, c.end FROM chunks c JOIN jobs j ON j.id = c.job_id "
+                "WHERE c.doc_id IS NULL AND j.status IN ('running', 'chunked') "
+                "ORDER BY j.created_at, c.seq LIMIT ?", (limit,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def mark_indexed(self, job_id: str, seqs: List[int], doc_ids: List[Optional[str]]) -> Dict[str, int]:
+        """
+        記錄文本塊的文檔ID
+
+        Returns:
+            dict: 該任務的文本塊總數 total 和已索引的數量 indexed
+        """
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE chunks SET doc_id = ? WHERE job_id = ? AND seq = ?",
+                [(doc_id or "", job_id, seq) for seq, doc_id in zip(seqs, doc_ids)]
+            )
+            row = self._conn.execute(
+                "SELECT COUNT(*) AS total, COUNT(doc_id) AS indexed FROM chunks WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return {"total": row["total"], "indexed": row["indexed"]}
+
+    def completed_jobs(self) -> List[Dict[str, Any]]:
+        """返回已完成分塊且所有文本塊都已索引的任務"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE status = 'chunked' AND NOT EXISTS "
+                "(SELECT 1 FROM chunks c WHERE c.job_id = jobs.id AND c.doc_id IS NULL) ORDER BY created_at"
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def chunk_doc_ids(self, job_id: str) -> List[str]:
+        """按順序返回任務各文本塊的文檔ID，索引失敗的為空字符串"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT doc_id FROM chunks WHERE job_id = ? ORDER BY seq", (job_id,)
+            ).fetchall()
+        return [row["doc_id"] or "" for row in rows]
+
+    def requeue(self, job_id: str, **metadata: Any):
+        """將任務放回隊列重新轉錄，並合併新的元數據"""
+        job = self.get(job_id)
+        if job is None:
+            return
+        job["metadata"].update(metadata)
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks WHERE job_id = ?", (job_id,))
+            self._conn.execute(
+                "UPDATE jobs SET status = 'queued', stage = 'transcription', metadata = ?, message = '等待處理', "
+                "updated_at = ? WHERE id = ?",
+                (json.dumps(job["metadata"], ensure_ascii=False), time.time(), job_id)
+            )
+
+    def finish(self, job_id: str, success: bool, message: str):
+        """標記任務完成或失敗，並刪除上傳的音檔"""
+        with self._lock:
+            row = self._conn.execute("SELECT audio_path FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, message = ?, updated_at = ? WHERE id = ?",
+                ("done" if success else "failed", message, time.time(), job_id)
+            )
+            self._conn.execute("DELETE FROM chunks WHERE job_id = ?", (job_id,))
+        if row is not None:
+            try:
+                os.unlink(row["audio_path"])
+            except OSError:
+                pass
+
+    def recover(self) -> int:
+        """
+        將上次運行時中斷的任務放回隊列
+
+        轉錄中斷的任務重新轉錄（已完成的轉錄會命中轉錄緩存）；已分塊的任務繼續索引剩餘的文本塊。
+
+        Returns:
+            int: 恢復的任務數量
+        """
+        with self._lock:
+            now = time.time()
+            self._conn.execute(
+                "DELETE FROM chunks WHERE job_id IN (SELECT id FROM jobs WHERE status = 'running')"
+            )
+            count = self._conn.execute(
+                "UPDATE jobs SET status = 'queued', stage = 'transcription', message = '等待處理', updated_at = ? "
+                "WHERE status = 'running'", (now,)
+            ).rowcount
+            count += self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'chunked'"
+            ).fetchone()[0]
+        return count
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """查詢任務"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list_jobs(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """按提交時間倒序列出最近的任務"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+def _transcribe_job(queue: IngestQueue, job: Dict[str, Any], audio_processor, text_processor):
+    """在工作進程中流式轉錄一個任務，每生成一個文本塊就交給索引線程"""
+    from modules.long_audio import probe_duration
+
+    job_id = job["id"]
+    audio_path = job["audio_path"]
+
+    # 已經轉錄並索引過的音檔交給索引線程確認文檔仍在向量存儲中
+    cached = None if job["metadata"].get("reindex") else audio_processor.cached_result(audio_path)
+    if cached:
+        queue.set_metadata(job_id, {"chunk_ids": cached["chunk_ids"]})
+        queue.update_progress(job_id, "transcription", 1.0)
+        queue.update_progress(job_id, "chunking", 1.0, "此音檔已處理過，正在確認索引")
+        queue.mark_chunked(job_id)
+        return
+
+    queue.update_progress(job_id, "transcription", 0.0, "正在轉錄")
+    output_path, segments = audio_processor.transcribe_stream(audio_path)
+    queue.set_metadata(job_id, {
+        "source": str(output_path),
+        "timestamp": output_path.stem.split("_")[-1],
+        "lecture_id": audio_processor.lecture_id(audio_path)
+    })
+
+    duration = probe_duration(audio_path)
+
+    def tracked():
+        for segment in segments:
+            if duration and segment.get("end") is not None:
+                progress = min(segment["end"] / duration, 0.99)
+                queue.update_progress(job_id, "transcription", progress)
+                queue.update_progress(job_id, "chunking", progress)
+            yield segment
+
+    count = 0
+    for count, chunk in enumerate(text_processor.iter_timed_chunks(tracked()), start=1):
+        queue.add_chunk(job_id, count - 1, chunk["text"], chunk["start"], chunk["end"])
+    if count == 0:
+        queue.finish(job_id, False, "音頻轉錄失敗")
+        return
+
+    queue.update_progress(job_id, "transcription", 1.0)
+    queue.update_progress(job_id, "chunking", 1.0, "轉錄完成，正在索引剩餘的文本塊")
+    queue.mark_chunked(job_id)
+
+def _worker_main(db_path: str, output_dir: str, num_threads: int, stop_event):
+    """轉錄工作進程：不斷從隊列中取出任務進行轉錄和分塊"""
+    import torch
+    from modules.audio_processor import AudioProcessor
+    from modules.text_processor import TextProcessor
+
+    # 多個工作進程平分 CPU；轉錄在本進程中進行，不再為每個任務創建進程池，
+    # 否則每個工作進程都會啟動 CPU 核心數個進程並各自加載一份 Whisper 模型
+    torch.set_num_threads(num_threads)
+    queue = IngestQueue(db_path)
+    audio_processor = AudioProcessor(output_dir, num_workers=1)
+    text_processor = TextProcessor()
+
+    while not stop_event.is_set():
+        job = queue.claim(os.getpid())
+        if job is None:
+            stop_event.wait(1.0)
+            continue
+        try:
+            _transcribe_job(queue, job, audio_processor, text_processor)
+        except Exception as e:
+            print(f"處理任務 {job['id']} 失敗：{str(e)}")
+            queue.finish(job["id"], False, f"處理失敗：{str(e)}")
+
+class IngestService:
+    def __init__(
+        self,
+        queue: IngestQueue,
+        output_dir: str,
+        vector_store,
+        audio_processor,
+        num_workers: int = 2,
+        batch_size: int = 64
+    ):
+        """
+        後台處理上傳的音檔
+
+        轉錄和分塊在獨立的工作進程中流式進行，多個音檔可以同時處理；
+        索引在當前進程的後台線程中完成，每生成一批文本塊就加入向量存儲，
+        長音檔的前面部分在轉錄完成前就可以檢索。
+
+        Args:
+            queue: 任務隊列
+            output_dir: 轉錄結果的輸出目錄
+            vector_store: 問答使用的向量存儲
+            audio_processor: 與工作進程使用同一個輸出目錄的音頻處理器，用於記錄已索引的文檔
+            num_workers: 轉錄工作進程數量
+            batch_size: 每批索引的文本塊數量
+        """
+        self.queue = queue
+        self.output_dir = output_dir
+        self.vector_store = vector_store
+        self.audio_processor = audio_processor
+        self.num_workers = max(1, num_workers)
+        self.batch_size = batch_size
+
+        self._context = multiprocessing.get_context("spawn")
+        self._stop_event = self._context.Event()
+        self._workers = []
+        self._indexer = None
+
+    def start(self):
+        """恢復中斷的任務並啟動工作進程和索引線程"""
+        recovered = self.queue.recover()
+        if recovered:
+            print(f"恢復了 {recovered} 個中斷的處理任務")
+
+        num_threads = max(1, (os.cpu_count() or 1) // self.num_workers)
+        for _ in range(self.num_workers):
+            # 工作進程在本進程中轉錄，不會再創建子進程，可以作為守護進程：
+            # 主進程沒有調用 stop 就退出時不會等待或殘留工作進程，中斷的任務在下次啟動時恢復
+            process = self._context.Process(
+                target=_worker_main,
+                args=(str(self.queue.db_path), self.output_dir, num_threads, self._stop_event),
+                name="ingest-worker",
+                daemon=True
+            )
+            process.start()
+            self._workers.append(process)
+
+        self._indexer = threading.Thread(target=self._index_loop, name="ingest-indexer", daemon=True)
+        self._indexer.start()
+
+    def stop(self, timeout: float = 5.0):
+        """停止工作進程，未完成的任務在下次啟動時恢復"""
+        self._stop_event.set()
+        for process in self._workers:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self._workers = []
+        # 保存索引線程已寫入但尚未保存的文本塊
+        self.vector_store.flush()
+
+    def submit(self, filename: str, data: bytes) -> str:
+        """提交上傳的音檔，返回任務ID"""
+        return self.queue.submit(filename, data)
+
+    def _index_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                indexed = self._index_pending()
+                self._finish_completed()
+            except Exception as e:
+                print(f"索引失敗：{str(e)}")
+                indexed = 0
+            if not indexed:
+                self._stop_event.wait(1.0)
+
+    def _index_pending(self) -> int:
+        """將尚未索引的文本塊分批加入向量存儲，返回本次處理的數量"""
+        rows = self.queue.pending_chunks(self.batch_size)
+        jobs: Dict[str, List[Dict[str, Any]]] = {}
+        for row in rows:
+            jobs.setdefault(row["job_id"], []).append(row)
+
+        for job_id, job_rows in jobs.items():
+            job = self.queue.get(job_id)
+            metadata = dict(job["metadata"])
+            lecture_id = metadata.pop("lecture_id", None)
+            metadata.pop("reindex_attempts", None)
+            contents = [row["content"] for row in job_rows]
+            doc_ids = self.vector_store.add_contents(contents, [
+                span_metadata(metadata, lecture_id, row["start"], row["end"]) for row in job_rows
+            ])
+            counts = self.queue.mark_indexed(job_id, [row["seq"] for row in job_rows], doc_ids)
+
+            # 轉錄尚未完成時，文本塊總數未知，以轉錄進度估算索引進度
+            transcribed = 1.0 if job["status"] == "chunked" else job["progress"].get("transcription", 0.0)
+            self.queue.update_progress(
+                job_id, "indexing", transcribed * counts["indexed"] / counts["total"],
+                f"已索引 {counts['indexed']} 個文本塊，可以開始提問"
+            )
+        return len(rows)
+
+    def _finish_completed(self):
+        """完成所有文本塊都已索引的任務"""
+        for job in self.queue.completed_jobs():
+            job_id = job["id"]
+            audio_path = job["audio_path"]
+
+            known_ids = job["metadata"].get("chunk_ids")
+            if known_ids is not None:
+                if self.vector_store.has_documents(known_ids):
+                    self.queue.update_progress(job_id, "indexing", 1.0)
+                    self.queue.finish(job_id, True, f"此音檔已處理過，沿用已有的 {len(known_ids)} 個文本塊")
+                else:
+                    # 向量存儲中的文檔已被刪除，重新轉錄並索引
+                    self._reindex(job, "重新索引後向量存儲中仍找不到此音檔的文本塊")
+                continue
+
+            doc_ids = self.queue.chunk_doc_ids(job_id)
+            chunk_count = sum(1 for doc_id in doc_ids if doc_id)
+            # 向量存儲按時間間隔保存，任務完成前確保其文本塊已寫入磁盤
+            self.vector_store.flush()
+            if chunk_count == len(doc_ids) and not self.vector_store.has_documents(doc_ids):
+                # 上次運行在保存前中斷，已標記為索引的文本塊不在向量存儲中
+                self._reindex(job, "重新索引後文本塊仍未能寫入向量存儲")
+            elif chunk_count == len(doc_ids):
+                self.audio_processor.remember_chunk_ids(audio_path, doc_ids)
+                self.queue.update_progress(job_id, "indexing", 1.0)
+                self.queue.finish(job_id, True, f"處理成功! 文本已分為 {chunk_count} 個塊並存儲到向量數據庫")
+            else:
+                self.queue.finish(job_id, False, f"向量存儲失敗: {len(doc_ids) - chunk_count}/{len(doc_ids)} 個塊未能存儲")
+
+    def _reindex(self, job: Dict[str, Any], message: str):
+        """
+        重新轉錄並索引任務
+
+        轉錄結果有緩存，重試的代價很小；向量存儲持續出錯時限制重試次數，避免任務無限循環。
+        """
+        attempts = job["metadata"].get("reindex_attempts", 0)
+        if attempts >= MAX_REINDEX_ATTEMPTS:
+            self.queue.finish(job["id"], False, message)
+            return
+        self.queue.requeue(job["id"], chunk_ids=None, reindex=True, reindex_attempts=attempts + 1)
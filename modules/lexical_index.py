@@ -0,0 +1,189 @@
+from pathlib import Path
+from collections import Counter
+import json
+import math
+import re
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+# 中日韓文字沒有空格分詞，連續的漢字、假名或諺文按字符二元組切分；其他文字按單詞切分
+_CJK = r"\u3040-\u30ff\u4e00-\u9fff\uac00-\ud7a3"
+_TOKEN = re.compile(rf"(?P<cjk>[{_CJK}]+)|[^\W_{_CJK}]+")
+
+def tokenize(text: str) -> List[str]:
+    """
+    將文本切分為詞項
+
+    英文等以空格分詞的文字按單詞切分並轉為小寫；中日韓文字切分為相鄰字符的二元組，
+    例如「光合作用」切分為「光合」「合作」「作用」，無需詞典即可匹配專有名詞和術語。
+    """
+    tokens = []
+    for match in _TOKEN.finditer(text.lower()):
+        word = match.group()
+        if match.lastgroup == "cjk" and len(word) > 1:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word)
+    return tokens
+
+class LexicalIndex:
+    def __init__(self, db_path: str, k1: float = 1.2, b: float = 0.75):
+        """
+        持久化的 BM25 倒排索引
+
+        每個文檔的詞頻保存在 SQLite 中，啟動時載入並在內存中建立倒排表，
+        查詢只涉及內存中的數組運算；添加文檔時同時寫入數據庫和內存。
+
+        Args:
+            db_path: 索引數據庫路徑
+            k1: BM25 的詞頻飽和參數
+            b: BM25 的文檔長度歸一化參數
+        """
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS documents (doc_id TEXT PRIMARY KEY, terms TEXT NOT NULL)")
+        self._conn.commit()
+
+        # 每個文檔佔用一個編號，倒排表記錄編號和詞頻；刪除的文檔只清空其編號，不重新編號
+        self._slot_of: Dict[str, int] = {}
+        self._doc_ids: List[Optional[str]] = []
+        self._lengths = np.zeros(1024, dtype=np.float64)
+        self._total_length = 0
+        self._postings: Dict[str, Dict[int, int]] = {}
+        # 查詢時使用的 (編號數組, 詞頻數組)，詞項的倒排表變化時重建
+        self._arrays: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for doc_id, terms in self._conn.execute("SELECT doc_id, terms FROM documents"):
+            self._insert(doc_id, json.loads(terms))
+
+    def _insert(self, doc_id: str, terms: Dict[str, int]):
+        slot = len(self._doc_ids)
+        self._doc_ids.append(doc_id)
+        self._slot_of[doc_id] = slot
+        if slot >= len(self._lengths):
+            self._lengths = np.concatenate([self._lengths, np.zeros(len(self._lengths), dtype=np.float64)])
+        length = sum(terms.values())
+        self._lengths[slot] = length
+        self._total_length += length
+        for term, frequency in terms.items():
+            self._postings.setdefault(term, {})[slot] = frequency
+            self._arrays.pop(term, None)
+
+    def _discard(self, doc_id: str, terms: Dict[str, int]):
+        slot = self._slot_of.pop(doc_id, None)
+        if slot is None:
+            return
+        self._doc_ids[slot] = None
+        self._total_length -= int(self._lengths[slot])
+        self._lengths[slot] = 0
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(slot, None)
+            self._arrays.pop(term, None)
+            if not postings:
+                del self._postings[term]
+
+    def _term_arrays(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        arrays = self._arrays.get(term)
+        if arrays is None:
+            postings = self._postings.get(term)
+            if not postings:
+                return None
+            arrays = (
+                np.fromiter(postings.keys(), dtype=np.intp, count=len(postings)),
+                np.fromiter(postings.values(), dtype=np.float64, count=len(postings))
+            )
+            self._arrays[term] = arrays
+        return arrays
+
+    def _stored_terms(self, doc_ids: List[str]) -> Dict[str, Dict[str, int]]:
+        """讀取已索引文檔的詞頻，用於覆蓋或刪除時從倒排表中移除"""
+        found = {}
+        # SQLite 單條語句的參數數量有限，分批查詢
+        for start in range(0, len(doc_ids), 500):
+            batch = doc_ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            for doc_id, terms in self._conn.execute(
+                f"SELECT doc_id, terms FROM documents WHERE doc_id IN ({placeholders})", batch
+            ):
+                found[doc_id] = json.loads(terms)
+        return found
+
+    def add(self, doc_ids: List[str], contents: List[str]):
+        """添加或覆蓋文檔"""
+        documents = dict(
+            (doc_id, dict(Counter(tokenize(content)))) for doc_id, content in zip(doc_ids, contents)
+        )
+        with self._lock:
+            previous = self._stored_terms([doc_id for doc_id in documents if doc_id in self._slot_of])
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO documents (doc_id, terms) VALUES (?, ?)",
+                [(doc_id, json.dumps(terms, ensure_ascii=False)) for doc_id, terms in documents.items()]
+            )
+            self._conn.commit()
+            for doc_id, terms in documents.items():
+                if doc_id in previous:
+                    # 文檔ID由內容決定，重複添加同一文檔時無需更新
+                    if previous[doc_id] == terms:
+                        continue
+                    self._discard(doc_id, previous[doc_id])
+                self._insert(doc_id, terms)
+
+    def remove(self, doc_ids: Iterable[str]):
+        """刪除文檔"""
+        with self._lock:
+            doc_ids = [doc_id for doc_id in doc_ids if doc_id in self._slot_of]
+            if not doc_ids:
+                return
+            previous = self._stored_terms(doc_ids)
+            self._conn.executemany("DELETE FROM documents WHERE doc_id = ?", [(doc_id,) for doc_id in doc_ids])
+            self._conn.commit()
+            for doc_id, terms in previous.items():
+                self._discard(doc_id, terms)
+
+    def doc_ids(self) -> List[str]:
+        """已索引的文檔ID"""
+        with self._lock:
+            return list(self._slot_of)
+
+    def count(self) -> int:
+        """已索引的文檔數量"""
+        return len(self._slot_of)
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[str, float]]:
+        """
+        按 BM25 分數檢索文檔
+
+        每個詞項的倒排表以數組形式參與計算，即使詞項出現在大部分文檔中也只需幾次向量運算。
+
+        Returns:
+            list: 分數最高的 k 個 (文檔ID, 分數)，按分數從高到低排列
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            count = len(self._slot_of)
+            if not count or not terms:
+                return []
+            average_length = self._total_length / count
+            scores = np.zeros(len(self._doc_ids), dtype=np.float64)
+            for term in terms:
+                arrays = self._term_arrays(term)
+                if arrays is None:
+                    continue
+                slots, frequencies = arrays
+                idf = math.log(1 + (count - len(slots) + 0.5) / (len(slots) + 0.5))
+                norm = frequencies + self.k1 * (1 - self.b + self.b * self._lengths[slots] / average_length)
+                scores[slots] += idf * frequencies * (self.k1 + 1) / norm
+
+            matched = np.flatnonzero(scores)
+            if len(matched) > k:
+                matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+            matched = matched[np.argsort(-scores[matched], kind="stable")]
+            return [(self._doc_ids[slot], float(scores[slot])) for slot in matched]
@@ -0,0 +1,474 @@
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+import asyncio
+import json
+import queue
+import random
+import threading
+import time
+import httpx
+import openai
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# 可以重試的錯誤：限流（429）、超時、連接失敗和服務端錯誤（5xx）
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError
+)
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        """
+        令牌桶限流器，每分鐘補充 per_minute 個令牌，最多累積一分鐘的量
+
+        只在 LLMClient 的事件循環中使用，無需加鎖。
+        """
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1):
+        """取出 amount 個令牌，不足時等待補充"""
+        # 超過桶容量的請求永遠等不到足夠的令牌，最多按容量計算
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def refund(self, amount: float):
+        """歸還多取的令牌；amount 為負數時補扣，令牌數可以暫時為負"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+class SharedStream:
+    def __init__(self, source: AsyncIterator[str]):
+        """
+        多個調用方共用的一個上游流式請求
+
+        上游的文本段保存在 parts 中並通知所有讀取者，較晚加入的調用方先讀到已收到的文本段，
+        再與其他調用方一起等待後續文本段。所有讀取者都提前結束時取消上游請求。
+        只在 LLMClient 的事件循環中使用，無需加鎖。
+        """
+        self.parts: List[str] = []
+        self.done = False
+        self.closed = False
+        self.error: Optional[Exception] = None
+        self.readers = 0
+        self._changed = asyncio.Event()
+        self.task = asyncio.ensure_future(self._pump(source))
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _pump(self, source: AsyncIterator[str]):
+        try:
+            async for text in source:
+                self.parts.append(text)
+                self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    async def read(self) -> AsyncIterator[str]:
+        """從頭讀取上游的文本段，上游失敗時拋出同一個錯誤"""
+        self.readers += 1
+        index = 0
+        try:
+            while True:
+                # 先取得當前的事件，讀取期間新到達的文本段會使其被觸發
+                changed = self._changed
+                while index < len(self.parts):
+                    index += 1
+                    yield self.parts[index - 1]
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await changed.wait()
+        finally:
+            self.readers -= 1
+            if self.readers == 0 and not self.done:
+                self.closed = True
+                self.task.cancel()
+
+class LLMClient:
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None,
+                 requests_per_minute: float = 500, tokens_per_minute: float = 30000,
+                 max_connections: int = 20, timeout: float = 60.0, max_retries: int = 5,
+                 base_delay: float = 0.5, max_delay: float = 20.0,
+                 count_tokens: Optional[Callable[[str], int]] = None):
+        """
+        共享的 OpenAI 聊天接口客戶端
+
+        所有請求在同一個後台事件循環中執行，共用一個 HTTP 連接池和限流器：
+        - 按每分鐘請求數和 token 數的令牌桶限流，請求前預扣估算的 token，完成後按實際用量修正
+        - 限流（429）、超時、連接失敗和 5xx 錯誤按帶隨機抖動的指數退避重試，服務端給出 Retry-After 時至少等待該時間
+        - 同時發出的相同請求只發送一次，共用同一個結果；流式請求共用同一個上游流，文本段分發給每個調用方
+
+        Args:
+            api_key: OpenAI API 密鑰，默認讀取 OPENAI_API_KEY 環境變量
+            base_url: API 地址，默認讀取 OPENAI_BASE_URL 環境變量，可指向本地模擬服務
+            requests_per_minute: 每分鐘最多發出的請求數
+            tokens_per_minute: 每分鐘最多使用的 token 數
+            max_connections: 連接池大小，也是同時進行的請求數上限
+            timeout: 單次請求的超時秒數
+            max_retries: 失敗後的最多重試次數
+            base_delay: 第一次重試的最長等待秒數，之後每次加倍
+            max_delay: 重試等待時間的上限
+            count_tokens: 計算文本 token 數的函數，默認按字符數估算
+        """
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.count_tokens = count_tokens or len
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client: Optional[openai.AsyncOpenAI] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # 正在進行的請求，鍵為請求內容
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._inflight_streams: Dict[str, SharedStream] = {}
+        self.stats = {"requests": 0, "retries": 0, "deduplicated": 0}
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        """第一次使用時啟動後台事件循環並創建連接池"""
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="llm-client", daemon=True).start()
+                asyncio.run_coroutine_threadsafe(self._open(), loop).result()
+                self._loop = loop
+            return self._loop
+
+    async def _open(self):
+        limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+        self._client = openai.AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=self.base_url,
+            timeout=self.timeout,
+            # 重試由本客戶端統一處理
+            max_retries=0,
+            http_client=httpx.AsyncClient(limits=limits, timeout=self.timeout)
+        )
+        self._semaphore = asyncio.Semaphore(self.max_connections)
+
+    def close(self):
+        """關閉連接池並停止後台事件循環"""
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._client.close(), loop).result()
+        # 關閉尚未結束的異步生成器（例如共用流中未讀完的響應），再停止事件循環
+        asyncio.run_coroutine_threadsafe(loop.shutdown_asyncgens(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+    def _prompt_tokens(self, messages: List[Dict[str, str]]) -> int:
+        return sum(self.count_tokens(message["content"]) + 4 for message in messages)
+
+    def _estimate_tokens(self, messages: List[Dict[str, str]], max_tokens: Optional[int]) -> int:
+        return self._prompt_tokens(messages) + (max_tokens or 500)
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        """第 attempt 次重試前的等待時間（完全隨機抖動的指數退避）"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        response = getattr(error, "response", None)
+        if response is not None:
+            try:
+                delay = max(delay, float(response.headers.get("retry-after", 0)))
+            except ValueError:
+                pass
+        return delay
+
+    async def _limit(self, estimate: int):
+        await self.requests.acquire(1)
+        await self.tokens.acquire(estimate)
+
+    async def _retry_or_raise(self, attempt: int, error: Exception):
+        if attempt >= self.max_retries:
+            raise error
+        delay = self._backoff(attempt, error)
+        self.stats["retries"] += 1
+        print(f"LLM 請求失敗（{type(error).__name__}），{delay:.1f} 秒後重試")
+        await asyncio.sleep(delay)
+
+    async def _create(self, request: Dict[str, Any]) -> str:
+        estimate = self._estimate_tokens(request["messages"], request.get("max_tokens"))
+        attempt = 0
+        while True:
+            await self._limit(estimate)
+            try:
+                async with self._semaphore:
+                    self.stats["requests"] += 1
+                    response = await self._client.chat.completions.create(**request, timeout=self.timeout)
+            except Exception as e:
+                # 失敗的嘗試沒有用掉預扣的 token，無論是否重試都全部歸還，
+                # 避免 429 期間越重試限流越緊，或一批無效請求拖慢正常的請求
+                self.tokens.refund(estimate)
+                if not isinstance(e, RETRYABLE_ERRORS):
+                    raise
+                await self._retry_or_raise(attempt, e)
+                attempt += 1
+                continue
+            if response.usage is not None:
+                self.tokens.refund(estimate - response.usage.total_tokens)
+            return response.choices[0].message.content or ""
+
+    @staticmethod
+    def _request_key(request: Dict[str, Any]) -> str:
+        return json.dumps(request, sort_keys=True, ensure_ascii=False)
+
+    async def _complete(self, request: Dict[str, Any]) -> str:
+        key = self._request_key(request)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._create(request))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.stats["deduplicated"] += 1
+        # 一個調用方被取消時不影響共用同一請求的其他調用方
+        return await asyncio.shield(task)
+
+    async def _stream(self, request: Dict[str, Any]) -> AsyncIterator[str]:
+        """
+        流式請求在收到第一段文本前失敗時重試，之後的錯誤直接拋出
+
+        請求最後一段返回的實際用量，按用量修正預扣的 token；服務沒有返回用量，
+        或調用方提前結束時，按提示的估算加上已收到文本的 token 數修正。
+        收到第一段文本前失敗的嘗試與 _create 相同，無論是否重試都歸還預扣的全部 token。
+        """
+        estimate = self._estimate_tokens(request["messages"], request.get("max_tokens"))
+        attempt = 0
+        while True:
+            await self._limit(estimate)
+            started = False
+            failed = False
+            parts: List[str] = []
+            used: Optional[int] = None
+            try:
+                async with self._semaphore:
+                    self.stats["requests"] += 1
+                    stream = await self._client.chat.completions.create(
+                        **request, stream=True, stream_options={"include_usage": True}, timeout=self.timeout
+                    )
+                    async for chunk in stream:
+                        if chunk.usage is not None:
+                            used = chunk.usage.total_tokens
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            started = True
+                            parts.append(chunk.choices[0].delta.content)
+                            yield chunk.choices[0].delta.content
+                return
+            except Exception as e:
+                if started:
+                    raise
+                failed = True
+                self.tokens.refund(estimate)
+                if not isinstance(e, RETRYABLE_ERRORS):
+                    raise
+                await self._retry_or_raise(attempt, e)
+                attempt += 1
+            finally:
+                if not failed:
+                    if used is None:
+                        used = self._prompt_tokens(request["messages"]) + self.count_tokens("".join(parts))
+                    self.tokens.refund(estimate - used)
+
+    def _stream_shared(self, request: Dict[str, Any]) -> AsyncIterator[str]:
+        """
+        同時發出的相同流式請求共用一個上游請求，各調用方都收到完整的文本段序列
+
+        Streamlit 和語音問答都以流式方式回答，課堂上同時提出的相同問題只向 API 發送一次。
+        """
+        key = self._request_key(request)
+        shared = self._inflight_streams.get(key)
+        if shared is None or shared.closed:
+            shared = SharedStream(self._stream(request))
+            self._inflight_streams[key] = shared
+
+            def forget(_):
+                # 已取消的流可能已被同一個鍵的新請求替換
+                if self._inflight_streams.get(key) is shared:
+                    del self._inflight_streams[key]
+            shared.task.add_done_callback(forget)
+        else:
+            self.stats["deduplicated"] += 1
+        return shared.read()
+
+    @staticmethod
+    def _request(messages: List[Dict[str, str]], model: str, temperature: float,
+                 max_tokens: Optional[int], stop: Optional[List[str]]) -> Dict[str, Any]:
+        request = {"model": model, "messages": messages, "temperature": temperature}
+        if max_tokens is not None:
+            request["max_tokens"] = max_tokens
+        if stop:
+            request["stop"] = stop
+        return request
+
+    async def acomplete(self, messages: List[Dict[str, str]], model: str = "gpt-4", temperature: float = 0.7,
+                        max_tokens: Optional[int] = None, stop: Optional[List[str]] = None) -> str:
+        """
+        發送聊天請求並返回完整答案，可以在任何事件循環中調用
+
+        Args:
+            messages: OpenAI 格式的消息列表
+            model: 模型名稱
+            temperature: 採樣溫度
+            max_tokens: 答案的最大 token 數
+            stop: 停止序列
+
+        Returns:
+            str: 答案文本
+        """
+        loop = self._ensure_loop()
+        request = self._request(messages, model, temperature, max_tokens, stop)
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._complete(request), loop))
+
+    def complete(self, messages: List[Dict[str, str]], model: str = "gpt-4", temperature: float = 0.7,
+                 max_tokens: Optional[int] = None, stop: Optional[List[str]] = None) -> str:
+        """acomplete 的同步版本"""
+        loop = self._ensure_loop()
+        request = self._request(messages, model, temperature, max_tokens, stop)
+        return asyncio.run_coroutine_threadsafe(self._complete(request), loop).result()
+
+    async def astream(self, messages: List[Dict[str, str]], model: str = "gpt-4", temperature: float = 0.7,
+                      max_tokens: Optional[int] = None, stop: Optional[List[str]] = None) -> AsyncIterator[str]:
+        """以流式方式發送聊天請求，逐段返回答案文本；提前結束迭代時取消請求"""
+        loop = self._ensure_loop()
+        request = self._request(messages, model, temperature, max_tokens, stop)
+        caller = asyncio.get_running_loop()
+        chunks: asyncio.Queue = asyncio.Queue()
+
+        def deliver(item):
+            try:
+                caller.call_soon_threadsafe(chunks.put_nowait, item)
+            except RuntimeError:
+                # 調用方的事件循環已經關閉
+                pass
+
+        async def produce():
+            try:
+                async for text in self._stream_shared(request):
+                    deliver((text, None))
+                deliver((None, None))
+            except asyncio.CancelledError:
+                # 調用方提前結束了迭代
+                pass
+            except Exception as e:
+                deliver((None, e))
+
+        future = asyncio.run_coroutine_threadsafe(produce(), loop)
+        try:
+            while True:
+                text, error = await chunks.get()
+                if error is not None:
+                    raise error
+                if text is None:
+                    return
+                yield text
+        finally:
+            future.cancel()
+
+    def stream(self, messages: List[Dict[str, str]], model: str = "gpt-4", temperature: float = 0.7,
+               max_tokens: Optional[int] = None, stop: Optional[List[str]] = None) -> Iterator[str]:
+        """astream 的同步版本"""
+        loop = self._ensure_loop()
+        request = self._request(messages, model, temperature, max_tokens, stop)
+        chunks: queue.Queue = queue.Queue()
+
+        async def produce():
+            try:
+                async for text in self._stream_shared(request):
+                    chunks.put((text, None))
+                chunks.put((None, None))
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                chunks.put((None, e))
+
+        future = asyncio.run_coroutine_threadsafe(produce(), loop)
+        try:
+            while True:
+                text, error = chunks.get()
+                if error is not None:
+                    raise error
+                if text is None:
+                    return
+                yield text
+        finally:
+            future.cancel()
+
+# LangChain 消息類型與 OpenAI 消息角色的對應
+_ROLES = {"human": "user", "ai": "assistant", "system": "system"}
+
+def to_openai_messages(messages: List[BaseMessage]) -> List[Dict[str, str]]:
+    """將 LangChain 消息轉換為 OpenAI 格式"""
+    return [{"role": _ROLES.get(message.type, "user"), "content": message.content} for message in messages]
+
+class PooledChatModel(BaseChatModel):
+    """
+    通過共享的 LLMClient 發送請求的 LangChain 聊天模型
+
+    問答鏈使用此模型代替各自創建連接的 ChatOpenAI，與其他調用共用連接池、限流和重試。
+    """
+    client: Any
+    model_name: str = "gpt-4"
+    temperature: float = 0.7
+    max_tokens: Optional[int] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "pooled-openai-chat"
+
+    def _options(self, stop: Optional[List[str]]) -> Dict[str, Any]:
+        return {"model": self.model_name, "temperature": self.temperature, "max_tokens": self.max_tokens, "stop": stop}
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        text = self.client.complete(to_openai_messages(messages), **self._options(stop))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        text = await self.client.acomplete(to_openai_messages(messages), **self._options(stop))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        for text in self.client.stream(to_openai_messages(messages), **self._options(stop)):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=text))
+            if run_manager:
+                run_manager.on_llm_new_token(text, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        async for text in self.client.astream(to_openai_messages(messages), **self._options(stop)):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=text))
+            if run_manager:
+                await run_manager.on_llm_new_token(text, chunk=chunk)
+            yield chunk
@@ -1,24 +1,43 @@
-from typing import Optional
-import openai
+from typing import Optional, Dict, Any, AsyncIterator, Iterator, List, Tuple
+import asyncio
 import os
+import time
 from dotenv import load_dotenv
 from langchain.chains import RetrievalQA
-from langchain_community.chat_models import ChatOpenAI
 from langchain.prompts import PromptTemplate
+from langchain.schema import Document
 from langchain.schema.retriever import BaseRetriever
+from modules.context_packer import ContextPacker
+from modules.llm_client import LLMClient, PooledChatModel
+from modules.tracing import tracer
 
 class LLMProcessor:
-    def __init__(self):
+    def __init__(self, context_tokens: int = 3000):
+        """
+        初始化 LLM 處理器
+
+        Args:
+            context_tokens: 每次提問發送給 LLM 的參考內容的 token 預算
+        """
         load_dotenv()
-        openai.api_key = os.getenv("OPENAI_API_KEY")
-        if not openai.api_key:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
             raise ValueError("未設置 OPENAI_API_KEY 環境變量")
+        self.context_packer = ContextPacker(max_tokens=context_tokens, model="gpt-4")
+        # get_answer 和問答鏈共用同一個客戶端（連接池、限流和重試），限額按賬戶的 OpenAI 速率限制設置
+        self.client = LLMClient(
+            api_key=api_key,
+            base_url=os.getenv("OPENAI_BASE_URL") or None,
+            requests_per_minute=float(os.getenv("LLM_REQUESTS_PER_MINUTE", "500")),
+            tokens_per_minute=float(os.getenv("LLM_TOKENS_PER_MINUTE", "30000")),
+            count_tokens=self.context_packer.count_tokens
+        )
     
     def get_answer(self, prompt: str) -> Optional[str]:
         """使用 LLM 獲取答案"""
         try:
-            response = openai.ChatCompletion.create(
-                model="gpt4",
+            answer = self.client.complete(
+                model="gpt-4",
                 messages=[
                     {"role": "system", "content": "你是一個專業的助手，請根據提供的內容準確回答問題。"},
                     {"role": "user", "content": prompt}
@@ -26,7 +45,7 @@ class LLMProcessor:
                 temperature=0.7,
                 max_tokens=500
             )
-            return response.choices[0].message.content.strip()
+            return answer.strip()
         except Exception as e:
             print(f"LLM 處理失敗: {str(e)}")
             return None
@@ -62,8 +81,9 @@ class LLMProcessor:
             input_variables=["context", "question"]
         )
 
-        # 創建 LLM
-        llm = ChatOpenAI(
+        # 創建 LLM，通過共享的客戶端發送請求
+        llm = PooledChatModel(
+            client=self.client,
             model_name="gpt-4",
             temperature=0.7
         )
@@ -77,4 +97,165 @@ class LLMProcessor:
             return_source_documents=True
         )
 
-        return qa_chain 
\ No newline at end of file
+        return qa_chain
+
+    def _retrieve(self, vector_store, question: str, k: int, where: Optional[Dict[str, Any]] = None) -> Tuple[List[float], List[str], List[Document]]:
+        """檢索問題的相關文檔，問題向量同時用於檢索和語義緩存匹配，只計算一次"""
+        with tracer.span("retrieval", k=k, filtered=where is not None):
+            embedding = vector_store.embed_texts([question])[0]
+            results = vector_store.retrieve_many([question], k=k, query_embeddings=[embedding], where=where)[0]
+        chunk_ids = [result['id'] for result in results]
+        documents = [
+            Document(page_content=result['content'], metadata=result['metadata'])
+            for result in results
+        ]
+        return embedding, chunk_ids, documents
+
+    def answer_with_cache(self, qa_chain: RetrievalQA, vector_store, question: str, answer_cache=None, k: int = 3,
+                          where: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        檢索相關內容並回答問題，命中問答緩存時不再調用 LLM
+
+        Args:
+            qa_chain: create_qa_chain 創建的問答鏈
+            vector_store: 向量存儲
+            question: 問題
+            answer_cache: 問答緩存，為 None 時每次都調用 LLM
+            k: 檢索的文檔數量
+            where: 檢索時的元數據過濾條件，例如只檢索某個講座或某段時間
+
+        Returns:
+            dict: result 為答案，source_documents 為參考文檔（元數據中的 lecture_id、start、end 可用於定位音頻），cached 表示是否命中緩存
+        """
+        with tracer.span("answer", streaming=False) as span:
+            embedding, chunk_ids, documents = self._retrieve(vector_store, question, k, where)
+
+            if answer_cache is not None:
+                answer = answer_cache.lookup(question, embedding, chunk_ids)
+                if answer is not None:
+                    print("命中問答緩存")
+                    span["attributes"]["cached"] = True
+                    return {"result": answer, "source_documents": documents, "cached": True}
+
+            # 直接使用已檢索到的文檔，避免問答鏈再次檢索
+            with tracer.span("llm_total", streaming=False):
+                output = qa_chain.combine_documents_chain.invoke({
+                    "input_documents": self.pack_context(documents),
+                    "question": question
+                })
+            answer = output[qa_chain.combine_documents_chain.output_key]
+
+            if answer_cache is not None:
+                answer_cache.store(question, embedding, chunk_ids, answer)
+            span["attributes"]["cached"] = False
+            return {"result": answer, "source_documents": documents, "cached": False}
+
+    def stream_answer(self, qa_chain: RetrievalQA, vector_store, question: str, answer_cache=None, k: int = 3,
+                      where: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        """
+        以流式方式回答問題，LLM 每生成一段文本就立即返回
+
+        使用與 answer_with_cache 相同的檢索、提示模板和問答緩存；
+        命中緩存時一次返回完整答案，完整答案生成後寫入緩存。
+
+        Args:
+            qa_chain: create_qa_chain 創建的問答鏈
+            vector_store: 向量存儲
+            question: 問題
+            answer_cache: 問答緩存，為 None 時每次都調用 LLM
+            k: 檢索的文檔數量
+            where: 檢索時的元數據過濾條件
+
+        Yields:
+            str: 答案的文本片段
+        """
+        # 生成器不能跨 yield 使用 span，耗時在結束時記錄
+        started = time.perf_counter()
+        embedding, chunk_ids, documents = self._retrieve(vector_store, question, k, where)
+
+        if answer_cache is not None:
+            answer = answer_cache.lookup(question, embedding, chunk_ids)
+            if answer is not None:
+                print("命中問答緩存")
+                tracer.record("answer", time.perf_counter() - started, streaming=True, cached=True)
+                yield answer
+                return
+
+        llm_chain, prompt = self._stuff_prompt(qa_chain, question, documents)
+
+        parts = []
+        requested = time.perf_counter()
+        for chunk in llm_chain.llm.stream(prompt):
+            if chunk.content:
+                if not parts:
+                    tracer.record("llm_first_token", time.perf_counter() - requested)
+                parts.append(chunk.content)
+                yield chunk.content
+        self._record_stream(started, requested, len(parts))
+
+        if answer_cache is not None and parts:
+            answer_cache.store(question, embedding, chunk_ids, "".join(parts))
+
+    async def astream_answer(self, qa_chain: RetrievalQA, vector_store, question: str, answer_cache=None, k: int = 3,
+                            where: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """
+        stream_answer 的協程版本，供異步語音問答管線使用
+
+        檢索需要計算向量，在線程池中執行；LLM 請求以協程方式等待，不佔用線程。
+        """
+        started = time.perf_counter()
+        # to_thread 會把當前的追蹤上下文帶到線程池中
+        embedding, chunk_ids, documents = await asyncio.to_thread(self._retrieve, vector_store, question, k, where)
+
+        if answer_cache is not None:
+            answer = answer_cache.lookup(question, embedding, chunk_ids)
+            if answer is not None:
+                print("命中問答緩存")
+                tracer.record("answer", time.perf_counter() - started, streaming=True, cached=True)
+                yield answer
+                return
+
+        llm_chain, prompt = self._stuff_prompt(qa_chain, question, documents)
+
+        parts = []
+        requested = time.perf_counter()
+        async for chunk in llm_chain.llm.astream(prompt):
+            if chunk.content:
+                if not parts:
+                    tracer.record("llm_first_token", time.perf_counter() - requested)
+                parts.append(chunk.content)
+                yield chunk.content
+        self._record_stream(started, requested, len(parts))
+
+        if answer_cache is not None and parts:
+            answer_cache.store(question, embedding, chunk_ids, "".join(parts))
+
+    @staticmethod
+    def _record_stream(started: float, requested: float, chunks: int):
+        """
+        記錄流式回答的耗時
+
+        調用方在兩段文本之間的處理時間（例如逐句合成語音）也計入其中，
+        LLM 本身的生成時間以 llm_first_token 和非流式請求的 llm_total 為準。
+        """
+        finished = time.perf_counter()
+        tracer.record("llm_total", finished - requested, streaming=True, chunks=chunks)
+        tracer.record("answer", finished - started, streaming=True, cached=False)
+
+    def pack_context(self, documents: List[Document]) -> List[Document]:
+        """去掉檢索結果中相鄰文本塊的重疊部分並合併，按相關性放入 token 預算內"""
+        packed = self.context_packer.pack(documents)
+        before = sum(self.context_packer.count_tokens(document.page_content) for document in documents)
+        after = sum(self.context_packer.count_tokens(document.page_content) for document in packed)
+        if after < before:
+            print(f"參考內容：{len(documents)} 個文本塊打包為 {len(packed)} 段，{before} → {after} tokens")
+        return packed
+
+    def _stuff_prompt(self, qa_chain: RetrievalQA, question: str, documents: List[Document]):
+        """按 stuff 鏈的方式拼接打包後的文檔，返回其中的 LLM 鏈和完整提示，以便直接流式調用 LLM"""
+        llm_chain = qa_chain.combine_documents_chain.llm_chain
+        prompt = llm_chain.prompt.format(
+            context="\n\n".join(document.page_content for document in self.pack_context(documents)),
+            question=question
+        )
+        return llm_chain, prompt
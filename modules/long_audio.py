@@ -0,0 +1,358 @@
+from collections import deque
+import multiprocessing
+import os
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+from modules.model_registry import use_whisper_model
+
+# 與 whisper.audio.SAMPLE_RATE 相同；直接寫出數值，導入本模塊時無需加載 whisper 和 torch
+SAMPLE_RATE = 16000
+
+# (窗口起點, 窗口終點, 保留區間起點, 保留區間終點)，單位為採樣點
+Window = Tuple[int, int, int, int]
+
+def find_split_points(
+    audio: np.ndarray,
+    window_seconds: float = 120.0,
+    search_seconds: float = 10.0,
+    frame_seconds: float = 0.02
+) -> List[int]:
+    """
+    在每個目標切分位置附近尋找能量最低的幀作為切分點
+
+    Args:
+        audio: 16kHz 單聲道 float32 音頻
+        window_seconds: 目標窗口長度
+        search_seconds: 在目標位置前後搜索靜音的範圍
+        frame_seconds: 計算能量的幀長
+
+    Returns:
+        list: 包含音頻起點和終點在內的切分點
+    """
+    total = len(audio)
+    window = int(window_seconds * SAMPLE_RATE)
+    if total <= window:
+        return [0, total]
+
+    frame = max(1, int(frame_seconds * SAMPLE_RATE))
+    n_frames = total // frame
+    energy = np.sqrt(np.mean(audio[:n_frames * frame].reshape(n_frames, frame) ** 2, axis=1))
+    search = int(search_seconds * SAMPLE_RATE) // frame
+
+    points = [0]
+    target = window
+    while total - target > window // 4:
+        center = target // frame
+        lo = max(points[-1] // frame + 1, center - search)
+        hi = min(n_frames, center + search + 1)
+        if lo >= hi:
+            split = target
+        else:
+            split = (lo + int(np.argmin(energy[lo:hi]))) * frame + frame // 2
+        points.append(split)
+        target = split + window
+    points.append(total)
+    return points
+
+def make_windows(audio: np.ndarray, window_seconds: float = 120.0, overlap_seconds: float = 2.0) -> List[Window]:
+    """根據靜音切分點生成相互重疊的轉錄窗口"""
+    points = find_split_points(audio, window_seconds)
+    pad = int(overlap_seconds * SAMPLE_RATE / 2)
+    total = len(audio)
+
+    windows = []
+    for keep_start, keep_end in zip(points[:-1], points[1:]):
+        windows.append((max(0, keep_start - pad), min(total, keep_end + pad), keep_start, keep_end))
+    return windows
+
+def _thread_budget() -> int:
+    """當前進程可用的線程數；已通過 torch.set_num_threads 限制時（例如處理隊列的工作進程）按限制計算"""
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        return torch.get_num_threads()
+    return os.cpu_count() or 1
+
+def _init_worker(num_threads: int):
+    """限制每個工作進程的線程數，讓多個進程平分 CPU"""
+    import torch
+    torch.set_num_threads(num_threads)
+
+def _transcribe_window(
+    index: int,
+    samples: np.ndarray,
+    offset: float,
+    model_name: str,
+    device: str,
+    compute_type: str,
+    decode_options: Dict[str, Any]
+) -> Tuple[int, List[Dict[str, Any]], str]:
+    """在工作進程中轉錄一個窗口，返回以整段音頻為基準的時間戳"""
+    with use_whisper_model(model_name, device, compute_type) as model:
+        result = model.transcribe(samples, fp16=compute_type == "float16", **decode_options)
+
+    segments = []
+    for segment in result["segments"]:
+        segments.append({
+            "start": segment["start"] + offset,
+            "end": segment["end"] + offset,
+            "text": segment["text"]
+        })
+    return index, segments, result.get("language", "")
+
+def stitch_segments(windows: List[Window], window_segments: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    按順序拼接各窗口的片段並去除重疊部分
+
+    片段的中點落在所屬窗口的保留區間內才會保留，
+    與上一個保留片段文本相同且時間重疊的片段視為重複。
+    """
+    stitched: List[Dict[str, Any]] = []
+    for (_, _, keep_start, keep_end), segments in zip(windows, window_segments):
+        lo = keep_start / SAMPLE_RATE
+        hi = keep_end / SAMPLE_RATE
+        for segment in segments:
+            if _keep_segment(segment, stitched[-1] if stitched else None, lo, hi):
+                stitched.append(dict(segment, id=len(stitched)))
+    return stitched
+
+def _keep_segment(segment: Dict[str, Any], previous: Optional[Dict[str, Any]], lo: float, hi: float) -> bool:
+    """片段的中點在保留區間 [lo, hi) 內，且不是上一個保留片段的重複時保留"""
+    middle = (segment["start"] + segment["end"]) / 2
+    if not lo <= middle < hi:
+        return False
+    if previous is not None:
+        if segment["text"].strip() == previous["text"].strip() and segment["start"] < previous["end"]:
+            return False
+    return True
+
+def transcribe_parallel(
+    audio: np.ndarray,
+    model_name: str,
+    device: str,
+    compute_type: str,
+    num_workers: Optional[int] = None,
+    window_seconds: float = 120.0,
+    overlap_seconds: float = 2.0,
+    **decode_options: Any
+) -> Dict[str, Any]:
+    """
+    將長音頻切分為重疊窗口，並在進程池中並行轉錄
+
+    Args:
+        audio: 16kHz 單聲道 float32 音頻
+        model_name: Whisper 模型名稱
+        device: 運行設備
+        compute_type: 計算精度
+        num_workers: 工作進程數，默認為 CPU 核心數
+        window_seconds: 每個窗口的目標長度
+        overlap_seconds: 相鄰窗口的重疊長度
+        decode_options: 傳給 Whisper 的其他解碼參數
+
+    Returns:
+        dict: 與 Whisper transcribe 相同格式的結果（text、segments、language）
+    """
+    windows = make_windows(audio, window_seconds, overlap_seconds)
+    num_workers = max(1, min(num_workers or os.cpu_count() or 1, len(windows)))
+    num_threads = max(1, _thread_budget() // num_workers)
+    print(f"長音頻分為 {len(windows)} 個窗口，使用 {num_workers} 個進程並行轉錄")
+
+    window_segments: List[List[Dict[str, Any]]] = [[] for _ in windows]
+    languages: List[str] = [""] * len(windows)
+
+    # 使用 spawn 避免在已加載 torch 的進程中 fork
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=context,
+                             initializer=_init_worker, initargs=(num_threads,)) as executor:
+        futures = [
+            executor.submit(
+                _transcribe_window, i, audio[start:end], start / SAMPLE_RATE,
+                model_name, device, compute_type, decode_options
+            )
+            for i, (start, end, _, _) in enumerate(windows)
+        ]
+        for future in futures:
+            index, segments, language = future.result()
+            window_segments[index] = segments
+            languages[index] = language
+
+    segments = stitch_segments(windows, window_segments)
+    detected = [language for language in languages if language]
+    return {
+        "text": "".join(segment["text"] for segment in segments),
+        "segments": segments,
+        "language": max(set(detected), key=detected.count) if detected else ""
+    }
+
+def probe_duration(audio_path: str) -> Optional[float]:
+    """以 ffprobe 讀取音頻時長（秒），無法讀取時返回 None"""
+    try:
+        output = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", audio_path],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+        return float(output) if output else None
+    except Exception:
+        return None
+
+def iter_audio_blocks(audio_path: str, block_seconds: float = 30.0) -> Iterator[np.ndarray]:
+    """
+    以 ffmpeg 流式解碼音頻文件，每次返回一段 16kHz 單聲道 float32 音頻
+
+    與 whisper.load_audio 使用相同的解碼參數，但不必一次將整個文件載入內存。
+    """
+    command = [
+        "ffmpeg", "-nostdin", "-loglevel", "error", "-threads", "0", "-i", audio_path,
+        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE), "-"
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    block_bytes = int(block_seconds * SAMPLE_RATE) * 2
+    decoded = 0
+    try:
+        while True:
+            data = process.stdout.read(block_bytes)
+            if not data:
+                break
+            decoded += len(data)
+            yield np.frombuffer(data, np.int16).astype(np.float32) / 32768.0
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        stderr = process.stderr.read().decode(errors="ignore")
+        process.stderr.close()
+        process.wait()
+    if decoded == 0:
+        raise RuntimeError(f"無法解碼音頻：{stderr.strip()}")
+
+def _quietest_point(audio: np.ndarray, center: int, search: int, frame_seconds: float = 0.02) -> int:
+    """在 center 前後 search 個採樣點內尋找能量最低的幀，返回其中點"""
+    frame = max(1, int(frame_seconds * SAMPLE_RATE))
+    lo = max(0, center - search)
+    hi = min(len(audio), center + search)
+    n_frames = (hi - lo) // frame
+    if n_frames == 0:
+        return center
+    energy = np.sqrt(np.mean(audio[lo:lo + n_frames * frame].reshape(n_frames, frame) ** 2, axis=1))
+    return lo + int(np.argmin(energy)) * frame + frame // 2
+
+def iter_windows(
+    blocks: Iterable[np.ndarray],
+    window_seconds: float = 30.0,
+    overlap_seconds: float = 1.0,
+    search_seconds: float = 5.0
+) -> Iterator[Tuple[np.ndarray, float, float, float]]:
+    """
+    將流式到達的音頻切分為相互重疊的轉錄窗口
+
+    緩衝的音頻足夠在目標位置前後搜索靜音時就切出一個窗口，只保留尚未轉錄的部分，
+    內存佔用只與窗口長度有關。
+
+    Yields:
+        tuple: (窗口音頻, 窗口起點秒數, 保留區間起點秒數, 保留區間終點秒數)
+    """
+    window = int(window_seconds * SAMPLE_RATE)
+    search = int(search_seconds * SAMPLE_RATE)
+    pad = int(overlap_seconds * SAMPLE_RATE / 2)
+
+    buffer = np.zeros(0, dtype=np.float32)
+    buffer_start = 0  # buffer[0] 在整段音頻中的位置
+    keep_start = 0
+    for block in blocks:
+        buffer = np.concatenate([buffer, block])
+        while buffer_start + len(buffer) >= keep_start + window + search + pad:
+            split = buffer_start + _quietest_point(buffer, keep_start + window - buffer_start, search)
+            start = max(0, keep_start - pad)
+            yield (
+                buffer[start - buffer_start:split + pad - buffer_start],
+                start / SAMPLE_RATE, keep_start / SAMPLE_RATE, split / SAMPLE_RATE
+            )
+            keep_start = split
+            drop = max(0, keep_start - pad) - buffer_start
+            buffer = buffer[drop:]
+            buffer_start += drop
+
+    # 剩餘的音頻作為最後一個窗口，保留其中所有片段
+    if buffer_start + len(buffer) > keep_start:
+        start = max(0, keep_start - pad)
+        yield buffer[start - buffer_start:], start / SAMPLE_RATE, keep_start / SAMPLE_RATE, float("inf")
+
+def iter_transcribe(
+    audio_path: str,
+    model_name: str,
+    device: str,
+    compute_type: str,
+    num_workers: int = 1,
+    window_seconds: float = 30.0,
+    overlap_seconds: float = 1.0,
+    **decode_options: Any
+) -> Iterator[Dict[str, Any]]:
+    """
+    邊解碼邊轉錄音頻文件，按時間順序逐個返回片段
+
+    每轉錄完一個窗口就返回其中的片段，不必等待整段音頻轉錄完成；
+    num_workers 大於 1 時在進程池中並行轉錄後續窗口，同時最多處理 num_workers + 1 個窗口。
+
+    Args:
+        audio_path: 音頻文件路徑
+        model_name: Whisper 模型名稱
+        device: 運行設備
+        compute_type: 計算精度
+        num_workers: 並行轉錄的工作進程數，為 1 時在當前進程中轉錄
+        window_seconds: 每個窗口的目標長度
+        overlap_seconds: 相鄰窗口的重疊長度
+        decode_options: 傳給 Whisper 的其他解碼參數
+
+    Yields:
+        dict: 包含 id、start、end、text 和 language 的片段
+    """
+    windows = iter_windows(iter_audio_blocks(audio_path), window_seconds, overlap_seconds)
+    previous = None
+    count = 0
+    for segments, language, lo, hi in _iter_window_results(
+        windows, model_name, device, compute_type, num_workers, decode_options
+    ):
+        for segment in segments:
+            if _keep_segment(segment, previous, lo, hi):
+                previous = dict(segment, id=count, language=language)
+                count += 1
+                yield previous
+
+def _iter_window_results(
+    windows: Iterator[Tuple[np.ndarray, float, float, float]],
+    model_name: str,
+    device: str,
+    compute_type: str,
+    num_workers: int,
+    decode_options: Dict[str, Any]
+) -> Iterator[Tuple[List[Dict[str, Any]], str, float, float]]:
+    """按窗口順序返回各窗口的轉錄結果"""
+    if num_workers <= 1:
+        for i, (samples, offset, lo, hi) in enumerate(windows):
+            _, segments, language = _transcribe_window(
+                i, samples, offset, model_name, device, compute_type, decode_options
+            )
+            yield segments, language, lo, hi
+        return
+
+    # 進程池的各工作進程平分當前進程可用的線程
+    num_threads = max(1, _thread_budget() // num_workers)
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=context,
+                             initializer=_init_worker, initargs=(num_threads,)) as executor:
+        pending = deque()
+        for i, (samples, offset, lo, hi) in enumerate(windows):
+            pending.append((executor.submit(
+                _transcribe_window, i, samples, offset, model_name, device, compute_type, decode_options
+            ), lo, hi))
+            # 限制同時處理的窗口數量，避免解碼速度快於轉錄時音頻在內存中堆積
+            if len(pending) > num_workers:
+                future, lo, hi = pending.popleft()
+                _, segments, language = future.result()
+                yield segments, language, lo, hi
+        while pending:
+            future, lo, hi = pending.popleft()
+            _, segments, language = future.result()
+            yield segments, language, lo, hi
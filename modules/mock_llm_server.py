@@ -0,0 +1,239 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+import argparse
+import asyncio
+import collections
+import json
+import random
+import threading
+import time
+from modules.llm_client import LLMClient
+
+class MockLLMServer:
+    def __init__(self, port: int = 0, latency: float = 0.2, requests_per_second: Optional[int] = None,
+                 error_rate: float = 0.0, stream_delay: float = 0.01, max_tokens: int = 4096):
+        """
+        模擬 OpenAI 聊天接口的本地服務，用於在不調用真實 API 的情況下測試 LLMClient
+
+        Args:
+            port: 監聽端口，0 表示自動選擇
+            latency: 每個請求的響應延遲（秒）
+            requests_per_second: 每秒接受的請求數，超出時返回 429，None 表示不限制
+            error_rate: 隨機返回 500 錯誤的比例
+            stream_delay: 流式響應中每段文本之間的間隔（秒）
+            max_tokens: 請求的 max_tokens 超過此值或沒有消息時返回 400
+        """
+        self.latency = latency
+        self.requests_per_second = requests_per_second
+        self.error_rate = error_rate
+        self.stream_delay = stream_delay
+        self.max_tokens = max_tokens
+        self.counts = collections.Counter()
+        self._lock = threading.Lock()
+        self._accepted = collections.deque()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """OpenAI 客戶端使用的 base_url"""
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _admit(self) -> Optional[int]:
+        """決定如何響應新請求，返回錯誤狀態碼，接受時返回 None"""
+        with self._lock:
+            self.counts["received"] += 1
+            if self.requests_per_second is not None:
+                now = time.monotonic()
+                while self._accepted and now - self._accepted[0] >= 1:
+                    self._accepted.popleft()
+                if len(self._accepted) >= self.requests_per_second:
+                    self.counts["rate_limited"] += 1
+                    return 429
+                self._accepted.append(now)
+            if random.random() < self.error_rate:
+                self.counts["failed"] += 1
+                return 500
+            self.counts["completed"] += 1
+            return None
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not self.path.endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+
+                if not request.get("messages") or (request.get("max_tokens") or 0) > server.max_tokens:
+                    # 與 OpenAI 相同，無效的請求返回 400，客戶端不應重試
+                    self._send_json(400, {"error": {"message": "Invalid request", "type": "invalid_request_error"}})
+                    return
+
+                status = server._admit()
+                if status == 429:
+                    self._send_json(429, {"error": {"message": "Rate limit reached", "type": "requests"}}, {"Retry-After": "1"})
+                    return
+                if status is not None:
+                    self._send_json(status, {"error": {"message": "Mock server error", "type": "server_error"}})
+                    return
+
+                time.sleep(server.latency)
+                question = request["messages"][-1]["content"] if request.get("messages") else ""
+                answer = f"模擬答案：{question[-30:]}"
+                model = request.get("model", "gpt-4")
+                prompt_tokens = sum(len(message["content"]) for message in request.get("messages", []))
+                if request.get("stream"):
+                    include_usage = (request.get("stream_options") or {}).get("include_usage", False)
+                    self._stream(model, answer, prompt_tokens if include_usage else None)
+                    return
+                self._send_json(200, {
+                    "id": "chatcmpl-mock",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": len(answer),
+                        "total_tokens": prompt_tokens + len(answer)
+                    }
+                })
+
+            def _stream(self, model: str, answer: str, prompt_tokens: Optional[int] = None):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                try:
+                    for start in range(0, len(answer), 4):
+                        chunk = {
+                            "id": "chatcmpl-mock",
+                            "object": "chat.completion.chunk",
+                            "created": int(time.time()),
+                            "model": model,
+                            "choices": [{"index": 0, "delta": {"content": answer[start:start + 4]}, "finish_reason": None}]
+                        }
+                        self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                        self.wfile.flush()
+                        time.sleep(server.stream_delay)
+                    if prompt_tokens is not None:
+                        # 與 OpenAI 相同，用量在最後一段中返回，choices 為空
+                        usage = {
+                            "id": "chatcmpl-mock",
+                            "object": "chat.completion.chunk",
+                            "created": int(time.time()),
+                            "model": model,
+                            "choices": [],
+                            "usage": {
+                                "prompt_tokens": prompt_tokens,
+                                "completion_tokens": len(answer),
+                                "total_tokens": prompt_tokens + len(answer)
+                            }
+                        }
+                        self.wfile.write(f"data: {json.dumps(usage, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客戶端提前結束流式請求（例如語音問答被打斷）
+                    with server._lock:
+                        server.counts["cancelled"] += 1
+
+        return Handler
+
+def _percentile(values: List[float], percent: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+async def _burst(client: LLMClient, requests: int, questions: int) -> List[float]:
+    async def ask(i: int) -> float:
+        started = time.perf_counter()
+        await client.acomplete([{"role": "user", "content": f"第 {i % questions} 個問題：光合作用是什麼？"}], max_tokens=100)
+        return time.perf_counter() - started
+    return await asyncio.gather(*(ask(i) for i in range(requests)))
+
+def burst(requests: int = 60, questions: int = 20, server_rps: int = 5, client_rpm: float = 1000, error_rate: float = 0.05):
+    """
+    模擬課堂上大量學生同時提問：啟動模擬服務並同時發出 requests 個請求
+
+    在項目根目錄運行 python -m modules.mock_llm_server
+
+    Args:
+        requests: 同時發出的請求數
+        questions: 其中不同問題的數量，相同的問題只發送一次
+        server_rps: 模擬服務每秒接受的請求數，超出時返回 429
+        client_rpm: 客戶端的每分鐘請求數限制
+        error_rate: 模擬服務隨機返回 500 的比例
+    """
+    server = MockLLMServer(requests_per_second=server_rps, error_rate=error_rate)
+    server.start()
+    client = LLMClient(api_key="mock", base_url=server.url, requests_per_minute=client_rpm,
+                       base_delay=0.2, max_delay=2.0, max_retries=8)
+    try:
+        started = time.perf_counter()
+        latencies = asyncio.run(_burst(client, requests, questions))
+        elapsed = time.perf_counter() - started
+    finally:
+        client.close()
+        server.stop()
+
+    print(f"{requests} 個請求（{questions} 個不同問題）在 {elapsed:.2f} 秒內全部完成")
+    print(f"延遲 p50 {_percentile(latencies, 50):.2f}s，p95 {_percentile(latencies, 95):.2f}s，p99 {_percentile(latencies, 99):.2f}s")
+    print(f"客戶端：{dict(client.stats)}")
+    print(f"模擬服務：{dict(server.counts)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="模擬 OpenAI 聊天接口的本地服務")
+    parser.add_argument("--serve", action="store_true", help="只啟動模擬服務，不運行突發請求測試")
+    parser.add_argument("--port", type=int, default=8001, help="--serve 時的監聽端口")
+    parser.add_argument("--latency", type=float, default=0.2, help="每個請求的響應延遲（秒）")
+    parser.add_argument("--rps", type=int, default=None,
+                        help="每秒接受的請求數，超出時返回 429；--serve 時默認不限制，突發測試默認為 5")
+    parser.add_argument("--error-rate", type=float, default=None,
+                        help="隨機返回 500 錯誤的比例；--serve 時默認為 0，突發測試默認為 0.05")
+    args = parser.parse_args()
+
+    if not args.serve:
+        burst(
+            server_rps=5 if args.rps is None else args.rps,
+            error_rate=0.05 if args.error_rate is None else args.error_rate
+        )
+        return
+
+    server = MockLLMServer(port=args.port, latency=args.latency, requests_per_second=args.rps,
+                           error_rate=args.error_rate or 0.0)
+    print(f"模擬服務已啟動：OPENAI_BASE_URL={server.url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import gc
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+ModelKey = Tuple[str, str, str]
+
+class ModelRegistry:
+    def __init__(self, idle_timeout: Optional[float] = 600.0):
+        """
+        初始化進程內共享的 Whisper 模型註冊表
+
+        Args:
+            idle_timeout: 模型閒置多少秒後自動卸載，None 表示永不卸載
+        """
+        self.idle_timeout = idle_timeout
+        self._models: Dict[ModelKey, Any] = {}
+        self._last_used: Dict[ModelKey, float] = {}
+        # 正在使用各模型的調用者數量，使用中的模型不會因閒置超時被卸載
+        self._active: Dict[ModelKey, int] = {}
+        self._load_locks: Dict[ModelKey, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._reaper: Optional[threading.Thread] = None
+
+    @staticmethod
+    def resolve_key(name: str = "base", device: Optional[str] = None, compute_type: Optional[str] = None) -> ModelKey:
+        """補全設備和計算精度的默認值，返回模型的唯一鍵"""
+        if device is None:
+            # torch 導入較慢，只在需要判斷設備時才導入
+            import torch
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        if compute_type is None:
+            compute_type = "float32" if device == "cpu" else "float16"
+        return name, device, compute_type
+
+    def get_whisper_model(self, name: str = "base", device: Optional[str] = None, compute_type: Optional[str] = None):
+        """獲取 Whisper 模型，首次使用時才加載，相同配置的調用者共享同一份權重"""
+        key = self.resolve_key(name, device, compute_type)
+
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._last_used[key] = time.monotonic()
+                return model
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        # 每個模型單獨加鎖，避免並行的首次調用重複加載
+        with load_lock:
+            with self._lock:
+                model = self._models.get(key)
+            if model is None:
+                import whisper
+                print(f"正在加載 Whisper 模型：{key[0]} ({key[1]}, {key[2]})...")
+                model = whisper.load_model(key[0], device=key[1])
+            with self._lock:
+                self._models[key] = model
+                self._last_used[key] = time.monotonic()
+                self._start_reaper()
+        return model
+
+    @contextmanager
+    def use_whisper_model(self, name: str = "base", device: Optional[str] = None,
+                          compute_type: Optional[str] = None) -> Iterator[Any]:
+        """
+        獲取 Whisper 模型並在代碼塊中標記為使用中
+
+        轉錄長音頻可能超過閒置超時，使用期間模型不會被卸載，結束時重新計算閒置時間。
+        """
+        key = self.resolve_key(name, device, compute_type)
+        with self._lock:
+            self._active[key] = self._active.get(key, 0) + 1
+        try:
+            yield self.get_whisper_model(*key)
+        finally:
+            with self._lock:
+                self._active[key] -= 1
+                if not self._active[key]:
+                    del self._active[key]
+                if key in self._models:
+                    self._last_used[key] = time.monotonic()
+
+    def unload(self, name: str = "base", device: Optional[str] = None, compute_type: Optional[str] = None) -> bool:
+        """卸載指定的模型，模型正在使用時不卸載"""
+        key = self.resolve_key(name, device, compute_type)
+        with self._lock:
+            if self._active.get(key):
+                print(f"Whisper 模型正在使用，暫不卸載：{key[0]} ({key[1]}, {key[2]})")
+                return False
+            model = self._models.pop(key, None)
+            self._last_used.pop(key, None)
+        if model is None:
+            return False
+        del model
+        self._release([key])
+        return True
+
+    def unload_idle(self) -> int:
+        """卸載閒置超時且沒有調用者正在使用的模型，返回卸載的數量"""
+        if self.idle_timeout is None:
+            return 0
+
+        now = time.monotonic()
+        with self._lock:
+            expired = [
+                key for key, last in self._last_used.items()
+                if now - last >= self.idle_timeout and not self._active.get(key)
+            ]
+            for key in expired:
+                self._models.pop(key, None)
+                self._last_used.pop(key, None)
+
+        if expired:
+            self._release(expired)
+        return len(expired)
+
+    def loaded_models(self) -> Dict[ModelKey, float]:
+        """返回已加載的模型及其閒置秒數"""
+        now = time.monotonic()
+        with self._lock:
+            return {key: now - last for key, last in self._last_used.items()}
+
+    def _release(self, keys):
+        """回收已移出註冊表的模型佔用的內存"""
+        gc.collect()
+        if any(key[1].startswith("cuda") for key in keys):
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        for key in keys:
+            print(f"已卸載 Whisper 模型：{key[0]} ({key[1]}, {key[2]})")
+
+    def _start_reaper(self):
+        """啟動後台線程定期卸載閒置模型（需持有 self._lock）"""
+        if self.idle_timeout is None or (self._reaper is not None and self._reaper.is_alive()):
+            return
+
+        def reap():
+            while True:
+                interval = self.idle_timeout
+                if interval is None:
+                    return
+                time.sleep(max(1.0, min(interval / 2, 60.0)))
+                self.unload_idle()
+                with self._lock:
+                    if not self._models:
+                        self._reaper = None
+                        return
+
+        self._reaper = threading.Thread(target=reap, name="whisper-model-reaper", daemon=True)
+        self._reaper.start()
+
+# 進程內默認的共享註冊表
+default_registry = ModelRegistry()
+
+def get_whisper_model(name: str = "base", device: Optional[str] = None, compute_type: Optional[str] = None):
+    """從默認註冊表獲取 Whisper 模型"""
+    return default_registry.get_whisper_model(name, device, compute_type)
+
+def use_whisper_model(name: str = "base", device: Optional[str] = None, compute_type: Optional[str] = None):
+    """從默認註冊表獲取 Whisper 模型並在代碼塊中標記為使用中"""
+    return default_registry.use_whisper_model(name, device, compute_type)
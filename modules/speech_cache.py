@@ -0,0 +1,123 @@
+from pathlib import Path
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Any, Callable, Dict, Optional
+
+class SpeechCache:
+    def __init__(self, cache_dir: str, max_bytes: int = 128 * 1024 * 1024):
+        """
+        初始化合成語音的磁盤緩存
+
+        每段語音保存為一個音頻文件，文件的修改時間即最近使用時間，
+        總大小超過 max_bytes 時按最近最少使用的順序淘汰。
+        命中時直接返回緩存中的文件路徑用於播放，播放後無需刪除。
+
+        Args:
+            cache_dir: 緩存目錄
+            max_bytes: 緩存在磁盤上的最大總大小
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+
+    @staticmethod
+    def make_key(text: str, lang: str, engine: str, voice_options: Optional[Dict[str, Any]] = None) -> str:
+        """根據文本、語言、語音引擎和語音參數生成緩存鍵"""
+        return hashlib.sha256(json.dumps(
+            {"text": text, "lang": lang, "engine": engine, "voice": voice_options or {}},
+            sort_keys=True,
+            ensure_ascii=False
+        ).encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key: str, suffix: str) -> Path:
+        return self.cache_dir / f"{key}{suffix}"
+
+    def get(self, key: str, suffix: str = ".mp3") -> Optional[str]:
+        """返回緩存的音頻文件路徑，命中時更新其最近使用時間"""
+        path = self._entry_path(key, suffix)
+        try:
+            os.utime(path)
+            return str(path)
+        except FileNotFoundError:
+            return None
+
+    def get_or_create(self, key: str, synthesize: Callable[[str], None], suffix: str = ".mp3") -> Optional[str]:
+        """
+        返回緩存的音頻文件路徑，未命中時調用 synthesize 生成
+
+        Args:
+            key: make_key 生成的緩存鍵
+            synthesize: 將語音寫入給定路徑的函數
+            suffix: 音頻文件擴展名
+
+        Returns:
+            str: 音頻文件路徑，合成失敗時為 None
+        """
+        path = self.get(key, suffix)
+        if path is not None:
+            return path
+
+        # 同一段語音只合成一次，其他線程等待後直接讀取緩存
+        with self._locks_lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            path = self.get(key, suffix)
+            if path is not None:
+                return path
+
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            os.close(fd)
+            try:
+                synthesize(tmp_path)
+                if os.path.getsize(tmp_path) == 0:
+                    raise RuntimeError("合成的語音為空")
+                # 先寫入臨時文件再替換，避免播放不完整的文件
+                path = self._entry_path(key, suffix)
+                os.replace(tmp_path, path)
+            except Exception as e:
+                print(f"語音合成失敗: {str(e)}")
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+                return None
+            finally:
+                with self._locks_lock:
+                    self._locks.pop(key, None)
+
+        self._evict(keep=path)
+        return str(path)
+
+    def _evict(self, keep: Optional[Path] = None):
+        """按最近使用時間淘汰條目，直到總大小不超過限制"""
+        entries = []
+        total = 0
+        for path in self.cache_dir.iterdir():
+            if path.suffix == ".tmp":
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                path.unlink()
+                total -= size
+            except FileNotFoundError:
+                total -= size
+            except OSError:
+                # 正在播放的文件在部分系統上無法刪除，留待下次淘汰
+                pass
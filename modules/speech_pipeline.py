@@ -0,0 +1,107 @@
+from collections import deque
+import contextvars
+import queue
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+_mixer_lock = threading.Lock()
+
+def ensure_mixer():
+    """第一次播放時才初始化 pygame 音頻設備，只用於文字問答時不必等待音頻設備"""
+    import pygame
+    with _mixer_lock:
+        if not pygame.mixer.get_init():
+            pygame.mixer.init()
+    return pygame
+
+class SpeechPipeline:
+    def __init__(self, synthesize: Callable[[str], Optional[str]], lookahead: int = 2, poll_interval: float = 0.02):
+        """
+        逐句合成並連續播放語音
+
+        後台線程按順序將句子合成為音頻文件，同時播放已合成的句子；
+        每段語音都通過 pygame 聲道的隊列接在上一段之後，句子之間沒有間隙。
+
+        Args:
+            synthesize: 將一句話合成為音頻文件並返回其路徑的函數，失敗時返回 None
+            lookahead: 最多提前合成的句子數量
+            poll_interval: 檢查聲道隊列的間隔秒數
+        """
+        self.synthesize = synthesize
+        self.lookahead = lookahead
+        self.poll_interval = poll_interval
+        self._stopped = threading.Event()
+        self._channel = None
+
+    def _produce(self, sentences: Iterable[str], clips: "queue.Queue[Optional[str]]"):
+        """合成線程：逐句合成並交給播放線程"""
+        try:
+            for sentence in sentences:
+                if self._stopped.is_set():
+                    break
+                if not sentence.strip():
+                    continue
+                path = self.synthesize(sentence)
+                if path:
+                    clips.put(path)
+        except Exception as e:
+            print(f"語音合成失敗：{str(e)}")
+        finally:
+            clips.put(None)
+
+    def play(self, sentences: Iterable[str]) -> int:
+        """
+        合成並播放所有句子，播放完成或調用 stop 後返回
+
+        Args:
+            sentences: 要朗讀的句子，可以是仍在生成中的迭代器
+
+        Returns:
+            int: 已排隊播放的語音段數
+        """
+        pygame = ensure_mixer()
+        self._stopped.clear()
+        clips: "queue.Queue[Optional[str]]" = queue.Queue(maxsize=self.lookahead)
+        # 合成線程沿用當前的追蹤上下文
+        producer = threading.Thread(
+            target=contextvars.copy_context().run, args=(self._produce, sentences, clips),
+            name="speech-synthesizer", daemon=True
+        )
+        producer.start()
+
+        # 保留最近的 Sound 對象，避免仍在聲道中播放或排隊時被回收
+        sounds = deque(maxlen=3)
+        played = 0
+        while True:
+            path = clips.get()
+            if path is None:
+                break
+            if self._stopped.is_set():
+                # 停止後只取出剩餘的語音，讓合成線程可以結束
+                continue
+            try:
+                sound = pygame.mixer.Sound(path)
+            except Exception as e:
+                print(f"音頻載入失敗：{str(e)}")
+                continue
+
+            if self._channel is None:
+                self._channel = pygame.mixer.find_channel(True)
+            # 聲道隊列只能容納一段語音，等上一段開始播放後再排入下一段
+            while self._channel.get_queue() is not None and not self._stopped.is_set():
+                time.sleep(self.poll_interval)
+            sounds.append(sound)
+            self._channel.queue(sound)
+            played += 1
+
+        while self._channel is not None and self._channel.get_busy() and not self._stopped.is_set():
+            time.sleep(self.poll_interval)
+        producer.join()
+        return played
+
+    def stop(self):
+        """停止播放，並放棄尚未合成的句子"""
+        self._stopped.set()
+        if self._channel is not None:
+            self._channel.stop()
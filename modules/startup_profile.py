@@ -0,0 +1,119 @@
+from contextlib import contextmanager
+import argparse
+import importlib
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+class StartupProfiler:
+    def __init__(self):
+        """
+        記錄各組件的導入和初始化耗時
+
+        同一組件的同一階段只保留第一次的耗時，即冷啟動時的數值；
+        Streamlit 每次重新運行腳本時重複的記錄（模塊已導入，耗時接近 0）會被忽略。
+        """
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._records: Dict[str, Dict[str, float]] = {}
+
+    def record(self, component: str, phase: str, seconds: float):
+        """記錄組件某一階段（import、init 等）的耗時"""
+        with self._lock:
+            self._records.setdefault(component, {}).setdefault(phase, seconds)
+
+    @contextmanager
+    def measure(self, component: str, phase: str) -> Iterator[None]:
+        """記錄代碼塊的耗時"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(component, phase, time.perf_counter() - started)
+
+    def import_module(self, component: str, module_name: str):
+        """導入組件所需的模塊並記錄導入耗時，導入失敗時不記錄"""
+        started = time.perf_counter()
+        module = importlib.import_module(module_name)
+        self.record(component, "import", time.perf_counter() - started)
+        return module
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """
+        各組件的耗時
+
+        Returns:
+            list: 按首次記錄的順序排列，每項包含 component、import、init（秒，未記錄時為 None）和 total
+        """
+        with self._lock:
+            records = {component: dict(phases) for component, phases in self._records.items()}
+        rows = []
+        for component, phases in records.items():
+            row = {"component": component, "import": phases.get("import"), "init": phases.get("init")}
+            row.update({phase: seconds for phase, seconds in phases.items() if phase not in row})
+            row["total"] = sum(phases.values())
+            rows.append(row)
+        return rows
+
+    def report(self) -> str:
+        """以表格形式返回各組件的耗時"""
+        lines = [f"{'組件':<24}{'導入 (s)':>10}{'初始化 (s)':>12}{'合計 (s)':>10}"]
+        for row in self.summary():
+            import_time = f"{row['import']:.3f}" if row["import"] is not None else "-"
+            init_time = f"{row['init']:.3f}" if row["init"] is not None else "-"
+            lines.append(f"{row['component']:<24}{import_time:>10}{init_time:>12}{row['total']:>10.3f}")
+        return "\n".join(lines)
+
+# 進程內共享的分析器
+profiler = StartupProfiler()
+
+# 應用使用的模塊，按依賴從輕到重排列；後導入的模塊只計入尚未被前面的模塊導入的部分
+PROFILED_MODULES = [
+    "streamlit",
+    "numpy",
+    "modules.text_processor",
+    "modules.ingest_queue",
+    "modules.tts_worker",
+    "modules.answer_cache",
+    "langchain",
+    "modules.vector_store",
+    "chromadb",
+    "faiss",
+    "sentence_transformers",
+    "modules.llm_processor",
+    "torch",
+    "whisper",
+    "modules.audio_processor",
+    "pygame",
+    "pyttsx3",
+    "sounddevice",
+    "gtts",
+    "modules.voice_qa"
+]
+
+def profile_imports(module_names: Optional[List[str]] = None) -> StartupProfiler:
+    """
+    依次導入模塊並記錄每個模塊的導入耗時
+
+    需要在新的進程中運行才能得到冷啟動的數值；未安裝的模塊會被跳過。
+    """
+    imports = StartupProfiler()
+    for module_name in module_names or PROFILED_MODULES:
+        try:
+            imports.import_module(module_name, module_name)
+        except Exception as e:
+            print(f"無法導入 {module_name}：{str(e)}")
+    return imports
+
+def main():
+    parser = argparse.ArgumentParser(description="分析應用各模塊的導入耗時")
+    parser.add_argument("modules", nargs="*", help="要導入的模塊，默認為應用使用的所有模塊")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    imports = profile_imports(args.modules or None)
+    print(imports.report())
+    print(f"合計 {time.perf_counter() - started:.3f} 秒")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import re
+from typing import Dict
+import numpy as np
+
+# 清理文本時保留的字符：文字、空白、中日韓統一表意文字和常用中文標點
+_DISALLOWED = re.compile(r'[^\w\s\u4e00-\u9fff。，！？、]')
+
+# 純 ASCII 文本中不保留的字符（除字母、數字、下劃線和空白外的所有字符），可以直接用 translate 刪除
+_ASCII_DISALLOWED = {
+    code: None for code in range(128)
+    if not (chr(code).isalnum() or chr(code) == "_" or chr(code).isspace())
+}
+
+# 文字系統及其 Unicode 範圍
+SCRIPTS = ("hiragana", "katakana", "hangul", "han", "latin")
+_SCRIPT_RANGES = {
+    "hiragana": [(0x3040, 0x309F)],
+    "katakana": [(0x30A0, 0x30FF)],
+    "hangul": [(0xAC00, 0xD7A3), (0x1100, 0x11FF)],
+    "han": [(0x4E00, 0x9FFF)],
+    "latin": [(0x41, 0x5A), (0x61, 0x7A)]
+}
+
+def _build_buckets():
+    """將各文字系統的範圍展開為有序的邊界，每兩個邊界之間的區間對應一個文字系統（0 表示其他字符）"""
+    ranges = sorted(
+        (low, high + 1, index)
+        for index, script in enumerate(SCRIPTS, start=1)
+        for low, high in _SCRIPT_RANGES[script]
+    )
+    edges, labels = [], [0]
+    for low, end, index in ranges:
+        edges.extend([low, end])
+        labels.extend([index, 0])
+    return np.array(edges, dtype=np.uint32), np.array(labels, dtype=np.intp)
+
+_EDGES, _LABELS = _build_buckets()
+
+# 純 ASCII 文本只可能含拉丁字母，刪除字母後長度的減少量即為字母數量
+_ASCII_LETTERS = bytes(range(0x41, 0x5B)) + bytes(range(0x61, 0x7B))
+
+# 判斷語言時只需知道是否出現某種文字，用預編譯的正則表達式找到第一個字符即可停止
+_KANA = re.compile(r'[\u3040-\u30ff]')
+_HANGUL = re.compile(r'[\uac00-\ud7a3\u1100-\u11ff]')
+_HAN = re.compile(r'[\u4e00-\u9fff]')
+
+def clean_text(text: str) -> str:
+    """
+    合併連續空白並移除特殊字符，結果與逐個 re.sub 的寫法相同
+
+    空白用 str.split 合併；純 ASCII 文本（英文轉錄）用 translate 刪除標點，無需正則表達式。
+    """
+    text = " ".join(text.split())
+    if text.isascii():
+        return text.translate(_ASCII_DISALLOWED).strip()
+    return _DISALLOWED.sub("", text).strip()
+
+def script_counts(text: str) -> Dict[str, int]:
+    """
+    統計文本中各文字系統的字符數量
+
+    純 ASCII 文本（英文答案）只統計字母；其他文本轉為碼位數組，
+    一次向量化的二分查找得到每個字符所屬的區間，再按文字系統計數。
+
+    Returns:
+        dict: hiragana、katakana、hangul、han、latin 各自的字符數量
+    """
+    if text.isascii():
+        data = text.encode("ascii")
+        counts = dict.fromkeys(SCRIPTS, 0)
+        counts["latin"] = len(data) - len(data.translate(None, _ASCII_LETTERS))
+        return counts
+    code_points = np.frombuffer(text.encode("utf-32-le", errors="surrogatepass"), dtype=np.uint32)
+    buckets = np.searchsorted(_EDGES, code_points, side="right")
+    counts = np.bincount(_LABELS[buckets], minlength=len(SCRIPTS) + 1)
+    return {script: int(counts[index]) for index, script in enumerate(SCRIPTS, start=1)}
+
+def detect_language(text: str) -> str:
+    """
+    按文字系統判斷語言：含假名為日文，其次含諺文為韓文，含漢字為中文，否則為英文
+
+    判斷規則與原先逐個字符範圍掃描的實現相同。
+    """
+    if _KANA.search(text):
+        return "ja"
+    if _HANGUL.search(text):
+        return "ko"
+    if _HAN.search(text):
+        return "zh-tw"
+    return "en"
+
+def language_from_counts(counts: Dict[str, int]) -> str:
+    """根據 script_counts 的結果按 detect_language 的規則判斷語言"""
+    if counts["hiragana"] or counts["katakana"]:
+        return "ja"
+    if counts["hangul"]:
+        return "ko"
+    if counts["han"]:
+        return "zh-tw"
+    return "en"
+
+def majority_language(counts: Dict[str, int]) -> str:
+    """
+    按字符數量最多的文字系統判斷語言，用於混合多種語言的答案
+
+    日文的漢字與假名混用，假名數量達到漢字的十分之一時漢字計入日文，
+    否則（例如中文中夾雜一個片假名詞）計入中文。沒有任何可識別的字符時為英文。
+    """
+    kana = counts["hiragana"] + counts["katakana"]
+    han_is_japanese = kana > 0 and kana * 10 >= counts["han"]
+    scores = {
+        "ja": kana + (counts["han"] if han_is_japanese else 0),
+        "ko": counts["hangul"],
+        "zh-tw": 0 if han_is_japanese else counts["han"],
+        "en": counts["latin"]
+    }
+    # 數量相同時按 ja、ko、zh-tw、en 的順序優先
+    language = max(scores, key=scores.get)
+    return language if scores[language] else "en"
@@ -1,10 +1,41 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
+import bisect
 import re
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from modules.text_normalize import clean_text
+
+class SentenceSplitter:
+    """將逐步到達的文本片段切分為完整的句子"""
+    
+    # 中文句末標點直接斷句；英文句號、問號、驚嘆號需要後接空白，避免切開小數和縮寫
+    _BOUNDARY = re.compile(r'[。！？]+[」』”’）)]*|[.!?]+[\"\')\]]*(?=\s)|\n+')
+    
+    def __init__(self):
+        self._buffer = ""
+    
+    def feed(self, text: str) -> List[str]:
+        """加入新的文本片段，返回其中已經完整的句子"""
+        self._buffer += text
+        sentences = []
+        start = 0
+        for match in self._BOUNDARY.finditer(self._buffer):
+            sentence = self._buffer[start:match.end()].strip()
+            if sentence:
+                sentences.append(sentence)
+            start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+    
+    def flush(self) -> List[str]:
+        """返回緩衝區中剩餘的不完整句子"""
+        rest = self._buffer.strip()
+        self._buffer = ""
+        return [rest] if rest else []
 
 class TextProcessor:
     def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200):
         """初始化文本處理器"""
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        self.chunk_size = chunk_size
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
@@ -17,12 +48,93 @@ class TextProcessor:
         return self.text_splitter.split_text(text)
     
     def clean_text(self, text: str) -> str:
-        """清理文本"""
-        # 移除多餘的空白字符
-        text = re.sub(r'\s+', ' ', text)
-        # 移除特殊字符
-        text = re.sub(r'[^\w\s\u4e00-\u9fff。，！？、]', '', text)
-        return text.strip()
+        """清理文本：合併多餘的空白字符並移除特殊字符"""
+        return clean_text(text)
+    
+    def iter_chunks(self, texts: Iterable[str]) -> Iterator[str]:
+        """
+        將逐段到達的文本（如 Whisper 的轉錄片段）清理後分塊，每湊滿一塊就立即返回
+        
+        使用與 split_text 相同的分割規則，只緩衝尚未輸出的文本，內存佔用與文本總長度無關。
+        """
+        for chunk in self.iter_timed_chunks({"text": text} for text in texts):
+            yield chunk["text"]
+    
+    def iter_timed_chunks(self, segments: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """
+        與 iter_chunks 相同地分塊，並記錄每塊對應的音頻時間範圍
+        
+        Args:
+            segments: 包含 text 以及可選的 start、end（秒）的片段，如 Whisper 的轉錄片段
+            
+        Yields:
+            dict: text 為文本塊，start、end 為其覆蓋的第一個和最後一個片段的起止時間，片段沒有時間時為 None
+        """
+        buffer = ""
+        # 每個片段在緩衝區中的起始位置及其起止時間
+        spans: List[Tuple[int, Optional[float], Optional[float]]] = []
+        for segment in segments:
+            text = segment["text"]
+            cleaned = self.clean_text(text)
+            if not cleaned:
+                continue
+            # 英文等片段以空格開頭，拼接時保留一個空格
+            if buffer and text[:1].isspace():
+                buffer += " "
+            spans.append((len(buffer), segment.get("start"), segment.get("end")))
+            buffer += cleaned
+            
+            # 緩衝足夠長時才切分，最後一塊可能還不完整，留到後續文本到達後再切分
+            if len(buffer) >= 2 * self.chunk_size:
+                chunks = self.split_text(buffer)
+                if len(chunks) > 1:
+                    positions = self._locate_chunks(buffer, chunks)
+                    for chunk, position in zip(chunks[:-1], positions[:-1]):
+                        yield self._timed_chunk(chunk, position, spans)
+                    buffer, spans = self._drop_prefix(buffer, spans, positions[-1])
+        
+        if buffer:
+            chunks = self.split_text(buffer)
+            for chunk, position in zip(chunks, self._locate_chunks(buffer, chunks)):
+                yield self._timed_chunk(chunk, position, spans)
+    
+    @staticmethod
+    def _locate_chunks(buffer: str, chunks: List[str]) -> List[int]:
+        """找出各文本塊在緩衝區中的起始位置，相鄰的塊可能重疊"""
+        positions = []
+        cursor = 0
+        for chunk in chunks:
+            position = buffer.find(chunk, cursor)
+            if position < 0:
+                position = cursor
+            positions.append(position)
+            cursor = position + 1
+        return positions
+    
+    @staticmethod
+    def _timed_chunk(chunk: str, position: int, spans: List[Tuple[int, Optional[float], Optional[float]]]) -> Dict[str, Any]:
+        offsets = [offset for offset, _, _ in spans]
+        first = max(bisect.bisect_right(offsets, position) - 1, 0)
+        last = max(bisect.bisect_right(offsets, position + len(chunk) - 1) - 1, first)
+        return {"text": chunk, "start": spans[first][1], "end": spans[last][2]}
+    
+    @staticmethod
+    def _drop_prefix(buffer: str, spans: List[Tuple[int, Optional[float], Optional[float]]], position: int):
+        """丟棄緩衝區中已輸出的部分，並保留仍與剩餘文本重疊的片段"""
+        kept = []
+        for i, (offset, start, end) in enumerate(spans):
+            segment_end = spans[i + 1][0] if i + 1 < len(spans) else len(buffer)
+            if segment_end > position:
+                kept.append((max(offset - position, 0), start, end))
+        return buffer[position:], kept
+    
+    @staticmethod
+    def iter_sentences(tokens: Iterable[str]) -> Iterator[str]:
+        """將流式輸出的文本片段按句子邊界重新組合，每完成一句就立即返回"""
+        splitter = SentenceSplitter()
+        for token in tokens:
+            yield from splitter.feed(token)
+        yield from splitter.flush()
     
     def format_qa_prompt(self, question: str, context: str) -> str:
         """格式化問答提示"""
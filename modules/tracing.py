@@ -0,0 +1,275 @@
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from collections import Counter, defaultdict, deque
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterator, List, Optional
+import numpy as np
+
+# 問答管線各階段的名稱
+STAGES = {
+    "ask_question": "語音提問（合計）",
+    "response": "說完到開始播放",
+    "audio_capture": "錄音",
+    "decode": "音頻解碼",
+    "whisper": "Whisper 轉錄",
+    "answer": "回答（合計）",
+    "retrieval": "檢索（合計）",
+    "embedding": "嵌入計算",
+    "ann_search": "向量檢索",
+    "lexical_search": "關鍵詞檢索",
+    "llm_first_token": "LLM 首個 token",
+    "llm_total": "LLM 合計",
+    "tts": "語音合成",
+    "speak": "本地朗讀（合成和播放）",
+    "playback": "播放"
+}
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# 當前線程或協程中正在進行的 span，子 span 以其為父節點
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+def _new_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+class Tracer:
+    def __init__(self, max_samples: int = 2048):
+        """
+        輕量的延遲追蹤
+
+        每個階段以 span 記錄耗時，同一次提問中的 span 共用 trace_id 並記錄父子關係；
+        每個階段保留最近 max_samples 次的耗時用於計算 p50/p95/p99。
+        完成的 span 可以寫入 JSONL 文件，統計結果可以通過 Prometheus 文本格式的 HTTP 端點導出。
+
+        Args:
+            max_samples: 每個階段保留的最近耗時數量
+        """
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._durations: Dict[str, deque] = {}
+        self._counts: Counter = Counter()
+        self._errors: Counter = Counter()
+        self._sums: Dict[str, float] = defaultdict(float)
+        # 最近完成的 span，用於查看單次提問的各階段耗時
+        self._recent: deque = deque(maxlen=512)
+        self._log_path: Optional[Path] = None
+        self._log_file = None
+        self._max_log_bytes = 0
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def configure(self, log_path: Optional[str] = None, max_log_bytes: int = 10 * 1024 * 1024):
+        """
+        設置 JSONL 導出文件
+
+        Args:
+            log_path: span 的寫入路徑，None 表示不寫入文件
+            max_log_bytes: 文件超過此大小時改名為 .1 後重新開始寫入
+        """
+        with self._lock:
+            if self._log_file is not None:
+                self._log_file.close()
+                self._log_file = None
+            self._log_path = Path(log_path) if log_path else None
+            self._max_log_bytes = max_log_bytes
+            if self._log_path is not None:
+                self._log_path.parent.mkdir(parents=True, exist_ok=True)
+                self._log_file = open(self._log_path, "a", encoding="utf-8")
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Dict[str, Any]]:
+        """
+        記錄代碼塊的耗時，代碼塊中可以通過返回的 span["attributes"] 補充屬性
+
+        不要在生成器中跨 yield 使用，生成器的耗時用 record 記錄。
+        """
+        parent = _current_span.get()
+        span = {
+            "trace_id": parent["trace_id"] if parent else _new_id(),
+            "span_id": _new_id(),
+            "parent_id": parent["span_id"] if parent else None,
+            "name": name,
+            "attributes": attributes
+        }
+        token = _current_span.set(span)
+        started_at = time.time()
+        started = time.perf_counter()
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            try:
+                _current_span.reset(token)
+            except ValueError:
+                _current_span.set(parent)
+            self._finish(span, started_at, time.perf_counter() - started, error)
+
+    def record(self, name: str, seconds: float, error: Optional[str] = None, **attributes):
+        """記錄已經完成的階段，例如在生成器中測得的首個 token 時間"""
+        parent = _current_span.get()
+        span = {
+            "trace_id": parent["trace_id"] if parent else _new_id(),
+            "span_id": _new_id(),
+            "parent_id": parent["span_id"] if parent else None,
+            "name": name,
+            "attributes": attributes
+        }
+        self._finish(span, time.time() - seconds, seconds, error)
+
+    def _finish(self, span: Dict[str, Any], started_at: float, duration: float, error: Optional[str]):
+        name = span["name"]
+        with self._lock:
+            samples = self._durations.get(name)
+            if samples is None:
+                samples = self._durations[name] = deque(maxlen=self.max_samples)
+            samples.append(duration)
+            self._counts[name] += 1
+            self._sums[name] += duration
+            if error:
+                self._errors[name] += 1
+            record = dict(span, start=round(started_at, 6), duration=round(duration, 6), error=error)
+            self._recent.append(record)
+            if self._log_file is not None:
+                self._write(record)
+
+    def _write(self, record: Dict[str, Any]):
+        try:
+            self._log_file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            self._log_file.flush()
+            if self._max_log_bytes and self._log_file.tell() > self._max_log_bytes:
+                self._log_file.close()
+                os.replace(self._log_path, f"{self._log_path}.1")
+                self._log_file = open(self._log_path, "a", encoding="utf-8")
+        except Exception as e:
+            print(f"寫入追蹤記錄失敗：{str(e)}")
+
+    def recent_traces(self, limit: int = 5) -> List[List[Dict[str, Any]]]:
+        """
+        最近的 limit 次追蹤
+
+        Returns:
+            list: 從新到舊排列，每項為同一 trace_id 的 span，按開始時間排列
+        """
+        with self._lock:
+            records = list(self._recent)
+        traces: Dict[str, List[Dict[str, Any]]] = {}
+        for record in reversed(records):
+            if record["trace_id"] not in traces:
+                if len(traces) >= limit:
+                    continue
+                traces[record["trace_id"]] = []
+            traces[record["trace_id"]].append(record)
+        return [sorted(spans, key=lambda span: span["start"]) for spans in traces.values()]
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        各階段的耗時統計
+
+        Returns:
+            dict: 階段名稱到 count、errors、total（累計秒數）、mean、p50、p95、p99、max 的映射，
+                  分位數按最近 max_samples 次計算
+        """
+        with self._lock:
+            snapshot = {
+                name: (np.fromiter(samples, dtype=np.float64), self._counts[name], self._errors[name], self._sums[name])
+                for name, samples in self._durations.items()
+            }
+        stats = {}
+        for name, (samples, count, errors, total) in snapshot.items():
+            p50, p95, p99 = np.percentile(samples, [q * 100 for q in QUANTILES])
+            stats[name] = {
+                "count": count,
+                "errors": errors,
+                "total": total,
+                "mean": total / count,
+                "p50": float(p50),
+                "p95": float(p95),
+                "p99": float(p99),
+                "max": float(samples.max())
+            }
+        return stats
+
+    def report(self) -> str:
+        """以表格形式返回各階段的耗時（毫秒），按累計耗時從高到低排列"""
+        lines = [f"{'階段':<20}{'次數':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'合計 (s)':>12}"]
+        for name, stat in sorted(self.stats().items(), key=lambda item: item[1]["total"], reverse=True):
+            lines.append(
+                f"{name:<20}{stat['count']:>8}{stat['p50'] * 1000:>10.1f}{stat['p95'] * 1000:>10.1f}"
+                f"{stat['p99'] * 1000:>10.1f}{stat['total']:>12.2f}"
+            )
+        return "\n".join(lines)
+
+    def prometheus_text(self) -> str:
+        """以 Prometheus 文本格式導出各階段的耗時"""
+        stats = self.stats()
+        lines = [
+            "# HELP qa_stage_duration_seconds Latency of QA pipeline stages.",
+            "# TYPE qa_stage_duration_seconds summary"
+        ]
+        for name, stat in stats.items():
+            for quantile, key in zip(QUANTILES, ("p50", "p95", "p99")):
+                lines.append(f'qa_stage_duration_seconds{{stage="{name}",quantile="{quantile}"}} {stat[key]:.6f}')
+            lines.append(f'qa_stage_duration_seconds_sum{{stage="{name}"}} {stat["total"]:.6f}')
+            lines.append(f'qa_stage_duration_seconds_count{{stage="{name}"}} {stat["count"]}')
+        lines.append("# HELP qa_stage_errors_total Failed QA pipeline stages.")
+        lines.append("# TYPE qa_stage_errors_total counter")
+        for name, stat in stats.items():
+            lines.append(f'qa_stage_errors_total{{stage="{name}"}} {stat["errors"]}')
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> bool:
+        """
+        在後台線程中啟動 Prometheus 抓取端點（/metrics），已啟動時不做任何事
+
+        Returns:
+            bool: 端點是否在運行
+        """
+        with self._lock:
+            if self._server is not None:
+                return True
+            tracer = self
+
+            class MetricsHandler(BaseHTTPRequestHandler):
+                def log_message(self, format, *args):
+                    pass
+
+                def do_GET(self):
+                    if self.path.split("?")[0] != "/metrics":
+                        self.send_error(404)
+                        return
+                    body = tracer.prometheus_text().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+            try:
+                self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+            except OSError as e:
+                print(f"無法啟動指標端點（端口 {port}）：{str(e)}")
+                return False
+            self._server.daemon_threads = True
+            threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True).start()
+            print(f"指標端點已啟動：http://{host}:{port}/metrics")
+            return True
+
+    def reset(self):
+        """清空統計數據"""
+        with self._lock:
+            self._durations.clear()
+            self._counts.clear()
+            self._errors.clear()
+            self._sums.clear()
+            self._recent.clear()
+
+# 進程內共享的追蹤器
+tracer = Tracer()
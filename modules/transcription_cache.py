@@ -0,0 +1,119 @@
+from pathlib import Path
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any, Dict, List, Optional
+
+class TranscriptionCache:
+    # 條目中引用的轉錄文件和片段文件，計入緩存大小並隨條目一起淘汰
+    FILE_FIELDS = ("transcript_path", "segments_path")
+
+    def __init__(self, cache_dir: str, max_bytes: int = 256 * 1024 * 1024):
+        """
+        初始化以音頻內容為鍵的轉錄緩存
+
+        每個條目保存為一個 JSON 文件，文件的修改時間即最近使用時間；
+        條目及其引用的轉錄文件的總大小超過 max_bytes 時按最近最少使用的順序一起淘汰。
+
+        Args:
+            cache_dir: 緩存目錄
+            max_bytes: 緩存在磁盤上的最大總大小，包括條目引用的轉錄文件
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def make_key(audio_path: str, model_name: str, decode_options: Dict[str, Any]) -> str:
+        """根據音頻內容的 SHA-256、模型名稱和解碼參數生成緩存鍵"""
+        digest = hashlib.sha256()
+        with open(audio_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        digest.update(json.dumps(
+            {"model": model_name, "options": decode_options},
+            sort_keys=True
+        ).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """讀取緩存條目，命中時更新其最近使用時間"""
+        path = self._entry_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path)
+            return entry
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"讀取轉錄緩存失敗: {str(e)}")
+            return None
+
+    def put(self, key: str, entry: Dict[str, Any]):
+        """寫入緩存條目，並在超出大小限制時淘汰舊條目"""
+        try:
+            # 先寫入臨時文件再替換，避免並行讀取到不完整的條目
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, self._entry_path(key))
+            self._evict(keep=self._entry_path(key))
+        except Exception as e:
+            print(f"寫入轉錄緩存失敗: {str(e)}")
+
+    def update(self, key: str, **fields: Any) -> bool:
+        """更新已有緩存條目的部分字段"""
+        entry = self.get(key)
+        if entry is None:
+            return False
+        entry.update(fields)
+        self.put(key, entry)
+        return True
+
+    def _entry_files(self, path: Path) -> List[Path]:
+        """條目文件及其引用的轉錄文件"""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return [path]
+        return [path] + [Path(entry[field]) for field in self.FILE_FIELDS if entry.get(field)]
+
+    @staticmethod
+    def _file_size(path: Path) -> int:
+        try:
+            return path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def _evict(self, keep: Optional[Path] = None):
+        """按最近使用時間淘汰條目及其引用的文件，直到總大小不超過限制；剛寫入的條目 keep 不淘汰"""
+        entries = []
+        total = 0
+        for path in self.cache_dir.glob("*.json"):
+            try:
+                mtime = path.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            files = self._entry_files(path)
+            size = sum(self._file_size(file) for file in files)
+            entries.append((mtime, path, size, files))
+            total += size
+
+        entries.sort()
+        for _, path, size, files in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            for file in files:
+                try:
+                    file.unlink()
+                except FileNotFoundError:
+                    pass
+            total -= size
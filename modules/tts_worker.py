@@ -0,0 +1,295 @@
+import atexit
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+def select_voice(engine) -> Optional[str]:
+    """選擇中文語音，優先使用 Microsoft 的中文語音"""
+    default_voice = None
+    chinese_voice = None
+    for voice in engine.getProperty('voices'):
+        if "chinese" in voice.name.lower() or "mandarin" in voice.name.lower() or "zh" in voice.id.lower():
+            chinese_voice = voice.id
+        if "microsoft" in voice.name.lower() and ("chinese" in voice.name.lower() or "zh" in voice.id.lower()):
+            default_voice = voice.id
+            break
+    return default_voice or chinese_voice
+
+def _worker_main(requests, results, cancel_generation, heartbeat, rate: int, volume: float):
+    """TTS 工作進程：只初始化一次 pyttsx3 引擎，然後依次處理朗讀或合成到文件的請求"""
+    try:
+        import pyttsx3
+        engine = pyttsx3.init()
+        voices = engine.getProperty('voices')
+        voice = select_voice(engine)
+        if voice:
+            engine.setProperty('voice', voice)
+        engine.setProperty('rate', rate)
+        engine.setProperty('volume', volume)
+        driver = getattr(getattr(engine, 'proxy', None), '_driver', None)
+        results.put(("ready", None, {
+            "voice": voice,
+            "voices": [v.name for v in voices if v.name],
+            "driver": type(driver).__module__ if driver is not None else None
+        }))
+    except Exception as e:
+        results.put(("ready", None, {"error": str(e)}))
+        return
+
+    # 使用外部事件循環，朗讀過程中可以檢查取消請求
+    engine.startLoop(False)
+    try:
+        while True:
+            heartbeat.value = time.time()
+            try:
+                request = requests.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            if request is None:
+                break
+
+            request_id, text, generation, output_path = request
+            if generation < cancel_generation.value:
+                results.put(("done", request_id, {"ok": False, "cancelled": True}))
+                continue
+
+            try:
+                if output_path:
+                    engine.save_to_file(text, output_path)
+                else:
+                    engine.say(text)
+                cancelled = False
+                while True:
+                    engine.iterate()
+                    heartbeat.value = time.time()
+                    if generation < cancel_generation.value:
+                        engine.stop()
+                        cancelled = True
+                        break
+                    if not engine.isBusy():
+                        break
+                    time.sleep(0.01)
+                results.put(("done", request_id, {"ok": not cancelled, "cancelled": cancelled}))
+            except Exception as e:
+                results.put(("done", request_id, {"ok": False, "error": str(e)}))
+    finally:
+        engine.endLoop()
+
+class TTSWorker:
+    def __init__(self, rate: int = 180, volume: float = 0.9, startup_timeout: float = 30.0):
+        """
+        常駐的本地 TTS 工作進程
+
+        pyttsx3 引擎和語音只在工作進程啟動時初始化一次，之後的朗讀請求通過隊列發送，
+        同一進程內的 Streamlit 應用和 VoiceQA 共用同一個工作進程。
+
+        Args:
+            rate: 語速
+            volume: 音量 (0.0 到 1.0)
+            startup_timeout: 等待工作進程初始化引擎的最長秒數
+        """
+        self.rate = rate
+        self.volume = volume
+        self.startup_timeout = startup_timeout
+
+        self._context = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._process = None
+        self._requests = None
+        self._results = None
+        self._cancel_generation = None
+        self._heartbeat = None
+        self._dispatcher = None
+        self._ready = threading.Event()
+        self._info: Dict[str, Any] = {}
+        self._pending: Dict[int, Tuple[threading.Event, Dict[str, Any]]] = {}
+        self._ids = itertools.count()
+        self.last_error: Optional[str] = None
+
+    def start(self, wait: bool = True) -> bool:
+        """
+        啟動工作進程（已在運行時不做任何事），返回引擎是否可用
+
+        Args:
+            wait: 是否等待引擎初始化完成；不等待時只啟動進程並返回 True，
+                  之後的朗讀或合成請求會等待引擎就緒
+        """
+        with self._lock:
+            running = self._process is not None and self._process.is_alive()
+            if running and (self._ready.is_set() or not wait):
+                return "error" not in self._info
+            if not running:
+                self._spawn()
+
+        if not wait:
+            return True
+        if not self._ready.wait(self.startup_timeout):
+            self.last_error = "TTS 工作進程啟動超時"
+            return False
+        if "error" in self._info:
+            self.last_error = self._info["error"]
+            return False
+        return True
+
+    def _spawn(self):
+        """啟動新的工作進程和分發線程（需持有 self._lock）"""
+        self._requests = self._context.Queue()
+        self._results = self._context.Queue()
+        self._cancel_generation = self._context.Value('i', 0)
+        self._heartbeat = self._context.Value('d', time.time())
+        self._ready.clear()
+        self._info = {}
+        self._process = self._context.Process(
+            target=_worker_main,
+            args=(self._requests, self._results, self._cancel_generation, self._heartbeat, self.rate, self.volume),
+            name="tts-worker",
+            daemon=True
+        )
+        self._process.start()
+        self._dispatcher = threading.Thread(target=self._dispatch, args=(self._results, self._process), name="tts-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def _dispatch(self, results, process):
+        """將工作進程的結果交給等待中的請求"""
+        while process.is_alive() or not results.empty():
+            try:
+                kind, request_id, payload = results.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+            if kind == "ready":
+                self._info = payload
+                if "error" not in payload:
+                    print("本地 TTS 工作進程已啟動")
+                self._ready.set()
+                continue
+            waiter = self._pending.pop(request_id, None)
+            if waiter is not None:
+                event, result = waiter
+                result.update(payload)
+                event.set()
+
+        # 工作進程退出時，喚醒所有仍在等待的請求
+        if not self._ready.is_set():
+            self._info = {"error": f"TTS 工作進程已退出（退出碼 {process.exitcode}）"}
+            self._ready.set()
+        for event, result in list(self._pending.values()):
+            result.setdefault("error", "TTS 工作進程已退出")
+            event.set()
+        self._pending.clear()
+
+    def speak(self, text: str, wait: bool = True, timeout: Optional[float] = 120.0) -> bool:
+        """
+        朗讀文本
+
+        Args:
+            text: 要朗讀的文本
+            wait: 是否等待朗讀完成
+            timeout: 等待的最長秒數
+
+        Returns:
+            bool: 不等待時表示請求是否已發送，等待時表示是否完整朗讀
+        """
+        if not text or not text.strip():
+            return True
+        return self._submit(text, None, wait, timeout)
+
+    def synthesize(self, text: str, output_path: str, timeout: Optional[float] = 120.0) -> bool:
+        """
+        將文本合成為音頻文件而不播放，供逐句預先合成後排隊播放
+
+        Args:
+            text: 要合成的文本
+            output_path: 輸出的音頻文件路徑（格式由系統的語音驅動決定，通常為 WAV）
+            timeout: 等待的最長秒數
+
+        Returns:
+            bool: 是否合成成功
+        """
+        return self._submit(text, output_path, True, timeout)
+
+    def _submit(self, text: str, output_path: Optional[str], wait: bool, timeout: Optional[float]) -> bool:
+        """發送請求，需要時等待工作進程完成"""
+        if not self.start():
+            return False
+
+        request_id = next(self._ids)
+        event = threading.Event()
+        result: Dict[str, Any] = {}
+        if wait:
+            self._pending[request_id] = (event, result)
+        self._requests.put((request_id, text, self._cancel_generation.value, output_path))
+        if not wait:
+            return True
+
+        # 分段等待，工作進程意外退出時不必等到超時
+        process = self._process
+        deadline = None if timeout is None else time.time() + timeout
+        while not event.wait(0.5):
+            if process is None or not process.is_alive():
+                self._pending.pop(request_id, None)
+                self.last_error = "TTS 工作進程已退出"
+                return False
+            if deadline is not None and time.time() >= deadline:
+                self._pending.pop(request_id, None)
+                self.last_error = "朗讀超時"
+                return False
+        if result.get("error"):
+            self.last_error = result["error"]
+        return bool(result.get("ok"))
+
+    def cancel(self):
+        """停止正在朗讀的內容，並丟棄所有排隊中的請求"""
+        if self._cancel_generation is not None:
+            with self._cancel_generation.get_lock():
+                self._cancel_generation.value += 1
+
+    def health(self) -> Dict[str, Any]:
+        """返回工作進程的狀態"""
+        alive = self._process is not None and self._process.is_alive()
+        return {
+            "alive": alive,
+            "pid": self._process.pid if self._process is not None else None,
+            "ready": self._ready.is_set() and "error" not in self._info,
+            "heartbeat_age": time.time() - self._heartbeat.value if alive else None,
+            "pending": len(self._pending),
+            "voice": self._info.get("voice"),
+            "voices": self._info.get("voices", []),
+            "driver": self._info.get("driver"),
+            "last_error": self._info.get("error") or self.last_error
+        }
+
+    def voice_options(self) -> Dict[str, Any]:
+        """影響合成結果的語音參數，用作語音緩存鍵的一部分"""
+        return {"rate": self.rate, "volume": self.volume, "voice": self._info.get("voice")}
+
+    def close(self, timeout: float = 5.0):
+        """停止工作進程"""
+        with self._lock:
+            if self._process is None:
+                return
+            self.cancel()
+            try:
+                self._requests.put(None)
+            except Exception:
+                pass
+            self._process.join(timeout)
+            if self._process.is_alive():
+                self._process.terminate()
+            self._process = None
+
+_default_worker: Optional[TTSWorker] = None
+_default_lock = threading.Lock()
+
+def get_tts_worker() -> TTSWorker:
+    """返回進程內共享的 TTS 工作進程，進程退出時自動關閉"""
+    global _default_worker
+    with _default_lock:
+        if _default_worker is None:
+            _default_worker = TTSWorker()
+            atexit.register(_default_worker.close)
+        return _default_worker
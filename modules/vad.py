@@ -0,0 +1,251 @@
+from collections import deque
+import queue
+import threading
+from typing import Callable, List, Optional
+import numpy as np
+
+class EnergyVAD:
+    def __init__(self, threshold_ratio: float = 3.0, min_threshold: float = 0.01, noise_alpha: float = 0.05):
+        """
+        基於能量的語音活動檢測
+
+        背景噪聲的能量以指數移動平均持續估計，
+        幀能量超過噪聲能量的 threshold_ratio 倍且不低於 min_threshold 時判定為語音。
+
+        Args:
+            threshold_ratio: 語音能量與背景噪聲能量的最小比值
+            min_threshold: 判定為語音的最低 RMS 能量
+            noise_alpha: 背景噪聲估計的更新速度
+        """
+        self.threshold_ratio = threshold_ratio
+        self.min_threshold = min_threshold
+        self.noise_alpha = noise_alpha
+        self.noise_floor: Optional[float] = None
+
+    @staticmethod
+    def energy(frame: np.ndarray) -> float:
+        return float(np.sqrt(np.mean(np.square(frame, dtype=np.float32))))
+
+    def threshold(self) -> float:
+        """當前判定為語音的 RMS 能量門限"""
+        return max(self.min_threshold, (self.noise_floor or 0.0) * self.threshold_ratio)
+
+    def is_speech(self, frame: np.ndarray) -> bool:
+        """判斷一幀音頻是否為語音"""
+        energy = self.energy(frame)
+        if self.noise_floor is None:
+            self.noise_floor = energy
+
+        speech = energy > self.threshold()
+        if not speech:
+            self.noise_floor += self.noise_alpha * (energy - self.noise_floor)
+        return speech
+
+class PlaybackAwareVAD(EnergyVAD):
+    def __init__(self, is_playing: Callable[[], bool], barge_in_ratio: Optional[float] = None, **options):
+        """
+        考慮揚聲器正在播放答案的語音活動檢測
+
+        外放時麥克風會錄到答案本身，能量 VAD 無法區分；播放期間默認不判定為語音，
+        避免答案被當作新的問題或打斷自己。播放期間的音頻也不用於更新背景噪聲。
+
+        Args:
+            is_playing: 返回揚聲器是否正在播放的函數
+            barge_in_ratio: 允許播放時打斷的門限倍數，播放期間能量超過平時門限的此倍數才判定為語音；
+                            None 表示播放期間不檢測語音
+            options: 傳給 EnergyVAD 的參數
+        """
+        super().__init__(**options)
+        self.is_playing = is_playing
+        self.barge_in_ratio = barge_in_ratio
+
+    def is_speech(self, frame: np.ndarray) -> bool:
+        if not self.is_playing():
+            return super().is_speech(frame)
+        if self.barge_in_ratio is None or self.noise_floor is None:
+            return False
+        return self.energy(frame) > self.threshold() * self.barge_in_ratio
+
+class UtteranceSegmenter:
+    def __init__(
+        self,
+        vad: EnergyVAD,
+        sample_rate: int = 16000,
+        frame_ms: int = 30,
+        pre_roll_ms: int = 300,
+        segment_pause_ms: int = 400,
+        min_segment_ms: int = 3000,
+        end_silence_ms: int = 800,
+        max_utterance_ms: int = 30000
+    ):
+        """
+        將逐幀到達的音頻切分為一句話
+
+        說話過程中遇到短暫停頓且當前片段足夠長時，先交出該片段供轉錄；
+        靜音持續 end_silence_ms 後認為這句話結束。
+
+        Args:
+            vad: 語音活動檢測器
+            sample_rate: 採樣率
+            frame_ms: 每幀的長度
+            pre_roll_ms: 保留語音開始前的音頻長度，避免切掉第一個字
+            segment_pause_ms: 交出中間片段所需的停頓長度
+            min_segment_ms: 中間片段的最短長度
+            end_silence_ms: 判定說話結束的靜音長度
+            max_utterance_ms: 一句話的最長長度
+        """
+        self.vad = vad
+        self.sample_rate = sample_rate
+        self.frame_ms = frame_ms
+        self.segment_pause_ms = segment_pause_ms
+        self.min_segment_ms = min_segment_ms
+        self.end_silence_ms = end_silence_ms
+        self.max_utterance_ms = max_utterance_ms
+
+        self._pre_roll = deque(maxlen=max(1, pre_roll_ms // frame_ms))
+        self._current: List[np.ndarray] = []
+        self._current_has_speech = False
+        self._silence_ms = 0
+        self._utterance_ms = 0
+        self.frames: List[np.ndarray] = []
+        self.started = False
+        self.done = False
+
+    def _take_segment(self, keep_silence_ms: int) -> Optional[np.ndarray]:
+        """取出當前片段，只保留末尾 keep_silence_ms 的靜音"""
+        frames = self._current
+        if self._silence_ms > keep_silence_ms:
+            drop = min(len(frames), (self._silence_ms - keep_silence_ms) // self.frame_ms)
+            frames = frames[:len(frames) - drop] if drop else frames
+        has_speech = self._current_has_speech
+        self._current = []
+        self._current_has_speech = False
+        if not has_speech or not frames:
+            return None
+        return np.concatenate(frames)
+
+    def feed(self, frame: np.ndarray) -> List[np.ndarray]:
+        """
+        加入一幀音頻
+
+        Returns:
+            list: 已經可以轉錄的片段，通常為空
+        """
+        if self.done:
+            return []
+
+        speech = self.vad.is_speech(frame)
+        if not self.started:
+            self._pre_roll.append(frame)
+            if not speech:
+                return []
+            self.started = True
+            self._current = list(self._pre_roll)
+            self.frames.extend(self._pre_roll)
+            self._current_has_speech = True
+            self._silence_ms = 0
+            self._utterance_ms = len(self._current) * self.frame_ms
+            return []
+
+        self._current.append(frame)
+        self.frames.append(frame)
+        self._utterance_ms += self.frame_ms
+        if speech:
+            self._current_has_speech = True
+            self._silence_ms = 0
+        else:
+            self._silence_ms += self.frame_ms
+
+        segments = []
+        if self._silence_ms >= self.end_silence_ms or self._utterance_ms >= self.max_utterance_ms:
+            segment = self._take_segment(keep_silence_ms=200)
+            if segment is not None:
+                segments.append(segment)
+            self.done = True
+        elif (self._silence_ms >= self.segment_pause_ms
+              and len(self._current) * self.frame_ms >= self.min_segment_ms
+              and self._current_has_speech):
+            segment = self._take_segment(keep_silence_ms=self.segment_pause_ms)
+            if segment is not None:
+                segments.append(segment)
+        return segments
+
+    def utterance(self) -> np.ndarray:
+        """返回這句話的完整音頻"""
+        if not self.frames:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(self.frames)
+
+class StreamingRecorder:
+    def __init__(self, sample_rate: int = 16000, frame_ms: int = 30, **segmenter_options):
+        """
+        以 sounddevice 的 InputStream 回調持續讀取麥克風，並在說話結束時自動停止
+
+        Args:
+            sample_rate: 採樣率
+            frame_ms: 每幀的長度
+            segmenter_options: 傳給 UtteranceSegmenter 的參數
+        """
+        self.sample_rate = sample_rate
+        self.frame_ms = frame_ms
+        self.segmenter_options = segmenter_options
+
+    def record(
+        self,
+        on_segment: Optional[Callable[[np.ndarray], None]] = None,
+        start_timeout: Optional[float] = 10.0,
+        vad: Optional[EnergyVAD] = None,
+        on_start: Optional[Callable[[], None]] = None,
+        stop_event: Optional[threading.Event] = None
+    ) -> np.ndarray:
+        """
+        錄製一句話
+
+        Args:
+            on_segment: 每得到一個可轉錄的片段時調用，可用於在說話過程中開始轉錄
+            start_timeout: 等待開始說話的最長秒數，為 None 時一直等待
+            vad: 語音活動檢測器，默認使用 EnergyVAD
+            on_start: 檢測到開始說話時調用，可用於打斷正在播放的語音
+            stop_event: 設置後立即停止錄音
+
+        Returns:
+            np.ndarray: 16kHz 單聲道 float32 音頻，沒有檢測到語音時為空數組
+        """
+        import sounddevice as sd
+
+        segmenter = UtteranceSegmenter(
+            vad or EnergyVAD(),
+            sample_rate=self.sample_rate,
+            frame_ms=self.frame_ms,
+            **self.segmenter_options
+        )
+        frames: "queue.Queue[np.ndarray]" = queue.Queue()
+
+        def callback(indata, frame_count, time_info, status):
+            if status:
+                print(f"錄音狀態：{status}")
+            frames.put(indata[:, 0].copy())
+
+        frame_samples = int(self.sample_rate * self.frame_ms / 1000)
+        waited_ms = 0
+        with sd.InputStream(samplerate=self.sample_rate, channels=1, dtype="float32",
+                            blocksize=frame_samples, callback=callback):
+            while not segmenter.done:
+                if stop_event is not None and stop_event.is_set():
+                    break
+                try:
+                    frame = frames.get(timeout=1.0)
+                except queue.Empty:
+                    continue
+                started = segmenter.started
+                for segment in segmenter.feed(frame):
+                    if on_segment is not None:
+                        on_segment(segment)
+                if segmenter.started and not started and on_start is not None:
+                    on_start()
+                if not segmenter.started:
+                    waited_ms += self.frame_ms
+                    if start_timeout is not None and waited_ms >= start_timeout * 1000:
+                        break
+
+        return segmenter.utterance()
@@ -0,0 +1,582 @@
+from pathlib import Path
+from abc import ABC, abstractmethod
+import os
+import pickle
+import threading
+from typing import Any, Dict, List, Optional
+import numpy as np
+
+class VectorBackend(ABC):
+    """
+    向量存儲後端接口
+
+    方法的參數和返回格式與 Chroma 的 Collection 一致，
+    VectorStore 可以不區分具體實現地調用。
+    """
+
+    @abstractmethod
+    def upsert(
+        self,
+        ids: List[str],
+        documents: List[str],
+        metadatas: List[Dict[str, Any]],
+        embeddings: Optional[List[List[float]]] = None
+    ):
+        """添加或覆蓋文檔，未提供向量時由後端計算"""
+
+    @abstractmethod
+    def query(
+        self,
+        query_texts: Optional[List[str]] = None,
+        query_embeddings: Optional[List[List[float]]] = None,
+        n_results: int = 10,
+        where: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, List[List[Any]]]:
+        """返回每個問題最相近的文檔，包含 ids、documents、metadatas、distances；where 為元數據過濾條件"""
+
+    @abstractmethod
+    def get(
+        self,
+        ids: Optional[List[str]] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        include: Optional[List[str]] = None
+    ) -> Dict[str, List[Any]]:
+        """按ID或分頁讀取文檔"""
+
+    @abstractmethod
+    def delete(self, ids: List[str]):
+        """刪除文檔"""
+
+    @abstractmethod
+    def count(self) -> int:
+        """文檔數量"""
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """計算文本向量"""
+
+    def persist(self):
+        """將尚未保存的修改寫入磁盤"""
+
+_COMPARISONS = {
+    "$eq": lambda value, target: value == target,
+    "$ne": lambda value, target: value != target,
+    "$gt": lambda value, target: value is not None and value > target,
+    "$gte": lambda value, target: value is not None and value >= target,
+    "$lt": lambda value, target: value is not None and value < target,
+    "$lte": lambda value, target: value is not None and value <= target,
+    "$in": lambda value, target: value in target,
+    "$nin": lambda value, target: value not in target
+}
+
+def matches_where(metadata: Dict[str, Any], where: Dict[str, Any]) -> bool:
+    """判斷元數據是否滿足 Chroma 格式的 where 條件，供不支持元數據過濾的後端使用"""
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, item) for item in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_where(metadata, item) for item in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for operator, target in condition.items():
+                if operator not in _COMPARISONS:
+                    raise ValueError(f"不支持的過濾運算符: {operator}")
+                if not _COMPARISONS[operator](value, target):
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+class ChromaBackend(VectorBackend):
+    def __init__(self, persist_directory: str, collection_name: str = "audio_transcripts", embedding_function=None):
+        """使用 ChromaDB 持久化集合的後端，embedding_function 為 None 時使用 Chroma 默認的嵌入函數"""
+        import chromadb
+        from chromadb.config import Settings
+
+        self.client = chromadb.PersistentClient(
+            path=str(persist_directory),
+            settings=Settings(
+                anonymized_telemetry=False,
+                allow_reset=True
+            )
+        )
+        collection_options = {"embedding_function": embedding_function} if embedding_function is not None else {}
+        self.collection = self.client.get_or_create_collection(
+            name=collection_name,
+            metadata={"hnsw:space": "cosine"},
+            **collection_options
+        )
+
+    @property
+    def max_batch_size(self) -> Optional[int]:
+        return getattr(self.client, "max_batch_size", None)
+
+    def upsert(self, ids, documents, metadatas, embeddings=None):
+        if embeddings is None:
+            self.collection.upsert(ids=ids, documents=documents, metadatas=metadatas)
+        else:
+            self.collection.upsert(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+
+    def query(self, query_texts=None, query_embeddings=None, n_results=10, where=None):
+        if query_embeddings is not None:
+            return self.collection.query(query_embeddings=query_embeddings, n_results=n_results, where=where)
+        return self.collection.query(query_texts=query_texts, n_results=n_results, where=where)
+
+    def get(self, ids=None, limit=None, offset=None, include=None):
+        if include is None:
+            include = ["documents", "metadatas"]
+        return self.collection.get(ids=ids, limit=limit, offset=offset, include=include)
+
+    def delete(self, ids):
+        self.collection.delete(ids=ids)
+
+    def count(self):
+        return self.collection.count()
+
+    def embed(self, texts):
+        return [list(map(float, vector)) for vector in self.collection._embedding_function(texts)]
+
+class _PickledDocument:
+    """反序列化 index.pkl 時代替 LangChain 的 Document，只保留字段值"""
+
+    def __setstate__(self, state: Dict[str, Any]):
+        # pydantic v1 和 v2 的 Document 都把字段保存在 __dict__ 中，其餘內部狀態不兼容
+        self.fields = state.get("__dict__", state)
+
+class _DocstoreUnpickler(pickle.Unpickler):
+    """
+    讀取 FAISS.save_local 保存的文檔存儲
+
+    不同版本的 langchain-core 基於不同版本的 pydantic，直接 pickle.load
+    其他版本寫入的 Document 會失敗，這裡先讀出字段再用當前版本的 Document 重建。
+    """
+
+    def find_class(self, module: str, name: str):
+        if name == "Document" and module.split(".")[0] in ("langchain", "langchain_core"):
+            return _PickledDocument
+        return super().find_class(module, name)
+
+def load_docstore(path: Path):
+    """
+    讀取 index.pkl
+
+    Returns:
+        tuple: (InMemoryDocstore, 標籤到文檔 ID 的映射)
+    """
+    from langchain_core.documents import Document
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+
+    try:
+        with open(path, "rb") as f:
+            docstore, index_to_docstore_id = _DocstoreUnpickler(f).load()
+        documents = {
+            doc_id: Document(page_content=document.fields["page_content"], metadata=document.fields.get("metadata") or {})
+            for doc_id, document in docstore._dict.items()
+        }
+    except Exception as e:
+        raise RuntimeError(f"無法讀取 FAISS 文檔存儲 {path}：{type(e).__name__}: {str(e)}") from e
+    return InMemoryDocstore(documents), dict(index_to_docstore_id)
+
+class FaissBackend(VectorBackend):
+    INDEX_TYPES = ("flat", "ivf", "hnsw")
+
+    def __init__(
+        self,
+        index_dir: str,
+        embedding_function=None,
+        index_type: str = "flat",
+        nlist: int = 256,
+        nprobe: int = 16,
+        hnsw_m: int = 32,
+        ef_search: int = 64,
+        mmap: bool = True,
+        max_orphan_ratio: float = 0.25
+    ):
+        """
+        進程內的 FAISS 後端
+
+        索引以 LangChain FAISS.save_local 的格式保存（index.faiss 和 index.pkl），
+        可以直接加載倉庫中已有的索引文件。
+
+        Args:
+            index_dir: 索引目錄
+            embedding_function: 計算文本向量的函數，默認與 Chroma 相同
+            index_type: 新建索引的類型：flat、ivf 或 hnsw
+            nlist: IVF 的聚類數量，向量數量達到 nlist * 39 後才從 flat 轉為 IVF
+            nprobe: IVF 查詢時搜索的聚類數量
+            hnsw_m: HNSW 每個節點的連接數
+            ef_search: HNSW 查詢時的候選列表大小
+            mmap: 是否以內存映射的方式加載已有索引，首次寫入時才讀入內存
+            max_orphan_ratio: HNSW/IVF 中已刪除但仍佔用空間的向量超過此比例時自動重建索引
+        """
+        import faiss
+        from langchain_community.docstore.in_memory import InMemoryDocstore
+
+        if index_type not in self.INDEX_TYPES:
+            raise ValueError(f"不支持的索引類型: {index_type}，可選: {', '.join(self.INDEX_TYPES)}")
+
+        self._faiss = faiss
+        self.index_dir = Path(index_dir)
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        self.index_type = index_type
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+        self.max_orphan_ratio = max_orphan_ratio
+
+        if embedding_function is None:
+            from chromadb.utils import embedding_functions
+            embedding_function = embedding_functions.DefaultEmbeddingFunction()
+        self.embedding_function = embedding_function
+
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._mmapped = False
+        self.index = None
+        self.docstore = InMemoryDocstore({})
+        self.index_to_docstore_id: Dict[int, str] = {}
+        self._label_of: Dict[str, int] = {}
+        self._next_label = 0
+        self._load(mmap)
+
+    # ---- 加載與保存 ----
+
+    @property
+    def _index_path(self) -> Path:
+        return self.index_dir / "index.faiss"
+
+    @property
+    def _store_path(self) -> Path:
+        return self.index_dir / "index.pkl"
+
+    def _load(self, mmap: bool):
+        if not self._index_path.exists() or not self._store_path.exists():
+            return
+
+        faiss = self._faiss
+        self.index = None
+        if mmap:
+            try:
+                self.index = faiss.read_index(str(self._index_path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+                self._mmapped = True
+            except RuntimeError:
+                self.index = None
+        if self.index is None:
+            self.index = faiss.read_index(str(self._index_path))
+            self._mmapped = False
+
+        self.docstore, self.index_to_docstore_id = load_docstore(self._store_path)
+        self._label_of = {doc_id: label for label, doc_id in self.index_to_docstore_id.items()}
+        self._next_label = max(self.index.ntotal, max(self.index_to_docstore_id, default=-1) + 1)
+        if isinstance(self.index, (faiss.IndexIDMap, faiss.IndexIDMap2)) and self.index.ntotal:
+            # HNSW/IVF 中已刪除的向量仍佔用標籤
+            self._next_label = max(self._next_label, int(faiss.vector_to_array(self.index.id_map).max()) + 1)
+        self._apply_search_params()
+        print(f"已加載 FAISS 索引：{self.index.ntotal} 個向量")
+
+    def persist(self):
+        with self._lock:
+            if not self._dirty or self.index is None:
+                return
+            # 先寫入臨時文件再替換，避免中斷時留下損壞的索引
+            tmp_index = self._index_path.with_suffix(".faiss.tmp")
+            tmp_store = self._store_path.with_suffix(".pkl.tmp")
+            self._faiss.write_index(self.index, str(tmp_index))
+            with open(tmp_store, "wb") as f:
+                pickle.dump((self.docstore, self.index_to_docstore_id), f)
+            os.replace(tmp_index, self._index_path)
+            os.replace(tmp_store, self._store_path)
+            self._dirty = False
+
+    # ---- 索引結構 ----
+
+    @property
+    def _is_cosine(self) -> bool:
+        return self.index is None or self.index.metric_type == self._faiss.METRIC_INNER_PRODUCT
+
+    def _base_index(self):
+        """返回 ID 映射層下面的實際索引"""
+        faiss = self._faiss
+        index = faiss.downcast_index(self.index)
+        if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+            return faiss.downcast_index(index.index)
+        return index
+
+    def _new_index(self, index_type: str, dimension: int, metric: int):
+        faiss = self._faiss
+        if index_type == "hnsw":
+            base = faiss.IndexHNSWFlat(dimension, self.hnsw_m, metric)
+        elif index_type == "ivf":
+            quantizer = faiss.IndexFlat(dimension, metric)
+            base = faiss.IndexIVFFlat(quantizer, dimension, self.nlist, metric)
+            base.own_fields = True
+            quantizer.this.disown()
+        else:
+            base = faiss.IndexFlat(dimension, metric)
+        index = faiss.IndexIDMap2(base)
+        index.own_fields = True
+        base.this.disown()
+        return index
+
+    def _apply_search_params(self):
+        base = self._base_index()
+        faiss = self._faiss
+        if isinstance(base, faiss.IndexIVF):
+            base.nprobe = self.nprobe
+        elif isinstance(base, faiss.IndexHNSW):
+            base.hnsw.efSearch = self.ef_search
+
+    def _ensure_writable(self, dimension: int):
+        """寫入前確保索引已讀入內存並帶有 ID 映射"""
+        faiss = self._faiss
+        if self.index is None:
+            # IVF 需要足夠的訓練數據，先以 flat 索引收集向量
+            initial_type = "flat" if self.index_type == "ivf" else self.index_type
+            self.index = self._new_index(initial_type, dimension, faiss.METRIC_INNER_PRODUCT)
+            self._apply_search_params()
+            return
+
+        if self._mmapped:
+            self.index = faiss.read_index(str(self._index_path))
+            self._mmapped = False
+            self._apply_search_params()
+
+        if not isinstance(faiss.downcast_index(self.index), (faiss.IndexIDMap, faiss.IndexIDMap2)):
+            # LangChain 保存的索引以位置作為ID，轉為 ID 映射索引以支持刪除和覆蓋
+            labels = np.array(sorted(self.index_to_docstore_id), dtype=np.int64)
+            vectors = self.index.reconstruct_n(0, self.index.ntotal)
+            index = faiss.IndexIDMap2(faiss.IndexFlat(self.index.d, self.index.metric_type))
+            if len(labels):
+                index.add_with_ids(vectors[labels], labels)
+            self.index = index
+
+    def _vectors_for_labels(self, labels: List[int]) -> np.ndarray:
+        if not labels:
+            return np.zeros((0, self.index.d), dtype=np.float32)
+        base = self._base_index()
+        if isinstance(base, self._faiss.IndexIVF):
+            base.make_direct_map()
+        return np.vstack([self.index.reconstruct(int(label)) for label in labels])
+
+    def rebuild(self, index_type: Optional[str] = None):
+        """
+        以當前的向量重建索引，可用於切換索引類型、訓練 IVF 或清除 HNSW/IVF 中已刪除的向量
+
+        Args:
+            index_type: 新的索引類型，默認為初始化時指定的類型
+        """
+        with self._lock:
+            index_type = index_type or self.index_type
+            if self.index is None:
+                self.index_type = index_type
+                return
+            self._ensure_writable(self.index.d)
+
+            labels = sorted(self.index_to_docstore_id)
+            vectors = self._vectors_for_labels(labels)
+            index = self._new_index(index_type, self.index.d, self.index.metric_type)
+            if len(labels):
+                base = self._faiss.downcast_index(index.index)
+                if isinstance(base, self._faiss.IndexIVF):
+                    base.train(vectors)
+                index.add_with_ids(vectors, np.array(labels, dtype=np.int64))
+
+            self.index = index
+            self.index_type = index_type
+            self._apply_search_params()
+            self._dirty = True
+            self.persist()
+            print(f"FAISS 索引已重建為 {index_type}：{len(labels)} 個向量")
+
+    def _maybe_train_ivf(self):
+        """向量足夠時將收集數據用的 flat 索引轉為 IVF"""
+        if self.index_type != "ivf" or isinstance(self._base_index(), self._faiss.IndexIVF):
+            return
+        if len(self.index_to_docstore_id) >= self.nlist * 39:
+            self.rebuild("ivf")
+
+    # ---- 讀寫接口 ----
+
+    def _prepare(self, vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+        if self._is_cosine:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.where(norms > 0, norms, 1)
+        return np.ascontiguousarray(vectors)
+
+    def _maybe_compact(self):
+        """HNSW/IVF 無法直接刪除向量，已刪除的向量佔比過高時重建索引回收空間"""
+        if self.index is None or not self.index.ntotal:
+            return
+        orphans = self.index.ntotal - len(self.index_to_docstore_id)
+        if orphans and orphans / self.index.ntotal > self.max_orphan_ratio:
+            print(f"FAISS 索引中有 {orphans}/{self.index.ntotal} 個已刪除的向量，正在重建")
+            self.rebuild()
+
+    def _remove_labels(self, labels: List[int]):
+        """刪除向量；flat 索引直接移除，HNSW/IVF 只移除映射，查詢時跳過"""
+        for label in labels:
+            doc_id = self.index_to_docstore_id.pop(label, None)
+            self._label_of.pop(doc_id, None)
+        if labels and isinstance(self._base_index(), self._faiss.IndexFlat):
+            self.index.remove_ids(np.array(labels, dtype=np.int64))
+
+    def upsert(self, ids, documents, metadatas, embeddings=None):
+        from langchain.schema import Document
+
+        if embeddings is None:
+            embeddings = self.embed(documents)
+
+        with self._lock:
+            vectors = self._prepare(embeddings)
+            self._ensure_writable(vectors.shape[1])
+
+            existing = [doc_id for doc_id in ids if doc_id in self._label_of]
+            self._remove_labels([self._label_of[doc_id] for doc_id in existing])
+            if existing:
+                # InMemoryDocstore 不允許添加已存在的ID，覆蓋前先刪除舊文檔
+                self.docstore.delete(existing)
+
+            # 標籤只增不減，已刪除向量的標籤不會被重用
+            labels = np.arange(self._next_label, self._next_label + len(ids), dtype=np.int64)
+            self._next_label += len(ids)
+            self.index.add_with_ids(vectors, labels)
+
+            self.docstore.add({
+                doc_id: Document(page_content=document, metadata=metadata or {})
+                for doc_id, document, metadata in zip(ids, documents, metadatas)
+            })
+            for label, doc_id in zip(labels, ids):
+                self.index_to_docstore_id[int(label)] = doc_id
+                self._label_of[doc_id] = int(label)
+
+            self._maybe_train_ivf()
+            self._maybe_compact()
+            self._dirty = True
+
+    def _query_filtered(self, vectors: np.ndarray, n_results: int, where: Dict[str, Any]):
+        """
+        只在滿足過濾條件的文檔中精確搜索
+
+        按講座或時間範圍過濾後的文檔通常很少，直接計算它們與問題的相似度，
+        比在整個索引中多取候選再過濾更準確也更快。
+        """
+        labels = [
+            label for label, doc_id in self.index_to_docstore_id.items()
+            if matches_where(self.docstore.search(doc_id).metadata, where)
+        ]
+        candidates = self._vectors_for_labels(labels)
+        if self._is_cosine:
+            scores = vectors @ candidates.T
+            order = np.argsort(-scores, axis=1)[:, :n_results]
+        else:
+            scores = ((vectors[:, None, :] - candidates[None, :, :]) ** 2).sum(axis=2)
+            order = np.argsort(scores, axis=1)[:, :n_results]
+        label_array = np.array(labels, dtype=np.int64)
+        return np.take_along_axis(scores, order, axis=1), label_array[order]
+
+    def query(self, query_texts=None, query_embeddings=None, n_results=10, where=None):
+        if query_embeddings is None:
+            query_embeddings = self.embed(query_texts)
+
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        with self._lock:
+            if self.index is None or not self.index_to_docstore_id:
+                for _ in query_embeddings:
+                    for key in result:
+                        result[key].append([])
+                return result
+
+            vectors = self._prepare(query_embeddings)
+            if where:
+                return self._format_results(*self._query_filtered(vectors, n_results, where), n_results)
+            # HNSW/IVF 中可能有已刪除的向量，多取一些候選再過濾
+            removed = self.index.ntotal - len(self.index_to_docstore_id)
+            k = min(self.index.ntotal, n_results + max(0, removed))
+            scores, labels = self.index.search(vectors, k)
+            return self._format_results(scores, labels, n_results)
+
+    def _format_results(self, scores, labels, n_results: int) -> Dict[str, List[List[Any]]]:
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for row_scores, row_labels in zip(scores, labels):
+            ids, documents, metadatas, distances = [], [], [], []
+            for score, label in zip(row_scores, row_labels):
+                doc_id = self.index_to_docstore_id.get(int(label))
+                if label < 0 or doc_id is None:
+                    continue
+                document = self.docstore.search(doc_id)
+                ids.append(doc_id)
+                documents.append(document.page_content)
+                metadatas.append(document.metadata)
+                # 與 Chroma 一致：餘弦空間返回 1 - 相似度，L2 空間返回平方距離
+                distances.append(float(1 - score) if self._is_cosine else float(score))
+                if len(ids) == n_results:
+                    break
+            result["ids"].append(ids)
+            result["documents"].append(documents)
+            result["metadatas"].append(metadatas)
+            result["distances"].append(distances)
+        return result
+
+    def get(self, ids=None, limit=None, offset=None, include=None):
+        if include is None:
+            include = ["documents", "metadatas"]
+
+        with self._lock:
+            if ids is None:
+                labels = sorted(self.index_to_docstore_id)
+                start = offset or 0
+                labels = labels[start:start + limit] if limit is not None else labels[start:]
+            else:
+                labels = [self._label_of[doc_id] for doc_id in ids if doc_id in self._label_of]
+
+            doc_ids = [self.index_to_docstore_id[label] for label in labels]
+            result: Dict[str, List[Any]] = {"ids": doc_ids}
+            if "documents" in include or "metadatas" in include:
+                documents = [self.docstore.search(doc_id) for doc_id in doc_ids]
+                if "documents" in include:
+                    result["documents"] = [document.page_content for document in documents]
+                if "metadatas" in include:
+                    result["metadatas"] = [document.metadata for document in documents]
+            if "embeddings" in include:
+                result["embeddings"] = self._vectors_for_labels(labels).tolist()
+        return result
+
+    def delete(self, ids):
+        with self._lock:
+            if self.index is None:
+                return
+            self._ensure_writable(self.index.d)
+            found = [doc_id for doc_id in ids if doc_id in self._label_of]
+            self._remove_labels([self._label_of[doc_id] for doc_id in found])
+            if found:
+                self.docstore.delete(found)
+            self._maybe_compact()
+            self._dirty = True
+
+    def count(self):
+        return len(self.index_to_docstore_id)
+
+    def embed(self, texts):
+        return [list(map(float, vector)) for vector in self.embedding_function(texts)]
+
+def create_backend(backend: str, persist_directory: str, **options: Any) -> VectorBackend:
+    """
+    根據配置創建向量存儲後端
+
+    Args:
+        backend: chroma 或 faiss
+        persist_directory: 向量存儲目錄，FAISS 索引保存在其下的 index 目錄
+        options: 傳給後端的其他參數
+    """
+    if backend == "chroma":
+        return ChromaBackend(persist_directory, **options)
+    if backend == "faiss":
+        return FaissBackend(str(Path(persist_directory) / "index"), **options)
+    raise ValueError(f"不支持的向量存儲後端: {backend}，可選: chroma、faiss")
@@ -1,13 +1,23 @@
 from pathlib import Path
-import chromadb
-from chromadb.config import Settings
+import asyncio
+import hashlib
+import re
 import json
-from typing import List, Dict, Any, Optional
+import time
+import weakref
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
 from langchain.schema import Document
 from langchain.vectorstores.base import VectorStore
 from langchain.embeddings.base import Embeddings
 from langchain.schema.retriever import BaseRetriever
+from langchain.callbacks.manager import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
 from pydantic import Field
+from modules.vector_backends import create_backend
+from modules.embeddings import EmbeddingModel
+from modules.chunk_index import ChunkIndex
+from modules.lexical_index import LexicalIndex
+from modules.vector_backends import matches_where
+from modules.tracing import tracer
 
 class ChromaRetriever(BaseRetriever):
     vector_store: Any = Field(description="向量存儲實例")
@@ -15,82 +25,587 @@ class ChromaRetriever(BaseRetriever):
     search_kwargs: Dict[str, Any] = Field(default_factory=dict, description="搜索參數")
     type: str = Field(default="chroma", description="檢索器類型")
     
-    def get_relevant_documents(self, query: str) -> List[Document]:
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.get_relevant_documents_many([query])[0]
+    
+    def get_relevant_documents_many(self, queries: List[str]) -> List[List[Document]]:
+        """批量檢索多個問題，結果順序與問題順序一致"""
         k = self.search_kwargs.get("k", 3)
-        results = self.vector_store.search(query, n_results=k)
+        if self.search_type == "hybrid":
+            results = self.vector_store.hybrid_search_many(queries, k=k, where=self.search_kwargs.get("filter"))
+        else:
+            results = self.vector_store.search_many(queries, k=k, where=self.search_kwargs.get("filter"))
         
-        documents = []
-        for result in results:
-            doc = Document(
-                page_content=result['content'],
-                metadata=result['metadata']
-            )
-            documents.append(doc)
-        return documents
+        return [
+            [
+                Document(
+                    page_content=result['content'],
+                    metadata=result['metadata']
+                )
+                for result in query_results
+            ]
+            for query_results in results
+        ]
+    
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return (await self.aget_relevant_documents_many([query]))[0]
+    
+    async def aget_relevant_documents_many(self, queries: List[str]) -> List[List[Document]]:
+        """異步批量檢索，在線程池中執行以免阻塞事件循環"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.get_relevant_documents_many, queries)
+
+# 舊版以集合大小遞增產生的文檔ID格式，例如 doc_12
+LEGACY_ID_PATTERN = re.compile(r"^doc_\d+$")
+
+# 問答檢索方式
+SEARCH_TYPES = ("hybrid", "similarity")
+
+def _persist_backend(backend):
+    """向量存儲被回收或進程退出時保存後端中尚未寫入磁盤的修改"""
+    try:
+        backend.persist()
+    except Exception as e:
+        print(f"保存向量存儲失敗: {str(e)}")
 
 class VectorStore(VectorStore):
-    def __init__(self, persist_directory: str):
+    def __init__(
+        self,
+        persist_directory: str,
+        batch_size: int = 256,
+        backend: str = "chroma",
+        embedding: Optional[Embeddings] = None,
+        search_type: str = "hybrid",
+        persist_interval: float = 30.0,
+        **backend_options: Any
+    ):
+        """
+        初始化向量存儲
+        
+        Args:
+            persist_directory: 向量存儲目錄
+            batch_size: 批量寫入和查詢時每批的數量
+            backend: 存儲後端，chroma 或 faiss
+            embedding: 嵌入模型，默認使用本地 sentence-transformers 模型並將向量緩存在存儲目錄中
+            search_type: 問答檢索方式，hybrid 結合關鍵詞和向量檢索，similarity 只使用向量檢索
+            persist_interval: 寫入後最多間隔多少秒保存一次後端（FAISS 每次保存都要重寫整個索引），
+                              flush 立即保存，實例被回收或進程退出時自動保存
+            backend_options: 傳給後端的其他參數，例如 FAISS 的 index_type
+        """
+        if search_type not in SEARCH_TYPES:
+            raise ValueError(f"不支持的檢索方式: {search_type}，可選: {', '.join(SEARCH_TYPES)}")
         self.persist_directory = Path(persist_directory)
+        self.batch_size = batch_size
+        self.search_type = search_type
+        self.backend_name = backend
+        self.persist_interval = persist_interval
+        self._last_persist = time.monotonic()
+        self._dirty = False
         self.persist_directory.mkdir(parents=True, exist_ok=True)
         
-        # 初始化 ChromaDB 客戶端
-        self.client = chromadb.PersistentClient(
-            path=str(self.persist_directory),
-            settings=Settings(
-                anonymized_telemetry=False,
-                allow_reset=True
-            )
-        )
+        # 創建嵌入模型，其他 LangChain 嵌入也會套上同一個緩存
+        cache_path = str(self.persist_directory / "embedding_cache.sqlite3")
+        if embedding is None:
+            embedding = EmbeddingModel(cache_path=cache_path)
+        elif not isinstance(embedding, EmbeddingModel):
+            embedding = EmbeddingModel(encoder=embedding, cache_path=cache_path)
+        self.embedding = embedding
         
-        # 創建或獲取集合
-        self.collection = self.client.get_or_create_collection(
-            name="audio_transcripts",
-            metadata={"hnsw:space": "cosine"}
+        # 創建存儲後端
+        self.backend = create_backend(
+            backend, str(self.persist_directory),
+            embedding_function=self.embedding, **backend_options
         )
+        
+        # 講座音頻時間到文本塊的索引
+        self.chunk_index = ChunkIndex(str(self.persist_directory / "chunk_spans.sqlite3"))
+        # 關鍵詞檢索使用的倒排索引
+        self.lexical_index = LexicalIndex(str(self.persist_directory / "lexical_index.sqlite3"))
+        
+        # 舊版集合的文檔ID為 doc_N，每個後端只需完整檢查一次，檢查完成後記錄在 store_meta.json 中
+        if not self._legacy_ids_checked():
+            self.migrate_legacy_ids()
+        
+        # 倒排索引建立之前已有的文檔需要補充索引
+        if self.lexical_index.count() != self.backend.count():
+            self.sync_lexical_index()
+        
+        # 只引用後端，不會讓已不再使用的實例一直保留到進程退出
+        weakref.finalize(self, _persist_backend, self.backend)
+    
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        """LangChain 向量存儲接口使用的嵌入模型"""
+        return self.embedding
+    
+    @staticmethod
+    def generate_doc_id(content: str, metadata: Optional[Dict[str, Any]] = None) -> str:
+        """
+        根據內容和來源生成文檔ID
+        
+        ID 只取決於文檔本身，無需查詢集合，刪除文檔或多個寫入者並行時也不會衝突；
+        相同來源的相同內容會得到相同ID，重複添加時會覆蓋而不是產生重複文檔。
+        """
+        source = str((metadata or {}).get("source", ""))
+        digest = hashlib.sha256(f"{source}\x00{content}".encode("utf-8")).hexdigest()
+        return f"doc_{digest[:32]}"
+    
+    def flush(self) -> bool:
+        """立即保存尚未寫入磁盤的修改"""
+        if not self._dirty:
+            return True
+        try:
+            self.backend.persist()
+            self._dirty = False
+            self._last_persist = time.monotonic()
+            return True
+        except Exception as e:
+            print(f"保存向量存儲失敗: {str(e)}")
+            return False
+    
+    def _persist_soon(self):
+        """距上次保存超過 persist_interval 秒時保存，連續寫入時不必每批都重寫整個索引"""
+        self._dirty = True
+        if time.monotonic() - self._last_persist >= self.persist_interval:
+            self.flush()
+    
+    @property
+    def _meta_path(self) -> Path:
+        return self.persist_directory / "store_meta.json"
+    
+    def _read_meta(self) -> Dict[str, Any]:
+        try:
+            with open(self._meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f"讀取向量存儲元數據失敗: {str(e)}")
+            return {}
+    
+    def _legacy_ids_checked(self) -> bool:
+        return self.backend_name in self._read_meta().get("legacy_ids_checked", [])
+    
+    def _record_legacy_ids_checked(self):
+        """記錄該後端已完整檢查過舊版ID，之後啟動時不再掃描"""
+        meta = self._read_meta()
+        checked = meta.setdefault("legacy_ids_checked", [])
+        if self.backend_name in checked:
+            return
+        checked.append(self.backend_name)
+        try:
+            with open(self._meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+        except Exception as e:
+            print(f"寫入向量存儲元數據失敗: {str(e)}")
     
     def add_content(self, content: str, metadata: Dict[str, Any]) -> bool:
         """添加內容到向量存儲"""
+        if not self._add_one(content, metadata):
+            return False
+        self._persist_soon()
+        return True
+    
+    def _add_one(self, content: str, metadata: Dict[str, Any]) -> bool:
         try:
             # 生成文檔ID
-            doc_id = f"doc_{len(self.collection.get()['ids'])}"
+            doc_id = self.generate_doc_id(content, metadata)
             
             # 添加文檔到集合
-            self.collection.add(
+            self.backend.upsert(
                 documents=[content],
                 metadatas=[metadata],
                 ids=[doc_id]
             )
+            self.chunk_index.add([doc_id], [metadata])
+            self.lexical_index.add([doc_id], [content])
             return True
         except Exception as e:
             print(f"添加內容失敗: {str(e)}")
             return False
     
-    def search(self, query: str, n_results: int = 3) -> List[Dict[str, Any]]:
-        """搜索相似內容"""
+    def add_contents(
+        self,
+        contents: List[str],
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+        batch_size: Optional[int] = None
+    ) -> List[Optional[str]]:
+        """
+        批量添加內容到向量存儲
+        
+        每批只進行一次嵌入計算和一次寫入；某一批寫入失敗時逐個重試該批內容，
+        以找出具體失敗的塊，其餘批次不受影響。寫入磁盤按 persist_interval 合併，
+        需要確保已保存時調用 flush。
+        
+        Args:
+            contents: 文本塊列表
+            metadatas: 與文本塊一一對應的元數據列表
+            batch_size: 每批的文本塊數量，默認使用初始化時的設定
+            
+        Returns:
+            list: 每個文本塊對應的文檔ID，添加失敗的塊為 None
+        """
+        if metadatas is None:
+            metadatas = [{} for _ in contents]
+        if len(metadatas) != len(contents):
+            raise ValueError("contents 和 metadatas 的長度必須一致")
+        
+        batch_size = batch_size or self.batch_size
+        max_batch_size = getattr(self.backend, "max_batch_size", None)
+        if max_batch_size:
+            batch_size = min(batch_size, max_batch_size)
+        
+        doc_ids = [self.generate_doc_id(c, m) for c, m in zip(contents, metadatas)]
+        results: List[Optional[str]] = [None] * len(contents)
+        
+        for start in range(0, len(contents), batch_size):
+            indices = range(start, min(start + batch_size, len(contents)))
+            
+            # 同一批中重複的ID只寫入一次
+            unique = {}
+            for i in indices:
+                unique.setdefault(doc_ids[i], i)
+            keep = list(unique.values())
+            
+            try:
+                self.backend.upsert(
+                    documents=[contents[i] for i in keep],
+                    metadatas=[metadatas[i] for i in keep],
+                    ids=[doc_ids[i] for i in keep]
+                )
+                self.chunk_index.add([doc_ids[i] for i in keep], [metadatas[i] for i in keep])
+                self.lexical_index.add([doc_ids[i] for i in keep], [contents[i] for i in keep])
+                for i in indices:
+                    results[i] = doc_ids[i]
+            except Exception as e:
+                print(f"批量添加失敗，改為逐個添加: {str(e)}")
+                for i in keep:
+                    if self._add_one(contents[i], metadatas[i]):
+                        results[i] = doc_ids[i]
+                for i in indices:
+                    if results[unique[doc_ids[i]]] is not None:
+                        results[i] = doc_ids[i]
+        
+        self._persist_soon()
+        
+        failed = sum(1 for doc_id in results if doc_id is None)
+        if failed:
+            print(f"共有 {failed}/{len(contents)} 個文本塊添加失敗")
+        return results
+    
+    def add_stream(
+        self,
+        items: Iterable[Tuple[str, Dict[str, Any]]],
+        batch_size: int = 16,
+        max_delay: float = 5.0
+    ) -> Iterator[List[Optional[str]]]:
+        """
+        邊生成邊添加文本塊，每添加一批就返回該批的文檔ID
+        
+        文本塊到達得快時湊滿 batch_size 再寫入；距上次寫入超過 max_delay 秒時立即寫入，
+        保證先到達的內容盡快可以被檢索。寫入的內容立即可以檢索，保存到磁盤按 persist_interval 合併，
+        全部添加完成後再保存一次。
+        
+        Args:
+            items: (文本塊, 元數據) 的迭代器
+            batch_size: 每批的最大文本塊數量
+            max_delay: 文本塊在寫入前最多等待的秒數
+            
+        Yields:
+            list: 該批每個文本塊對應的文檔ID，添加失敗的塊為 None
+        """
+        contents: List[str] = []
+        metadatas: List[Dict[str, Any]] = []
+        last_write = time.monotonic() - max_delay
+        for content, metadata in items:
+            contents.append(content)
+            metadatas.append(metadata)
+            if len(contents) >= batch_size or time.monotonic() - last_write >= max_delay:
+                yield self.add_contents(contents, metadatas)
+                contents, metadatas = [], []
+                last_write = time.monotonic()
+        if contents:
+            yield self.add_contents(contents, metadatas)
+        self.flush()
+    
+    def has_documents(self, ids: List[str]) -> bool:
+        """檢查指定的文檔是否都還在集合中"""
         try:
-            results = self.collection.query(
-                query_texts=[query],
-                n_results=n_results
-            )
+            return len(self.backend.get(ids=ids, include=[])["ids"]) == len(set(ids))
+        except Exception as e:
+            print(f"查詢文檔失敗: {str(e)}")
+            return False
+    
+    def migrate_legacy_ids(self, batch_size: int = 500) -> int:
+        """
+        將舊版 doc_N 格式的文檔ID遷移為基於內容的ID
+        
+        掃描所有文檔ID，只讀取舊版文檔的內容和向量，沿用已存儲的向量，不會重新計算嵌入。
+        可以重複執行，已遷移的文檔會被跳過；完整掃描後記錄在元數據中，之後初始化時不再掃描。
+        
+        Args:
+            batch_size: 每批讀取和寫入的文檔數量
             
-            # 格式化結果
-            formatted_results = []
-            for i in range(len(results['documents'][0])):
-                formatted_results.append({
-                    'content': results['documents'][0][i],
-                    'metadata': results['metadatas'][0][i],
-                    'distance': results['distances'][0][i] if 'distances' in results else None
-                })
+        Returns:
+            int: 遷移的文檔數量
+        """
+        migrated = 0
+        offset = 0
+        try:
+            while True:
+                batch = self.backend.get(limit=batch_size, offset=offset, include=[])
+                if not batch["ids"]:
+                    break
+                
+                legacy_ids = [doc_id for doc_id in batch["ids"] if LEGACY_ID_PATTERN.match(doc_id)]
+                if not legacy_ids:
+                    offset += len(batch["ids"])
+                    continue
+                
+                legacy = self.backend.get(ids=legacy_ids, include=["documents", "metadatas", "embeddings"])
+                old_ids = legacy["ids"]
+                documents = legacy["documents"]
+                metadatas = legacy["metadatas"]
+                embeddings = legacy["embeddings"]
+                new_ids = [self.generate_doc_id(doc, meta) for doc, meta in zip(documents, metadatas)]
+                
+                # 同一批中內容相同的文檔只保留一份
+                unique = {}
+                for i, new_id in enumerate(new_ids):
+                    unique.setdefault(new_id, i)
+                keep = list(unique.values())
+                
+                self.backend.upsert(
+                    ids=[new_ids[i] for i in keep],
+                    documents=[documents[i] for i in keep],
+                    metadatas=[metadatas[i] for i in keep],
+                    embeddings=[embeddings[i] for i in keep]
+                )
+                self.backend.delete(ids=old_ids)
+                self.lexical_index.remove(old_ids)
+                self.lexical_index.add([new_ids[i] for i in keep], [documents[i] for i in keep])
+                migrated += len(old_ids)
+                
+                # 舊文檔已被刪除，剩餘未處理的文檔會前移
+                offset += len(batch["ids"]) - len(old_ids)
+            
+            if migrated:
+                self._dirty = True
+                self.flush()
+                print(f"已遷移 {migrated} 個舊版文檔ID")
+            self._record_legacy_ids_checked()
+            return migrated
+        except Exception as e:
+            print(f"遷移文檔ID失敗: {str(e)}")
+            return migrated
+    
+    def sync_lexical_index(self, batch_size: int = 500) -> int:
+        """
+        使倒排索引與向量存儲中的文檔一致：補充缺少的文檔並移除已不存在的文檔
+        
+        Returns:
+            int: 新加入倒排索引的文檔數量
+        """
+        added = 0
+        try:
+            indexed = set(self.lexical_index.doc_ids())
+            stored = set()
+            offset = 0
+            while True:
+                batch = self.backend.get(limit=batch_size, offset=offset, include=["documents"])
+                if not batch["ids"]:
+                    break
+                missing = [i for i, doc_id in enumerate(batch["ids"]) if doc_id not in indexed]
+                if missing:
+                    self.lexical_index.add(
+                        [batch["ids"][i] for i in missing],
+                        [batch["documents"][i] for i in missing]
+                    )
+                    added += len(missing)
+                stored.update(batch["ids"])
+                offset += len(batch["ids"])
+            self.lexical_index.remove(indexed - stored)
+            if added:
+                print(f"已為 {added} 個文檔建立關鍵詞索引")
+        except Exception as e:
+            print(f"同步關鍵詞索引失敗: {str(e)}")
+        return added
+    
+    def search(self, query: str, n_results: int = 3, where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """搜索相似內容"""
+        return self.search_many([query], k=n_results, where=where)[0]
+    
+    def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """使用嵌入模型計算文本向量"""
+        with tracer.span("embedding", texts=len(texts)):
+            return self.embedding.embed(texts)
+    
+    def search_many(
+        self,
+        queries: List[str],
+        k: int = 3,
+        query_embeddings: Optional[List[List[float]]] = None,
+        where: Optional[Dict[str, Any]] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        批量搜索多個問題
+        
+        每批問題只進行一次嵌入計算和一次查詢。
+        
+        Args:
+            queries: 問題列表
+            k: 每個問題返回的結果數量
+            query_embeddings: 已經計算好的問題向量，提供時不再重新嵌入
+            where: 元數據過濾條件（Chroma 的 where 格式），例如 chunk_index.span_filter 生成的講座和時間範圍
+            
+        Returns:
+            list: 每個問題的搜索結果，順序與 queries 一致；某批失敗時該批結果為空列表
+        """
+        all_results: List[List[Dict[str, Any]]] = []
+        for start in range(0, len(queries), self.batch_size):
+            batch = queries[start:start + self.batch_size]
+            try:
+                # 先計算向量再查詢（後端傳入文本時內部同樣調用嵌入模型），分別記錄兩者的耗時
+                if query_embeddings is not None:
+                    batch_embeddings = query_embeddings[start:start + self.batch_size]
+                else:
+                    batch_embeddings = self.embed_texts(batch)
+                with tracer.span("ann_search", queries=len(batch), k=k, filtered=where is not None):
+                    results = self.backend.query(
+                        query_embeddings=batch_embeddings,
+                        n_results=k,
+                        where=where
+                    )
+                
+                # 格式化結果
+                for q in range(len(batch)):
+                    formatted_results = []
+                    for i in range(len(results['documents'][q])):
+                        formatted_results.append({
+                            'id': results['ids'][q][i],
+                            'content': results['documents'][q][i],
+                            'metadata': results['metadatas'][q][i],
+                            'distance': results['distances'][q][i] if results.get('distances') else None
+                        })
+                    all_results.append(formatted_results)
+            except Exception as e:
+                print(f"搜索失敗: {str(e)}")
+                all_results.extend([] for _ in batch)
+        
+        return all_results
+    
+    def hybrid_search_many(
+        self,
+        queries: List[str],
+        k: int = 3,
+        query_embeddings: Optional[List[List[float]]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        candidates: Optional[int] = None,
+        rrf_k: int = 60
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        結合關鍵詞和向量檢索的混合搜索
+        
+        向量檢索和 BM25 關鍵詞檢索各取一批候選，按倒數排名融合（RRF）：
+        每個文檔的分數為其在兩個排名中 1 / (rrf_k + 名次) 之和，兩邊都排名靠前的文檔優先。
+        公式名稱、專有名詞等向量檢索容易漏掉的精確詞語可以由關鍵詞檢索補上。
+        
+        Args:
+            queries: 問題列表
+            k: 每個問題返回的結果數量
+            query_embeddings: 已經計算好的問題向量
+            where: 元數據過濾條件，同時作用於兩種檢索
+            candidates: 每種檢索各取的候選數量，默認為 max(4k, 20)
+            rrf_k: RRF 的平滑常數
             
-            return formatted_results
+        Returns:
+            list: 每個問題的搜索結果，格式與 search_many 相同，另有融合分數 score；
+                  只由關鍵詞檢索找到的文檔 distance 為 None
+        """
+        candidates = candidates or max(4 * k, 20)
+        dense = self.search_many(queries, k=candidates, query_embeddings=query_embeddings, where=where)
+        with tracer.span("lexical_search", queries=len(queries), k=candidates):
+            lexical = [self.lexical_index.search(query, candidates) for query in queries]
+        
+        # 一次取回只出現在關鍵詞檢索結果中的文檔
+        known = {result['id'] for results in dense for result in results}
+        missing = list({doc_id for hits in lexical for doc_id, _ in hits} - known)
+        documents: Dict[str, Dict[str, Any]] = {}
+        if missing:
+            try:
+                found = self.backend.get(ids=missing)
+                for doc_id, content, metadata in zip(found['ids'], found['documents'], found['metadatas']):
+                    documents[doc_id] = {'id': doc_id, 'content': content, 'metadata': metadata, 'distance': None}
+            except Exception as e:
+                print(f"獲取文檔失敗: {str(e)}")
+        
+        all_results: List[List[Dict[str, Any]]] = []
+        for dense_results, hits in zip(dense, lexical):
+            by_id = {result['id']: result for result in dense_results}
+            scores: Dict[str, float] = {}
+            for rank, result in enumerate(dense_results, start=1):
+                scores[result['id']] = 1 / (rrf_k + rank)
+            rank = 0
+            for doc_id, _ in hits:
+                document = by_id.get(doc_id) or documents.get(doc_id)
+                if document is None or (where and not matches_where(document['metadata'] or {}, where)):
+                    continue
+                rank += 1
+                by_id[doc_id] = document
+                scores[doc_id] = scores.get(doc_id, 0.0) + 1 / (rrf_k + rank)
+            
+            top = sorted(scores, key=scores.get, reverse=True)[:k]
+            all_results.append([dict(by_id[doc_id], score=scores[doc_id]) for doc_id in top])
+        return all_results
+    
+    def retrieve_many(
+        self,
+        queries: List[str],
+        k: int = 3,
+        query_embeddings: Optional[List[List[float]]] = None,
+        where: Optional[Dict[str, Any]] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """按初始化時設定的檢索方式搜索，供問答使用"""
+        if self.search_type == "hybrid":
+            return self.hybrid_search_many(queries, k=k, query_embeddings=query_embeddings, where=where)
+        return self.search_many(queries, k=k, query_embeddings=query_embeddings, where=where)
+    
+    def chunks_between(self, lecture_id: str, start: float, end: float) -> List[Dict[str, Any]]:
+        """
+        查詢講座中與時間範圍重疊的文本塊，可用於從答案的來源直接定位到音頻
+        
+        Args:
+            lecture_id: 講座ID
+            start: 開始時間（秒）
+            end: 結束時間（秒）
+            
+        Returns:
+            list: 按開始時間排序的文本塊，包含 id、content、metadata
+        """
+        spans = self.chunk_index.between(lecture_id, start, end)
+        if not spans:
+            return []
+        try:
+            results = self.backend.get(ids=[span["doc_id"] for span in spans])
         except Exception as e:
-            print(f"搜索失敗: {str(e)}")
+            print(f"獲取文檔失敗: {str(e)}")
             return []
+        documents = {
+            doc_id: {'id': doc_id, 'content': content, 'metadata': metadata}
+            for doc_id, content, metadata in zip(results['ids'], results['documents'], results['metadatas'])
+        }
+        return [documents[span["doc_id"]] for span in spans if span["doc_id"] in documents]
+    
+    def chunks_at(self, lecture_id: str, offset: float) -> List[Dict[str, Any]]:
+        """查詢講座中包含某一時刻的文本塊"""
+        return self.chunks_between(lecture_id, offset, offset)
     
     def get_all_documents(self) -> List[Dict[str, Any]]:
         """獲取所有文檔"""
         try:
-            results = self.collection.get()
+            results = self.backend.get()
             documents = []
             for i in range(len(results['ids'])):
                 documents.append({
@@ -120,13 +635,12 @@ class VectorStore(VectorStore):
         **kwargs: Any,
     ) -> "VectorStore":
         """從文本列表創建向量存儲"""
-        persist_directory = kwargs.get("persist_directory", "vector_store")
-        instance = cls(persist_directory)
+        persist_directory = kwargs.pop("persist_directory", "vector_store")
+        instance = cls(persist_directory, embedding=embedding, **kwargs)
         
         # 添加文本到存儲
-        for i, text in enumerate(texts):
-            metadata = metadatas[i] if metadatas else {}
-            instance.add_content(text, metadata)
+        instance.add_contents(texts, metadatas)
+        instance.flush()
             
         return instance
         
@@ -134,10 +648,11 @@ class VectorStore(VectorStore):
         self,
         query: str,
         k: int = 4,
+        filter: Optional[Dict[str, Any]] = None,
         **kwargs: Any,
     ) -> List[Document]:
-        """執行相似度搜索"""
-        results = self.search(query, n_results=k)
+        """執行相似度搜索，filter 為元數據過濾條件"""
+        results = self.search(query, n_results=k, where=filter)
         return [
             Document(
                 page_content=result['content'],
@@ -0,0 +1,257 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import threading
+import time
+from typing import AsyncIterator, Optional
+from modules.text_processor import SentenceSplitter
+from modules.speech_pipeline import ensure_mixer
+from modules.vad import PlaybackAwareVAD, StreamingRecorder
+from modules.tracing import tracer
+
+class VoicePipeline:
+    def __init__(
+        self,
+        voice_qa,
+        qa_system,
+        queue_size: int = 2,
+        lookahead: int = 2,
+        barge_in: bool = False,
+        barge_in_ratio: float = 4.0,
+        echo_tail: float = 0.3,
+        max_seconds: int = 30,
+        poll_interval: float = 0.02
+    ):
+        """
+        異步的端到端語音問答管線
+
+        收音、轉錄、回答、語音合成和播放各自作為一個階段並行運行，階段之間以有界隊列連接：
+        Whisper 轉錄和語音合成在線程池中執行，LLM 請求以協程方式等待。
+        播放答案的同時仍在收音，上一個答案播放完後即可提出下一個問題，轉錄和回答與播放重疊進行。
+        外放時麥克風會錄到答案本身，因此播放期間默認不檢測語音；開啟 barge_in 後，
+        播放時足夠大聲地開始說話會打斷正在播放的答案。
+
+        Args:
+            voice_qa: VoiceQA 實例，提供轉錄、語言檢測和語音合成
+            qa_system: 問答系統，優先使用其 astream_answer 協程，否則在線程池中調用 answer_question
+            queue_size: 轉錄和回答階段的隊列長度，即最多同時處理的問題數量
+            lookahead: 最多提前合成的語音段數
+            barge_in: 播放時開始說話是否打斷播放
+            barge_in_ratio: 播放期間判定為開始說話所需的能量，為平時門限的倍數，避免答案本身觸發打斷
+            echo_tail: 播放結束後仍視為播放中的秒數，覆蓋揚聲器的延遲和房間的回聲
+            max_seconds: 每個問題的最長錄音秒數
+            poll_interval: 檢查播放聲道的間隔秒數
+        """
+        self.voice_qa = voice_qa
+        self.qa_system = qa_system
+        self.queue_size = queue_size
+        self.lookahead = lookahead
+        self.barge_in = barge_in
+        self.barge_in_ratio = barge_in_ratio
+        self.echo_tail = echo_tail
+        self._played_at = 0.0
+        self.max_seconds = max_seconds
+        self.poll_interval = poll_interval
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopped = threading.Event()
+        self._question_ids = itertools.count(1)
+        # 編號小於此值的問題已被打斷，其答案不再合成和播放
+        self._cancel_before = 0
+        self._channel = None
+        self._generating = set()
+        # 各問題說完話的時間，用於記錄從說完到開始播放答案的延遲
+        self._spoken_at = {}
+        self._listen_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="voice-listener")
+        # Whisper 模型不能並行推理，轉錄按順序在單個線程中執行
+        self._whisper_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="voice-transcriber")
+        self._tts_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="voice-synthesizer")
+
+    def _is_stale(self, question_id: int) -> bool:
+        return question_id < self._cancel_before
+
+    async def run(self):
+        """運行管線，直到調用 stop 或收音出錯"""
+        self._loop = asyncio.get_running_loop()
+        self._stopped.clear()
+        utterances = asyncio.Queue(self.queue_size)
+        questions = asyncio.Queue(self.queue_size)
+        answers = asyncio.Queue(self.queue_size)
+        clips = asyncio.Queue(self.lookahead)
+
+        tasks = [
+            asyncio.create_task(self._transcribe(utterances, questions)),
+            asyncio.create_task(self._answer(questions, answers)),
+            asyncio.create_task(self._synthesize(answers, clips)),
+            asyncio.create_task(self._play(clips))
+        ]
+        try:
+            await self._loop.run_in_executor(self._listen_executor, self._listen, utterances)
+        finally:
+            self._stopped.set()
+            if self._channel is not None:
+                self._channel.stop()
+            tasks.extend(self._generating)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for executor in (self._listen_executor, self._whisper_executor, self._tts_executor):
+                executor.shutdown(wait=False)
+
+    def stop(self):
+        """停止管線，可在任意線程中調用"""
+        self._stopped.set()
+
+    def _is_playing(self) -> bool:
+        """揚聲器是否正在播放答案（包括剛結束播放的 echo_tail 秒）"""
+        now = time.monotonic()
+        if self._channel is not None and self._channel.get_busy():
+            self._played_at = now
+            return True
+        return now - self._played_at < self.echo_tail
+
+    def _listen(self, utterances: asyncio.Queue):
+        """收音線程：持續錄製問題，說話過程中已完成的片段立即交給 Whisper"""
+        recorder = StreamingRecorder(self.voice_qa.SAMPLE_RATE, max_utterance_ms=self.max_seconds * 1000)
+        vad = PlaybackAwareVAD(self._is_playing, self.barge_in_ratio if self.barge_in else None)
+        print("\n請開始說話，說完後稍停片刻即可...")
+        while not self._stopped.is_set():
+            question_id = None
+            futures = []
+
+            def on_start():
+                nonlocal question_id
+                question_id = next(self._question_ids)
+                self._loop.call_soon_threadsafe(self._on_speech_start, question_id)
+
+            audio = recorder.record(
+                on_segment=lambda segment: futures.append(
+                    self._whisper_executor.submit(self.voice_qa.transcribe_question, segment)
+                ),
+                start_timeout=None,
+                vad=vad,
+                on_start=on_start,
+                stop_event=self._stopped
+            )
+            if self._stopped.is_set() or question_id is None or not len(audio):
+                continue
+            self._spoken_at[question_id] = time.perf_counter()
+
+            # 隊列已滿時在此等待，避免積壓過多未處理的問題
+            try:
+                asyncio.run_coroutine_threadsafe(
+                    utterances.put((question_id, futures, audio)), self._loop
+                ).result()
+            except Exception:
+                break
+
+    def _on_speech_start(self, question_id: int):
+        """開始說話時，打斷正在播放的答案"""
+        if self.barge_in and self._channel is not None and self._channel.get_busy():
+            self._cancel_before = question_id
+            self._channel.stop()
+            print("\n（已打斷播放）")
+
+    async def _transcribe(self, utterances: asyncio.Queue, questions: asyncio.Queue):
+        """轉錄階段：等待各片段的轉錄結果並拼接為問題"""
+        while True:
+            question_id, futures, audio = await utterances.get()
+            texts = [await asyncio.wrap_future(future) for future in futures]
+            question = self.voice_qa.join_transcripts(texts)
+
+            if self.voice_qa.save_recordings:
+                self.voice_qa.save_recording(audio)
+            if not question:
+                print("抱歉，我沒有聽清楚你的問題。")
+                self._spoken_at.pop(question_id, None)
+                continue
+
+            print(f"\n你的問題是：{question}")
+            await questions.put((question_id, question))
+
+    async def _answer(self, questions: asyncio.Queue, answers: asyncio.Queue):
+        """回答階段：每個問題在獨立的協程中生成答案，多個問題的 LLM 請求可以同時進行"""
+        while True:
+            question_id, question = await questions.get()
+            # 每個答案的句子數量受 LLM 最大輸出長度限制，不必設置上限
+            sentences = asyncio.Queue()
+            task = asyncio.create_task(self._generate(question_id, question, sentences))
+            self._generating.add(task)
+            task.add_done_callback(self._generating.discard)
+            await answers.put((question_id, sentences))
+
+    async def _answer_tokens(self, question: str) -> AsyncIterator[str]:
+        if hasattr(self.qa_system, "astream_answer"):
+            async for token in self.qa_system.astream_answer(question):
+                yield token
+        else:
+            yield await self._loop.run_in_executor(None, self.qa_system.answer_question, question)
+
+    async def _generate(self, question_id: int, question: str, sentences: asyncio.Queue):
+        """生成一個問題的答案，並按句子放入隊列"""
+        question_lang = self.voice_qa.detect_language(question)
+        splitter = SentenceSplitter()
+        lang = None
+        try:
+            async for token in self._answer_tokens(question):
+                if self._is_stale(question_id) or self._stopped.is_set():
+                    return
+                for sentence in splitter.feed(token):
+                    # 以第一句的語言作為整個答案的朗讀語言
+                    lang = lang or self.voice_qa.resolve_answer_language(sentence, question_lang)
+                    sentences.put_nowait((sentence, lang))
+            for sentence in splitter.flush():
+                lang = lang or self.voice_qa.resolve_answer_language(sentence, question_lang)
+                sentences.put_nowait((sentence, lang))
+        except Exception as e:
+            print(f"問答失敗：{str(e)}")
+            sentences.put_nowait(("抱歉，我無法回答這個問題。", question_lang))
+        finally:
+            sentences.put_nowait(None)
+
+    def _load_clip(self, sentence: str, lang: str):
+        """合成一句話並載入為 pygame 聲音"""
+        path = self.voice_qa.synthesize_clip(sentence, lang)
+        if path is None:
+            return None
+        try:
+            return ensure_mixer().mixer.Sound(path)
+        except Exception as e:
+            print(f"音頻載入失敗：{str(e)}")
+            return None
+
+    async def _synthesize(self, answers: asyncio.Queue, clips: asyncio.Queue):
+        """合成階段：按問題順序逐句合成語音"""
+        while True:
+            question_id, sentences = await answers.get()
+            while True:
+                item = await sentences.get()
+                if item is None:
+                    break
+                if self._is_stale(question_id):
+                    continue
+                sentence, lang = item
+                print(sentence)
+                sound = await self._loop.run_in_executor(self._tts_executor, self._load_clip, sentence, lang)
+                if sound is not None and not self._is_stale(question_id):
+                    await clips.put((question_id, sound))
+
+    async def _play(self, clips: asyncio.Queue):
+        """播放階段：每段語音排在聲道隊列中，接在上一段之後播放"""
+        pygame = ensure_mixer()
+        self._channel = pygame.mixer.find_channel(True)
+        # 保留最近的 Sound 對象，避免仍在聲道中播放或排隊時被回收
+        sounds = deque(maxlen=3)
+        while True:
+            question_id, sound = await clips.get()
+            while self._channel.get_queue() is not None:
+                await asyncio.sleep(self.poll_interval)
+            if self._is_stale(question_id):
+                self._spoken_at.pop(question_id, None)
+                continue
+            sounds.append(sound)
+            self._channel.queue(sound)
+            spoken_at = self._spoken_at.pop(question_id, None)
+            if spoken_at is not None:
+                tracer.record("response", time.perf_counter() - spoken_at, question_id=question_id)
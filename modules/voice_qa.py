@@ -1,99 +1,196 @@
-import sounddevice as sd
 import numpy as np
+import contextvars
 import wave
-import os
 from datetime import datetime
 from pathlib import Path
-import whisper
-import tempfile
-from gtts import gTTS
-import pygame
-import pyttsx3
+from typing import Optional, Union, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from modules.model_registry import ModelRegistry, get_whisper_model, use_whisper_model
+from modules.text_processor import TextProcessor
+from modules.tts_worker import get_tts_worker
+from modules.speech_cache import SpeechCache
+from modules.vad import StreamingRecorder
+from modules.speech_pipeline import SpeechPipeline, ensure_mixer
+from modules.text_normalize import detect_language, majority_language, script_counts
+from modules.tracing import tracer
 
 class VoiceQA:
-    def __init__(self, output_dir: str = "voice_questions", use_local_tts: bool = True):
+    # Whisper 要求的輸入格式：16kHz 單聲道 float32
+    SAMPLE_RATE = 16000
+    
+    def __init__(self, output_dir: str = "voice_questions", use_local_tts: bool = True,
+                 model_name: str = "base", device: Optional[str] = None, compute_type: Optional[str] = None,
+                 save_recordings: bool = True, use_vad: bool = True,
+                 speech_cache_max_bytes: int = 128 * 1024 * 1024):
         """初始化語音問答系統"""
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(exist_ok=True)
-        self.model = whisper.load_model("base")
-        # 初始化 pygame 用於播放音頻
-        pygame.mixer.init()
+        # 錄音直接在內存中交給 Whisper，保存到磁盤只在後台進行
+        self.save_recordings = save_recordings
+        self._save_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="recording-saver")
+        # 是否以語音活動檢測決定何時停止錄音，否則錄製固定時長
+        self.use_vad = use_vad
+        # 與 AudioProcessor 共享註冊表中的 Whisper 模型，首次轉錄時才加載
+        self.model_name, self.device, self.compute_type = ModelRegistry.resolve_key(model_name, device, compute_type)
+        # 合成的語音按文本和語音參數緩存，重播和相同的答案無需再次合成
+        self.speech_cache = SpeechCache(str(self.output_dir / "speech_cache"), speech_cache_max_bytes)
+        # 當前正在逐句播放的語音管線
+        self._pipeline: Optional[SpeechPipeline] = None
+        # pygame 音頻設備在第一次播放時才初始化
         # 是否使用本地TTS引擎
         self.use_local_tts = use_local_tts
         
-        # 初始化本地TTS引擎
+        # 本地TTS引擎在常駐的工作進程中只初始化一次，與 Streamlit 應用共用；
+        # 在後台啟動，第一次朗讀時才等待引擎就緒
         if self.use_local_tts:
-            try:
-                self.tts_engine = pyttsx3.init()
-                
-                # 獲取可用的語音
-                voices = self.tts_engine.getProperty('voices')
-                
-                # 設置預設語音
-                default_voice = None
-                chinese_voice = None
-                
-                # 查找中文語音
-                for voice in voices:
-                    if "chinese" in voice.name.lower() or "mandarin" in voice.name.lower() or "zh" in voice.id.lower():
-                        chinese_voice = voice.id
-                    if "microsoft" in voice.name.lower() and ("chinese" in voice.name.lower() or "zh" in voice.id.lower()):
-                        default_voice = voice.id
-                        break
-                
-                # 如果找到了中文語音，設置它
-                if default_voice:
-                    self.tts_engine.setProperty('voice', default_voice)
-                    print(f"設置 TTS 語音為: {default_voice}")
-                elif chinese_voice:
-                    self.tts_engine.setProperty('voice', chinese_voice)
-                    print(f"設置 TTS 語音為: {chinese_voice}")
-                else:
-                    print(f"沒有找到中文語音，使用預設語音")
-                
-                # 設置語速 (默認值為200，值越大語速越快)
-                self.tts_engine.setProperty('rate', 180)
-                
-                # 設置音量 (0.0 到 1.0)
-                self.tts_engine.setProperty('volume', 0.9)
-                
-                print("本地 TTS 引擎初始化成功")
-                
-            except Exception as e:
-                print(f"本地 TTS 引擎初始化失敗: {str(e)}")
-                self.tts_engine = None
-                self.use_local_tts = False
+            self.tts_worker = get_tts_worker()
+            self.tts_worker.start(wait=False)
+    
+    def _local_tts_ready(self) -> bool:
+        """等待本地 TTS 引擎就緒，無法初始化時改用在線服務"""
+        if self.use_local_tts and not self.tts_worker.start():
+            print(f"本地 TTS 引擎初始化失敗: {self.tts_worker.last_error}")
+            self.use_local_tts = False
+        return self.use_local_tts
+    
+    @property
+    def model(self):
+        """共享的 Whisper 模型"""
+        return get_whisper_model(self.model_name, self.device, self.compute_type)
+        
+    def record_question_audio(self, duration: int = 5) -> np.ndarray:
+        """
+        錄製語音問題並直接返回 Whisper 可用的音頻數據
         
-    def record_question(self, duration: int = 5, sample_rate: int = 44100) -> str:
-        """錄製語音問題"""
+        Returns:
+            np.ndarray: 16kHz 單聲道 float32 音頻
+        """
+        import sounddevice as sd
         print(f"\n請開始說話，持續 {duration} 秒...")
-        recording = sd.rec(
-            int(duration * sample_rate),
-            samplerate=sample_rate,
-            channels=1,
-            dtype=np.int16
-        )
-        sd.wait()
+        with tracer.span("audio_capture", mode="fixed", seconds=duration):
+            try:
+                recording = sd.rec(
+                    int(duration * self.SAMPLE_RATE),
+                    samplerate=self.SAMPLE_RATE,
+                    channels=1,
+                    dtype=np.float32
+                )
+                sd.wait()
+                audio = recording[:, 0]
+            except sd.PortAudioError:
+                # 部分設備不支持 16kHz，以設備默認採樣率錄音後再重採樣
+                device_rate = int(sd.query_devices(kind='input')['default_samplerate'])
+                recording = sd.rec(int(duration * device_rate), samplerate=device_rate, channels=1, dtype=np.float32)
+                sd.wait()
+                audio = self.resample(recording[:, 0], device_rate)
         print("錄音結束！")
+        return audio
+    
+    def listen_question(self, max_seconds: int = 30, start_timeout: float = 10.0) -> Tuple[str, np.ndarray]:
+        """
+        持續收音直到說話結束，並在說話過程中轉錄已完成的片段
         
+        Args:
+            max_seconds: 最長錄音秒數
+            start_timeout: 等待開始說話的最長秒數
+            
+        Returns:
+            tuple: (轉錄的問題, 16kHz 單聲道 float32 音頻)
+        """
+        print("\n請開始說話，說完後稍停片刻即可...")
+        recorder = StreamingRecorder(self.SAMPLE_RATE, max_utterance_ms=max_seconds * 1000)
+        futures = []
+        # 轉錄線程沿用當前的追蹤上下文，片段的轉錄耗時記錄在同一次提問中
+        context = contextvars.copy_context()
+        
+        # 單線程按順序轉錄片段，錄音線程不被 Whisper 阻塞
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="partial-transcriber") as executor:
+            with tracer.span("audio_capture", mode="vad") as span:
+                audio = recorder.record(
+                    on_segment=lambda segment: futures.append(
+                        executor.submit(context.copy().run, self.transcribe_question, segment)
+                    ),
+                    start_timeout=start_timeout
+                )
+                span["attributes"]["seconds"] = round(len(audio) / self.SAMPLE_RATE, 2)
+            print("錄音結束！" if len(audio) else "沒有檢測到語音")
+            # 說話結束後仍需等待最後一段轉錄完成
+            with tracer.span("whisper", source="question_tail", segments=len(futures)):
+                texts = [future.result() for future in futures]
+        
+        return self.join_transcripts(texts), audio
+    
+    @staticmethod
+    def join_transcripts(texts: List[str]) -> str:
+        """拼接分段轉錄的文本，只在英文等以空格分詞的文字之間加空格"""
+        joined = ""
+        for text in texts:
+            text = text.strip()
+            if not text:
+                continue
+            if joined and joined[-1].isascii() and text[0].isascii():
+                joined += " "
+            joined += text
+        return joined
+    
+    @classmethod
+    def resample(cls, audio: np.ndarray, sample_rate: int) -> np.ndarray:
+        """將音頻線性重採樣為 16kHz"""
+        if sample_rate == cls.SAMPLE_RATE:
+            return audio.astype(np.float32, copy=False)
+        length = int(round(len(audio) * cls.SAMPLE_RATE / sample_rate))
+        positions = np.linspace(0, len(audio) - 1, num=length)
+        return np.interp(positions, np.arange(len(audio)), audio).astype(np.float32)
+    
+    def save_recording(self, audio: np.ndarray, background: bool = True) -> str:
+        """
+        將錄音保存為 WAV 文件
+        
+        Args:
+            audio: 16kHz 單聲道 float32 音頻
+            background: 是否在後台線程中寫入，不阻塞轉錄
+            
+        Returns:
+            str: 錄音文件路徑
+        """
         # 生成文件名
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f"question_{timestamp}.wav"
         filepath = self.output_dir / filename
         
-        # 保存錄音文件
-        with wave.open(str(filepath), 'wb') as wf:
-            wf.setnchannels(1)
-            wf.setsampwidth(2)
-            wf.setframerate(sample_rate)
-            wf.writeframes(recording.tobytes())
-            
+        def write():
+            try:
+                pcm = (np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16)
+                with wave.open(str(filepath), 'wb') as wf:
+                    wf.setnchannels(1)
+                    wf.setsampwidth(2)
+                    wf.setframerate(self.SAMPLE_RATE)
+                    wf.writeframes(pcm.tobytes())
+            except Exception as e:
+                print(f"保存錄音失敗：{str(e)}")
+        
+        if background:
+            self._save_executor.submit(write)
+        else:
+            write()
         return str(filepath)
     
-    def transcribe_question(self, audio_path: str) -> str:
-        """將語音轉換為文字"""
+    def record_question(self, duration: int = 5) -> str:
+        """錄製語音問題並保存為文件"""
+        audio = self.record_question_audio(duration)
+        return self.save_recording(audio, background=False)
+    
+    def transcribe_question(self, audio: Union[str, np.ndarray]) -> str:
+        """
+        將語音轉換為文字
+        
+        Args:
+            audio: 音頻文件路徑，或 16kHz 單聲道 float32 音頻數據（無需臨時文件和 ffmpeg）
+        """
         try:
-            result = self.model.transcribe(audio_path)
+            with tracer.span("whisper", source="question", model=self.model_name):
+                with use_whisper_model(self.model_name, self.device, self.compute_type) as model:
+                    result = model.transcribe(audio, fp16=self.compute_type == "float16")
             text = result["text"].strip()
             # 使用Whisper提供的語言檢測結果
             detected_language = result.get("language", "")
@@ -106,16 +203,16 @@ class VoiceQA:
             
     def text_to_speech(self, text: str, lang: str = 'zh-tw') -> str:
         """將文字轉換為語音"""
-        if self.use_local_tts:
+        if self._local_tts_ready():
             try:
                 # 如果是日文或韓文，直接使用gTTS，因為pyttsx3對這些語言支持不佳
                 if lang in ['ja', 'ko']:
                     print(f"檢測到{lang}語言，切換到在線TTS服務...")
                     return self._gtts_to_speech(text, lang)
                     
-                # 直接使用本地引擎播放，無需保存文件
-                self.tts_engine.say(text)
-                self.tts_engine.runAndWait()
+                # 交給本地TTS工作進程播放，無需保存文件
+                if not self.tts_worker.speak(text):
+                    raise RuntimeError(self.tts_worker.last_error or "朗讀未完成")
                 return None  # 無需返回文件路徑
             except Exception as e:
                 print(f"本地語音生成失敗：{str(e)}")
@@ -128,57 +225,68 @@ class VoiceQA:
     
     def _gtts_to_speech(self, text: str, lang: str = 'zh-tw') -> str:
         """使用gTTS將文字轉換為語音"""
-        try:
-            # 創建臨時文件
-            with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as temp_file:
-                temp_path = temp_file.name
-            
-            # 生成語音
-            tts = gTTS(text=text, lang=lang)
-            tts.save(temp_path)
-            
-            return temp_path
-        except Exception as e:
-            print(f"語音生成失敗：{str(e)}")
-            return None
+        return self.synthesize_speech(text, lang)
+    
+    def synthesize_speech(self, text: str, lang: str = 'zh-tw', slow: bool = False) -> Optional[str]:
+        """
+        使用gTTS合成語音，結果保存在語音緩存中
+        
+        Returns:
+            str: 緩存中的 MP3 文件路徑，播放後無需刪除；合成失敗時為 None
+        """
+        from gtts import gTTS
+        key = SpeechCache.make_key(text, lang, "gtts", {"slow": slow})
+        with tracer.span("tts", engine="gtts", lang=lang, chars=len(text)):
+            return self.speech_cache.get_or_create(
+                key, lambda path: gTTS(text=text, lang=lang, slow=slow).save(path)
+            )
     
     def play_audio(self, audio_path: str):
         """播放音頻文件"""
+        pygame = ensure_mixer()
         try:
-            pygame.mixer.music.load(audio_path)
-            pygame.mixer.music.play()
-            while pygame.mixer.music.get_busy():
-                pygame.time.Clock().tick(10)
+            with tracer.span("playback"):
+                pygame.mixer.music.load(audio_path)
+                pygame.mixer.music.play()
+                while pygame.mixer.music.get_busy():
+                    pygame.time.Clock().tick(10)
         except Exception as e:
             print(f"音頻播放失敗：{str(e)}")
-    
+
+    def stop_speaking(self):
+        """停止正在播放的語音，並丟棄排隊中的朗讀"""
+        if self._pipeline is not None:
+            self._pipeline.stop()
+        if self.use_local_tts:
+            self.tts_worker.cancel()
+        import pygame
+        if pygame.mixer.get_init():
+            pygame.mixer.music.stop()
+
     def detect_language(self, text: str) -> str:
-        """嘗試檢測文本語言"""
-        # 優先檢測日文特有字符（平假名和片假名）
-        if any('\u3040' <= char <= '\u309F' for char in text) or any('\u30A0' <= char <= '\u30FF' for char in text):
-            return 'ja'
-            
-        # 檢測韓文字符（朝鮮文音節、朝鮮文字母）
-        if any('\uac00' <= char <= '\ud7a3' for char in text) or any('\u1100' <= char <= '\u11ff' for char in text):
-            return 'ko'
-            
-        # 檢測中文字符（中日韓統一表意文字）
-        if any('\u4e00' <= char <= '\u9fff' for char in text):
-            # 只有當同時存在漢字和日文特有字符（平假名和片假名）時才判定為日文
-            if any('\u3040' <= char <= '\u309F' for char in text) or any('\u30A0' <= char <= '\u30FF' for char in text):
-                return 'ja'
-            return 'zh-tw'
-            
-        # 更多語言檢測可以在這裡添加
-        return 'en'  # 默認英語
+        """嘗試檢測文本語言：含假名為日文，其次含諺文為韓文，含漢字為中文，否則為英文"""
+        return detect_language(text)
+    
+    def detect_answer_language(self, text: str) -> str:
+        """檢測答案的朗讀語言，混合多種語言時按字符最多的語言判斷"""
+        return majority_language(script_counts(text))
             
     def ask_question(self, qa_system) -> str:
-        """錄音並提問"""
-        # 錄製問題
-        audio_path = self.record_question()
+        """錄音並提問，各階段的耗時記錄在同一次追蹤中"""
+        with tracer.span("ask_question", vad=self.use_vad):
+            return self._ask_question(qa_system)
+
+    def _ask_question(self, qa_system) -> str:
+        # 錄製問題並轉換為文字，音頻直接在內存中轉錄
+        if self.use_vad:
+            question, audio = self.listen_question()
+        else:
+            audio = self.record_question_audio()
+            question = self.transcribe_question(audio)
         
-        # 轉換為文字
-        question = self.transcribe_question(audio_path)
+        # 需要保存錄音時在後台寫入
+        if self.save_recordings and len(audio):
+            self.save_recording(audio)
         if not question:
             return "抱歉，我沒有聽清楚你的問題。"
             
@@ -187,12 +295,25 @@ class VoiceQA:
         print(f"\n你的問題是：{question}")
         print(f"問題語言檢測結果：{question_lang}")
         
+        # 支持流式回答時，每完成一句就開始朗讀，不必等待完整答案
+        if hasattr(qa_system, "stream_answer"):
+            return self._speak_streamed_answer(qa_system.stream_answer(question), question_lang)
+        
         # 獲取答案
         answer = qa_system.answer_question(question)
         print(f"\n答案：{answer}")
         
-        # 檢測答案語言，預設使用問題的語言
-        lang = self.detect_language(answer)
+        lang = self.resolve_answer_language(answer, question_lang)
+        
+        # 將答案轉換為語音並播放
+        print("正在播放語音回答...")
+        self.speak(answer, lang)
+        
+        return answer
+    
+    def resolve_answer_language(self, answer: str, question_lang: str) -> str:
+        """檢測答案語言，預設使用問題的語言；混合多種語言的答案按字符最多的語言朗讀"""
+        lang = self.detect_answer_language(answer)
         if lang == 'en' and question_lang != 'en':
             # 如果答案被檢測為英文，但問題不是英文，則使用問題的語言
             # 這是為了處理某些可能未包含特定語言特徵的短回答
@@ -200,21 +321,78 @@ class VoiceQA:
             print(f"答案語言檢測為英文，但根據問題語言調整為：{lang}")
         else:
             print(f"答案語言檢測結果：{lang}")
+        return lang
+    
+    def speak(self, text: str, lang: str):
+        """朗讀一段文本，按句子切分後邊合成邊播放"""
+        self.speak_sentences(TextProcessor.iter_sentences([text]), lambda: lang)
+    
+    def speak_sentences(self, sentences, get_lang) -> int:
+        """
+        逐句合成並連續播放
         
-        # 將答案轉換為語音並播放
-        print("正在播放語音回答...")
-        if self.use_local_tts and lang not in ['ja', 'ko']:
-            # 使用本地TTS直接播放 (對於中文和英文)
-            self.text_to_speech(answer, lang)
-        else:
-            # 使用gTTS播放 (對於日文、韓文或當本地TTS不可用時)
-            speech_file = self.text_to_speech(answer, lang)
-            if speech_file:
-                self.play_audio(speech_file)
-                # 刪除臨時文件
-                try:
-                    os.unlink(speech_file)
-                except:
-                    pass
-        
-        return answer 
\ No newline at end of file
+        Args:
+            sentences: 要朗讀的句子，可以是仍在生成中的迭代器
+            get_lang: 返回朗讀語言的函數，在合成每一句時調用
+            
+        Returns:
+            int: 播放的語音段數
+        """
+        pipeline = SpeechPipeline(lambda sentence: self.synthesize_clip(sentence, get_lang()))
+        self._pipeline = pipeline
+        try:
+            # 合成與播放同時進行，播放的耗時包含等待合成第一句的時間
+            with tracer.span("playback", mode="pipeline") as span:
+                played = pipeline.play(sentences)
+                span["attributes"]["clips"] = played
+            return played
+        finally:
+            self._pipeline = None
+    
+    def synthesize_clip(self, text: str, lang: str) -> Optional[str]:
+        """將一句話合成為可播放的音頻文件，本地引擎失敗時改用在線服務"""
+        if lang not in ['ja', 'ko'] and self._local_tts_ready():
+            path = self.synthesize_local(text)
+            if path is not None:
+                return path
+            print("本地語音生成失敗，嘗試使用在線語音服務...")
+        return self.synthesize_speech(text, lang)
+    
+    def synthesize_local(self, text: str) -> Optional[str]:
+        """使用本地TTS工作進程合成語音，結果保存在語音緩存中"""
+        # 緩存鍵包含引擎選用的語音，需在引擎就緒後計算
+        if not self._local_tts_ready():
+            return None
+        key = SpeechCache.make_key(text, "", "pyttsx3", self.tts_worker.voice_options())
+        
+        def synthesize(path: str):
+            if not self.tts_worker.synthesize(text, path):
+                raise RuntimeError(self.tts_worker.last_error or "合成未完成")
+        
+        with tracer.span("tts", engine="pyttsx3", chars=len(text)):
+            return self.speech_cache.get_or_create(key, synthesize, suffix=".wav")
+    
+    def _speak_streamed_answer(self, tokens, question_lang: str) -> str:
+        """一邊接收流式答案一邊逐句合成和朗讀，返回完整答案"""
+        parts = []
+        lang = None
+        
+        def collect():
+            for token in tokens:
+                parts.append(token)
+                yield token
+        
+        def sentences():
+            nonlocal lang
+            for sentence in TextProcessor.iter_sentences(collect()):
+                print(sentence)
+                # 以第一句的語言作為整個答案的朗讀語言
+                if lang is None:
+                    lang = self.resolve_answer_language(sentence, question_lang)
+                    print("正在播放語音回答...")
+                yield sentence
+        
+        print("\n答案：")
+        self.speak_sentences(sentences(), lambda: lang)
+        
+        return "".join(parts).strip()
\ No newline at end of file
@@ -0,0 +1,40 @@
+import hashlib
+import sys
+from pathlib import Path
+from typing import List
+import pytest
+
+# 測試直接導入項目根目錄下的 modules 包
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+class HashEmbeddings:
+    """
+    按詞項哈希到固定維度的確定性嵌入，測試中代替 sentence-transformers 模型
+
+    包含相同詞項的文本得到相近的向量，無需下載模型。
+    """
+    model_name = "hash"
+
+    def __init__(self, dimension: int = 64):
+        self.dimension = dimension
+        self.calls = 0
+
+    def _vector(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimension
+        for term in text.lower().split():
+            digest = hashlib.sha256(term.encode("utf-8")).digest()
+            vector[digest[0] % self.dimension] += 1.0
+        if not any(vector):
+            vector[0] = 1.0
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._vector(text)
+
+@pytest.fixture
+def hash_embeddings():
+    return HashEmbeddings()
@@ -0,0 +1,75 @@
+import gc
+import time
+import weakref
+import numpy as np
+import pytest
+
+from modules import answer_cache
+from modules.answer_cache import AnswerCache
+
+CHUNKS = ["doc_a", "doc_b"]
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = AnswerCache(str(tmp_path / "answers.json"), similarity_threshold=0.95, ttl=60, save_delay=60)
+    yield cache
+    cache.flush()
+
+def unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+def test_exact_hit_ignores_case_and_punctuation(cache):
+    cache.store("What is photosynthesis?", None, CHUNKS, "答案")
+    assert cache.lookup("  what is   PHOTOSYNTHESIS ", None, list(reversed(CHUNKS))) == "答案"
+
+def test_semantic_hit_requires_threshold_and_same_chunks(cache):
+    cache.store("光合作用是什麼", unit(1, 0, 0), CHUNKS, "答案")
+    assert cache.lookup("什麼是光合作用", unit(1, 0.1, 0), CHUNKS) == "答案"
+    assert cache.lookup("什麼是光合作用", unit(1, 1, 0), CHUNKS) is None
+    # 檢索到的文檔不同時舊答案不再適用
+    assert cache.lookup("什麼是光合作用", unit(1, 0.1, 0), ["doc_c"]) is None
+
+def test_entries_expire_after_ttl(cache, monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(answer_cache.time, "time", lambda: now)
+    cache.store("問題", unit(0, 1, 0), CHUNKS, "答案")
+    now += 30
+    assert cache.lookup("問題", None, CHUNKS) == "答案"
+    now += 31
+    assert cache.lookup("問題", None, CHUNKS) is None
+    assert cache.lookup("問題", unit(0, 1, 0), CHUNKS) is None
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = AnswerCache(str(tmp_path / "answers.json"), max_entries=2, save_delay=60)
+    cache.store("一", None, CHUNKS, "1")
+    cache.store("二", None, CHUNKS, "2")
+    assert cache.lookup("一", None, CHUNKS) == "1"
+    cache.store("三", None, CHUNKS, "3")
+    assert cache.lookup("二", None, CHUNKS) is None
+    assert cache.lookup("一", None, CHUNKS) == "1"
+    cache.flush()
+
+def test_flush_persists_entries(tmp_path):
+    path = str(tmp_path / "answers.json")
+    cache = AnswerCache(path, save_delay=60)
+    cache.store("問題", unit(0, 0, 1), CHUNKS, "答案")
+    cache.flush()
+
+    reopened = AnswerCache(path, save_delay=60)
+    assert reopened.lookup("另一種問法", unit(0, 0.01, 1), CHUNKS) == "答案"
+
+def test_unused_cache_is_released(tmp_path):
+    path = str(tmp_path / "answers.json")
+    cache = AnswerCache(path, save_delay=0.01)
+    cache.store("問題", None, CHUNKS, "答案")
+    reference = weakref.ref(cache)
+    del cache
+    for _ in range(100):
+        gc.collect()
+        if reference() is None:
+            break
+        time.sleep(0.01)
+    # 後台保存完成後實例被回收，不會保留到進程退出
+    assert reference() is None
+    assert AnswerCache(path).lookup("問題", None, CHUNKS) == "答案"
@@ -0,0 +1,58 @@
+import pytest
+
+from modules import audio_processor
+from modules.audio_processor import AudioProcessor
+
+@pytest.fixture
+def processor(tmp_path):
+    return AudioProcessor(str(tmp_path / "out"), device="cpu", num_workers=4, long_audio_threshold=600)
+
+@pytest.fixture
+def audio_file(tmp_path):
+    path = tmp_path / "lecture.wav"
+    path.write_bytes(b"not really audio")
+    return str(path)
+
+def test_stream_writes_transcript_while_yielding(monkeypatch, processor, audio_file):
+    def fake_iter_transcribe(path, model_name, device, compute_type, num_workers=1):
+        yield {"id": 0, "start": 0.0, "end": 1.0, "text": "第一段", "language": "zh"}
+        yield {"id": 1, "start": 1.0, "end": 2.0, "text": "第二段", "language": "zh"}
+
+    monkeypatch.setattr(audio_processor, "iter_transcribe", fake_iter_transcribe)
+
+    output_path, segments = processor.transcribe_stream(audio_file)
+    assert next(segments)["text"] == "第一段"
+    # 片段在返回時已經寫入文件
+    assert output_path.read_text(encoding="utf-8") == "第一段"
+    assert [segment["text"] for segment in segments] == ["第二段"]
+    assert output_path.read_text(encoding="utf-8") == "第一段第二段"
+    assert len(output_path.with_suffix(".segments.jsonl").read_text(encoding="utf-8").splitlines()) == 2
+
+@pytest.mark.parametrize("duration, expected_workers", [(10.0, 1), (None, 1), (1200.0, 4)])
+def test_stream_uses_process_pool_only_for_long_audio(monkeypatch, processor, audio_file, duration, expected_workers):
+    calls = []
+
+    def fake_iter_transcribe(path, model_name, device, compute_type, num_workers=1):
+        calls.append(num_workers)
+        yield {"id": 0, "start": 0.0, "end": 1.0, "text": "片段", "language": "zh"}
+
+    monkeypatch.setattr(audio_processor, "probe_duration", lambda path: duration)
+    monkeypatch.setattr(audio_processor, "iter_transcribe", fake_iter_transcribe)
+
+    output_path, segments = processor.transcribe_stream(audio_file)
+    assert [segment["text"] for segment in segments] == ["片段"]
+    assert calls == [expected_workers]
+    assert output_path.read_text(encoding="utf-8") == "片段"
+
+def test_stream_reads_cached_segments(monkeypatch, processor, audio_file):
+    monkeypatch.setattr(audio_processor, "probe_duration", lambda path: 10.0)
+    monkeypatch.setattr(
+        audio_processor, "iter_transcribe",
+        lambda *args, **kwargs: iter([{"id": 0, "start": 0.0, "end": 1.0, "text": "片段"}])
+    )
+    _, segments = processor.transcribe_stream(audio_file)
+    list(segments)
+
+    monkeypatch.setattr(audio_processor, "iter_transcribe", None)
+    _, cached = processor.transcribe_stream(audio_file)
+    assert [segment["text"] for segment in cached] == ["片段"]
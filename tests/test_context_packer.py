@@ -0,0 +1,68 @@
+import pytest
+
+pytest.importorskip("tiktoken")
+pytest.importorskip("langchain")
+
+from langchain.schema import Document
+from modules.context_packer import ContextPacker
+
+TEXT = "".join(f"第{i}句講的是光合作用的第{i}個步驟。" for i in range(40))
+
+@pytest.fixture
+def packer():
+    packer = ContextPacker(max_tokens=3000, min_overlap=10)
+    # 按字符數計算 token，結果不依賴 tiktoken 編碼文件
+    packer.encoding = None
+    return packer
+
+def chunk(start, end, lecture="L1", **metadata):
+    return Document(page_content=TEXT[start:end], metadata={"lecture_id": lecture, "start": start, "end": end, **metadata})
+
+def test_overlapping_chunks_merge_into_one_passage(packer):
+    documents = [chunk(100, 300), chunk(0, 150), chunk(250, 400)]
+    packed = packer.pack(documents)
+
+    assert len(packed) == 1
+    assert packed[0].page_content == TEXT[0:400]
+    assert packed[0].metadata["start"] == 0 and packed[0].metadata["end"] == 400
+
+def test_contained_and_duplicate_chunks_are_dropped(packer):
+    documents = [chunk(0, 200), chunk(50, 100), chunk(0, 200)]
+    passages = packer.merge(documents)
+    assert [passage["text"] for passage in passages] == [TEXT[0:200]]
+    assert passages[0]["chunks"] == 3
+
+def test_chunks_from_different_lectures_stay_separate(packer):
+    documents = [chunk(0, 150, lecture="L1"), chunk(100, 250, lecture="L2")]
+    packed = packer.pack(documents)
+    assert [document.page_content for document in packed] == [TEXT[0:150], TEXT[100:250]]
+
+def test_bridging_chunk_joins_two_passages(packer):
+    documents = [chunk(0, 100), chunk(200, 300), chunk(80, 220)]
+    packed = packer.pack(documents)
+    assert [document.page_content for document in packed] == [TEXT[0:300]]
+
+def test_budget_skips_chunks_that_do_not_fit(packer):
+    documents = [chunk(0, 100, lecture="A"), chunk(0, 120, lecture="B"), chunk(0, 50, lecture="C")]
+    packed = packer.pack(documents, max_tokens=160)
+    # 第二個文本塊放不下，較不相關但較短的第三個仍可放入
+    assert [document.metadata["lecture_id"] for document in packed] == ["A", "C"]
+    assert sum(packer.count_tokens(document.page_content) for document in packed) <= 160
+
+def test_merged_overlap_only_counts_once_against_budget(packer):
+    documents = [chunk(0, 100), chunk(80, 180)]
+    packed = packer.pack(documents, max_tokens=180)
+    assert [document.page_content for document in packed] == [TEXT[0:180]]
+
+def test_oversized_first_chunk_is_truncated(packer):
+    packed = packer.pack([chunk(0, 500)], max_tokens=120)
+    assert [document.page_content for document in packed] == [TEXT[0:120]]
+
+def test_truncate_with_tiktoken():
+    packer = ContextPacker()
+    if packer.encoding is None:
+        pytest.skip("無法加載 tiktoken 編碼")
+    text = "Photosynthesis converts light energy into chemical energy. " * 20
+    truncated = packer.truncate(text, 10)
+    assert text.startswith(truncated)
+    assert packer.count_tokens(truncated) <= 10
@@ -0,0 +1,81 @@
+from modules.ingest_queue import IngestQueue, IngestService
+
+class FakeVectorStore:
+    def __init__(self, persisted=True):
+        self.persisted = persisted
+        self.metadatas = []
+
+    def add_contents(self, contents, metadatas):
+        self.metadatas.extend(metadatas)
+        return [f"id-{len(self.metadatas)}-{i}" for i in range(len(contents))]
+
+    def has_documents(self, ids):
+        return self.persisted
+
+    def flush(self):
+        return True
+
+class FakeAudioProcessor:
+    def __init__(self):
+        self.remembered = {}
+
+    def remember_chunk_ids(self, audio_path, doc_ids):
+        self.remembered[audio_path] = doc_ids
+
+def transcribe(queue, worker_pid=1):
+    """模擬工作進程完成一次轉錄和分塊"""
+    job = queue.claim(worker_pid)
+    queue.set_metadata(job["id"], {"source": "lecture.txt", "lecture_id": "L1"})
+    queue.add_chunk(job["id"], 0, "光合作用", 0.0, 5.0)
+    queue.mark_chunked(job["id"])
+    return job
+
+def make_service(tmp_path, vector_store):
+    queue = IngestQueue(str(tmp_path / "jobs.sqlite3"))
+    return IngestService(queue, str(tmp_path / "out"), vector_store, FakeAudioProcessor())
+
+def test_indexed_job_finishes(tmp_path):
+    service = make_service(tmp_path, FakeVectorStore())
+    job_id = service.submit("lecture.wav", b"audio")
+    transcribe(service.queue)
+    assert service._index_pending() == 1
+    service._finish_completed()
+
+    job = service.queue.get(job_id)
+    assert job["status"] == "done"
+    assert service.audio_processor.remembered[job["audio_path"]] == ["id-1-0"]
+    assert service.vector_store.metadatas[0]["lecture_id"] == "L1"
+
+def test_reindex_is_retried_once(tmp_path):
+    # 文本塊始終沒有寫入向量存儲
+    service = make_service(tmp_path, FakeVectorStore(persisted=False))
+    job_id = service.submit("lecture.wav", b"audio")
+
+    transcribe(service.queue)
+    service._index_pending()
+    service._finish_completed()
+    job = service.queue.get(job_id)
+    assert job["status"] == "queued"
+    assert job["metadata"]["reindex"] and job["metadata"]["reindex_attempts"] == 1
+
+    transcribe(service.queue)
+    assert service.queue.get(job_id)["metadata"]["reindex_attempts"] == 1
+    service._index_pending()
+    service._finish_completed()
+    job = service.queue.get(job_id)
+    assert job["status"] == "failed"
+    assert service.queue.claim(1) is None
+    # 重試次數只用於任務控制，不寫入文本塊的元數據
+    assert all("reindex_attempts" not in metadata for metadata in service.vector_store.metadatas)
+
+def test_missing_cached_chunks_are_reindexed_once(tmp_path):
+    service = make_service(tmp_path, FakeVectorStore(persisted=False))
+    job_id = service.submit("lecture.wav", b"audio")
+    for _ in range(2):
+        job = service.queue.claim(1)
+        assert job is not None
+        # 此音檔已處理過，只需確認文本塊仍在向量存儲中
+        service.queue.set_metadata(job["id"], {"chunk_ids": ["old-id"]})
+        service.queue.mark_chunked(job["id"])
+        service._finish_completed()
+    assert service.queue.get(job_id)["status"] == "failed"
@@ -0,0 +1,41 @@
+from modules.lexical_index import LexicalIndex, tokenize
+
+def test_tokenize_splits_cjk_into_bigrams():
+    assert tokenize("光合作用") == ["光合", "合作", "作用"]
+    assert tokenize("DNA 複製 is Important!") == ["dna", "複製", "is", "important"]
+    assert tokenize("一") == ["一"]
+
+def test_search_ranks_exact_terms_first(tmp_path):
+    index = LexicalIndex(str(tmp_path / "lexical.sqlite3"))
+    index.add(
+        ["a", "b", "c"],
+        ["卡爾文循環發生在葉綠體基質中", "光合作用需要陽光和水", "細胞呼吸在粒線體中進行"]
+    )
+    results = index.search("卡爾文循環是什麼", k=3)
+    assert results[0][0] == "a"
+    assert all(doc_id != "c" for doc_id, _ in results)
+    assert [score for _, score in results] == sorted((score for _, score in results), reverse=True)
+
+def test_overwrite_and_remove(tmp_path):
+    index = LexicalIndex(str(tmp_path / "lexical.sqlite3"))
+    index.add(["a", "b"], ["mitochondria energy", "chloroplast energy"])
+    index.add(["a"], ["ribosome protein"])
+    assert [doc_id for doc_id, _ in index.search("mitochondria")] == []
+    assert [doc_id for doc_id, _ in index.search("ribosome")] == ["a"]
+
+    index.remove(["b", "missing"])
+    assert index.count() == 1
+    assert index.search("chloroplast") == []
+
+def test_index_persists(tmp_path):
+    path = str(tmp_path / "lexical.sqlite3")
+    LexicalIndex(path).add(["a", "b"], ["krebs cycle", "glycolysis pathway"])
+    reopened = LexicalIndex(path)
+    assert sorted(reopened.doc_ids()) == ["a", "b"]
+    assert [doc_id for doc_id, _ in reopened.search("glycolysis")] == ["b"]
+
+def test_search_returns_at_most_k(tmp_path):
+    index = LexicalIndex(str(tmp_path / "lexical.sqlite3"))
+    index.add([str(i) for i in range(50)], [f"energy note {i}" for i in range(50)])
+    assert len(index.search("energy", k=5)) == 5
+    assert index.search("", k=5) == []
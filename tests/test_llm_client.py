@@ -0,0 +1,148 @@
+import asyncio
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("langchain_core")
+
+from modules.llm_client import LLMClient
+from modules.mock_llm_server import MockLLMServer
+
+@pytest.fixture
+def server():
+    server = MockLLMServer(latency=0.2, stream_delay=0.005)
+    server.start()
+    yield server
+    server.stop()
+
+def make_client(server, **options):
+    options.setdefault("base_delay", 0.01)
+    options.setdefault("max_delay", 0.05)
+    return LLMClient(api_key="mock", base_url=server.url, **options)
+
+def ask(question):
+    return [{"role": "user", "content": question}]
+
+def test_complete_returns_answer(server):
+    client = make_client(server)
+    try:
+        assert client.complete(ask("光合作用")) == "模擬答案：光合作用"
+    finally:
+        client.close()
+
+def test_identical_concurrent_completions_are_sent_once(server):
+    client = make_client(server)
+
+    async def burst():
+        return await asyncio.gather(*(client.acomplete(ask(f"問題 {i % 2}")) for i in range(6)))
+
+    try:
+        answers = asyncio.run(burst())
+    finally:
+        client.close()
+    assert answers == ["模擬答案：問題 0", "模擬答案：問題 1"] * 3
+    assert server.counts["received"] == 2
+    assert client.stats["deduplicated"] == 4
+
+def test_identical_concurrent_streams_share_one_request(server):
+    client = make_client(server)
+
+    async def read(question):
+        return [text async for text in client.astream(ask(question))]
+
+    async def burst():
+        return await asyncio.gather(*(read("同一個問題") for _ in range(4)), read("另一個問題"))
+
+    try:
+        results = asyncio.run(burst())
+    finally:
+        client.close()
+    # 每個調用方都收到完整的文本段序列
+    assert all("".join(parts) == "模擬答案：同一個問題" for parts in results[:4])
+    assert all(parts == results[0] for parts in results[:4])
+    assert "".join(results[4]) == "模擬答案：另一個問題"
+    assert server.counts["received"] == 2
+    assert client.stats["deduplicated"] == 3
+
+def test_stream_reader_stopping_early_does_not_affect_others(server):
+    client = make_client(server)
+
+    async def first_chunk(question):
+        async for text in client.astream(ask(question)):
+            return text
+
+    async def read_all(question):
+        return "".join([text async for text in client.astream(ask(question))])
+
+    async def burst():
+        return await asyncio.gather(first_chunk("共用的問題"), read_all("共用的問題"))
+
+    try:
+        first, full = asyncio.run(burst())
+    finally:
+        client.close()
+    assert full == "模擬答案：共用的問題"
+    assert full.startswith(first)
+
+def test_sync_stream(server):
+    client = make_client(server)
+    try:
+        assert "".join(client.stream(ask("同步"))) == "模擬答案：同步"
+    finally:
+        client.close()
+
+def test_rate_limited_requests_are_retried(server):
+    server.requests_per_second = 1
+    client = make_client(server, max_retries=5)
+
+    async def burst():
+        return await asyncio.gather(*(client.acomplete(ask(f"問題 {i}")) for i in range(3)))
+
+    try:
+        answers = asyncio.run(burst())
+    finally:
+        client.close()
+    assert answers == [f"模擬答案：問題 {i}" for i in range(3)]
+    assert server.counts["rate_limited"] > 0
+    assert client.stats["retries"] >= server.counts["rate_limited"]
+
+def test_failed_completion_attempts_refund_token_estimate(server):
+    server.error_rate = 1.0
+    client = make_client(server, tokens_per_minute=10000, max_retries=3)
+    try:
+        with pytest.raises(Exception):
+            client.complete(ask("問題"), max_tokens=2000)
+    finally:
+        client.close()
+    assert server.counts["failed"] == 4
+    # 四次嘗試各預扣約 2000 個 token，全部歸還後令牌桶仍接近滿
+    assert client.tokens.tokens > client.tokens.capacity - 100
+
+def test_failed_stream_attempts_refund_token_estimate(server):
+    server.error_rate = 1.0
+    client = make_client(server, tokens_per_minute=10000, max_retries=3)
+    try:
+        with pytest.raises(Exception):
+            list(client.stream(ask("問題"), max_tokens=2000))
+    finally:
+        client.close()
+    assert server.counts["failed"] == 4
+    assert client.tokens.tokens > client.tokens.capacity - 100
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_rejected_requests_refund_token_estimate(server, streaming):
+    client = make_client(server, tokens_per_minute=20000, max_retries=3)
+    # 提示很長，max_tokens 超過模擬服務的上限，請求返回 400
+    messages = ask("光合作用 " * 1000)
+    try:
+        for _ in range(4):
+            with pytest.raises(Exception) as error:
+                if streaming:
+                    list(client.stream(messages, max_tokens=5000))
+                else:
+                    client.complete(messages, max_tokens=5000)
+            assert getattr(error.value, "status_code", None) == 400
+    finally:
+        client.close()
+    # 無效的請求不重試，也不佔用令牌桶
+    assert client.stats["retries"] == 0
+    assert client.tokens.tokens > client.tokens.capacity - 100
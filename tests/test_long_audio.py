@@ -0,0 +1,74 @@
+import numpy as np
+
+from modules.long_audio import SAMPLE_RATE, find_split_points, iter_windows, make_windows, stitch_segments
+
+def tone_with_pauses(seconds, pause_every, pause_seconds=0.5):
+    """每隔 pause_every 秒有一段靜音的測試音頻"""
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    audio = (0.3 * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+    for start in np.arange(pause_every, seconds, pause_every):
+        audio[int(start * SAMPLE_RATE):int((start + pause_seconds) * SAMPLE_RATE)] = 0
+    return audio
+
+def test_short_audio_is_one_window():
+    audio = tone_with_pauses(30, 10)
+    assert find_split_points(audio, window_seconds=120) == [0, len(audio)]
+    assert make_windows(audio, window_seconds=120) == [(0, len(audio), 0, len(audio))]
+
+def test_windows_split_in_silence_and_cover_audio():
+    audio = tone_with_pauses(300, 55)
+    windows = make_windows(audio, window_seconds=60, overlap_seconds=2)
+
+    assert len(windows) > 1
+    # 保留區間首尾相接，覆蓋整段音頻
+    assert windows[0][2] == 0 and windows[-1][3] == len(audio)
+    for previous, current in zip(windows, windows[1:]):
+        assert previous[3] == current[2]
+    for start, end, keep_start, keep_end in windows:
+        assert start <= keep_start < keep_end <= end
+        assert keep_start - start <= SAMPLE_RATE and end - keep_end <= SAMPLE_RATE
+    # 切分點落在靜音中
+    for _, _, keep_start, _ in windows[1:]:
+        assert audio[keep_start] == 0
+
+def test_stitch_drops_overlap_duplicates():
+    windows = [(0, 11 * SAMPLE_RATE, 0, 10 * SAMPLE_RATE), (9 * SAMPLE_RATE, 20 * SAMPLE_RATE, 10 * SAMPLE_RATE, 20 * SAMPLE_RATE)]
+    window_segments = [
+        [
+            {"start": 0.0, "end": 4.0, "text": " 第一句"},
+            {"start": 4.0, "end": 9.8, "text": " 第二句"},
+            # 中點落在下一個窗口的保留區間，由下一個窗口負責
+            {"start": 9.8, "end": 11.0, "text": " 第三"}
+        ],
+        [
+            {"start": 9.0, "end": 9.8, "text": " 第二句"},
+            {"start": 9.8, "end": 13.0, "text": " 第三句"},
+            {"start": 13.0, "end": 20.0, "text": " 第四句"}
+        ]
+    ]
+    segments = stitch_segments(windows, window_segments)
+    assert [segment["text"] for segment in segments] == [" 第一句", " 第二句", " 第三句", " 第四句"]
+    assert [segment["id"] for segment in segments] == [0, 1, 2, 3]
+
+def test_stitch_drops_repeated_text_across_boundary():
+    windows = [(0, 11 * SAMPLE_RATE, 0, 10 * SAMPLE_RATE), (9 * SAMPLE_RATE, 20 * SAMPLE_RATE, 10 * SAMPLE_RATE, 20 * SAMPLE_RATE)]
+    window_segments = [
+        [{"start": 8.0, "end": 10.5, "text": " 重複的句子"}],
+        [{"start": 10.1, "end": 10.6, "text": "重複的句子 "}, {"start": 11.0, "end": 12.0, "text": " 下一句"}]
+    ]
+    segments = stitch_segments(windows, window_segments)
+    assert [segment["text"] for segment in segments] == [" 重複的句子", " 下一句"]
+
+def test_iter_windows_matches_streamed_audio():
+    audio = tone_with_pauses(100, 25)
+    blocks = [audio[i:i + 7 * SAMPLE_RATE] for i in range(0, len(audio), 7 * SAMPLE_RATE)]
+    windows = list(iter_windows(iter(blocks), window_seconds=30, overlap_seconds=1, search_seconds=5))
+
+    assert len(windows) > 1
+    assert windows[0][2] == 0 and windows[-1][3] == float("inf")
+    for (_, _, _, keep_end), (_, _, keep_start, _) in zip(windows, windows[1:]):
+        assert keep_end == keep_start
+    # 每個窗口的音頻與原音頻對應位置一致
+    for samples, start, _, _ in windows:
+        offset = int(round(start * SAMPLE_RATE))
+        np.testing.assert_array_equal(samples, audio[offset:offset + len(samples)])
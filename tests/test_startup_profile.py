@@ -0,0 +1,24 @@
+import time
+
+from modules.startup_profile import StartupProfiler, profile_imports
+
+def test_first_measurement_is_kept():
+    profiler = StartupProfiler()
+    with profiler.measure("vector_store", "init"):
+        time.sleep(0.01)
+    # Streamlit 重新運行腳本時的重複記錄不覆蓋冷啟動的數值
+    profiler.record("vector_store", "init", 0.0)
+    profiler.record("vector_store", "import", 0.5)
+    profiler.record("tts", "init", 0.25)
+
+    rows = profiler.summary()
+    assert [row["component"] for row in rows] == ["vector_store", "tts"]
+    assert rows[0]["init"] >= 0.01
+    assert rows[0]["total"] == rows[0]["init"] + 0.5
+    assert rows[1]["import"] is None
+    assert profiler.report().splitlines()[2].split() == ["tts", "-", "0.250", "0.250"]
+
+def test_profile_imports_skips_missing_modules(capsys):
+    imports = profile_imports(["json", "module_that_does_not_exist"])
+    assert [row["component"] for row in imports.summary()] == ["json"]
+    assert "module_that_does_not_exist" in capsys.readouterr().out
@@ -0,0 +1,41 @@
+import random
+import pytest
+
+from modules import text_normalize
+from modules.text_normalize import clean_text, detect_language, majority_language, script_counts
+from benchmarks.text_normalize import SAMPLES, legacy_clean_text, legacy_detect_language
+
+def random_text(length, rng):
+    ranges = [(0x20, 0x7E), (0x3000, 0x30FF), (0x4E00, 0x9FFF), (0xAC00, 0xD7FF), (0x1100, 0x11FF), (0x80, 0xFFFF), (0x10000, 0x10FFFF)]
+    return "".join(chr(rng.randint(*rng.choice(ranges))) for _ in range(length))
+
+def reference_counts(text):
+    counts = dict.fromkeys(text_normalize.SCRIPTS, 0)
+    for char in text:
+        for script, ranges in text_normalize._SCRIPT_RANGES.items():
+            if any(low <= ord(char) <= high for low, high in ranges):
+                counts[script] += 1
+    return counts
+
+@pytest.mark.parametrize("length", [0, 1, 40, 600])
+def test_script_counts_matches_reference(length):
+    # 覆蓋 ASCII 和 numpy 兩種實現
+    rng = random.Random(length)
+    for _ in range(50):
+        text = random_text(length, rng)
+        assert script_counts(text) == reference_counts(text)
+    ascii_text = "".join(chr(rng.randint(0x20, 0x7E)) for _ in range(length))
+    assert script_counts(ascii_text) == reference_counts(ascii_text)
+
+@pytest.mark.parametrize("name", sorted(SAMPLES))
+def test_matches_legacy_implementations(name):
+    sample = SAMPLES[name]
+    assert clean_text(sample) == legacy_clean_text(sample)
+    assert detect_language(sample) == legacy_detect_language(sample)
+
+def test_majority_language():
+    assert majority_language(script_counts("光合作用（photosynthesis）是植物利用陽光製造養分的過程")) == "zh-tw"
+    assert majority_language(script_counts("光合作用は植物が養分を作る過程です")) == "ja"
+    # 中文中夾雜一個片假名詞時仍按中文朗讀
+    assert majority_language(script_counts("這個詞在日文中寫作カメラ，意思是相機，是從英文借來的外來語，在日常生活中非常常見的一個例子")) == "zh-tw"
+    assert majority_language(script_counts("12345")) == "en"
@@ -0,0 +1,94 @@
+import json
+import pytest
+
+from modules.tracing import Tracer
+
+@pytest.fixture
+def tracer():
+    tracer = Tracer()
+    yield tracer
+    tracer.configure(None)
+
+def test_nested_spans_share_trace_and_parent(tracer):
+    with tracer.span("answer", question="q") as answer:
+        with tracer.span("retrieval") as retrieval:
+            with tracer.span("embedding"):
+                pass
+        tracer.record("llm_first_token", 0.01)
+    with tracer.span("answer"):
+        pass
+
+    first, second = reversed(tracer.recent_traces())
+    spans = {span["name"]: span for span in first}
+    assert set(spans) == {"answer", "retrieval", "embedding", "llm_first_token"}
+    assert {span["trace_id"] for span in first} == {answer["trace_id"]}
+    assert spans["answer"]["parent_id"] is None
+    assert spans["answer"]["attributes"] == {"question": "q"}
+    assert spans["retrieval"]["parent_id"] == answer["span_id"]
+    assert spans["embedding"]["parent_id"] == retrieval["span_id"]
+    assert spans["llm_first_token"]["parent_id"] == answer["span_id"]
+    # 新的頂層 span 開始新的追蹤
+    assert second[0]["trace_id"] != answer["trace_id"]
+
+def test_failed_span_counts_error_and_reraises(tracer):
+    with pytest.raises(ValueError):
+        with tracer.span("whisper"):
+            raise ValueError("bad audio")
+    assert tracer.stats()["whisper"]["errors"] == 1
+    assert tracer.recent_traces()[0][0]["error"] == "ValueError"
+
+def test_stats_quantiles(tracer):
+    for i in range(1, 101):
+        tracer.record("retrieval", i / 1000)
+    stat = tracer.stats()["retrieval"]
+    assert stat["count"] == 100
+    assert stat["total"] == pytest.approx(5.05)
+    assert stat["mean"] == pytest.approx(0.0505)
+    assert stat["p50"] == pytest.approx(0.0505)
+    assert stat["p95"] == pytest.approx(0.09505)
+    assert stat["p99"] == pytest.approx(0.09901)
+    assert stat["max"] == pytest.approx(0.1)
+
+def test_quantiles_use_recent_samples(tracer):
+    tracer = Tracer(max_samples=10)
+    for _ in range(50):
+        tracer.record("tts", 1.0)
+    for _ in range(10):
+        tracer.record("tts", 0.1)
+    stat = tracer.stats()["tts"]
+    assert stat["count"] == 60
+    assert stat["p99"] == pytest.approx(0.1)
+    assert stat["total"] == pytest.approx(51.0)
+
+def test_prometheus_text(tracer):
+    tracer.record("retrieval", 0.25)
+    tracer.record("retrieval", 0.75, error="Timeout")
+    lines = tracer.prometheus_text().splitlines()
+    assert "# TYPE qa_stage_duration_seconds summary" in lines
+    assert 'qa_stage_duration_seconds{stage="retrieval",quantile="0.5"} 0.500000' in lines
+    assert 'qa_stage_duration_seconds_sum{stage="retrieval"} 1.000000' in lines
+    assert 'qa_stage_duration_seconds_count{stage="retrieval"} 2' in lines
+    assert 'qa_stage_errors_total{stage="retrieval"} 1' in lines
+
+def test_jsonl_log_rotates(tmp_path, tracer):
+    path = tmp_path / "traces" / "spans.jsonl"
+    tracer.configure(str(path), max_log_bytes=500)
+    for i in range(10):
+        tracer.record("playback", 0.1, index=i)
+    tracer.configure(None)
+
+    rotated = tmp_path / "traces" / "spans.jsonl.1"
+    assert rotated.exists()
+    assert rotated.stat().st_size > 500
+    records = [json.loads(line) for line in rotated.read_text(encoding="utf-8").splitlines()]
+    records += [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    # 輪換只保留一份舊文件，新文件接著舊文件的記錄繼續寫入
+    indices = [record["attributes"]["index"] for record in records]
+    assert indices == list(range(indices[0], 10))
+    assert all(record["name"] == "playback" and record["duration"] == 0.1 for record in records)
+
+def test_reset_clears_stats(tracer):
+    tracer.record("decode", 0.1)
+    tracer.reset()
+    assert tracer.stats() == {}
+    assert tracer.recent_traces() == []
@@ -0,0 +1,54 @@
+import os
+
+from modules.transcription_cache import TranscriptionCache
+
+def stream_entry(tmp_path, name, size):
+    """與流式轉錄相同，條目只引用磁盤上的轉錄文件和片段文件"""
+    transcript = tmp_path / f"{name}.txt"
+    segments = tmp_path / f"{name}.segments.jsonl"
+    transcript.write_text("字" * size, encoding="utf-8")
+    segments.write_text("{}\n" * size, encoding="utf-8")
+    return {"transcript_path": str(transcript), "segments_path": str(segments), "chunk_ids": []}
+
+def test_put_and_get(tmp_path):
+    cache = TranscriptionCache(str(tmp_path / "cache"))
+    cache.put("key", {"text": "光合作用", "chunk_ids": []})
+    assert cache.get("key") == {"text": "光合作用", "chunk_ids": []}
+    assert cache.update("key", chunk_ids=["a"])
+    assert cache.get("key")["chunk_ids"] == ["a"]
+    assert cache.get("missing") is None
+    assert not cache.update("missing", chunk_ids=["a"])
+
+def test_make_key_depends_on_content_and_options(tmp_path):
+    first = tmp_path / "a.wav"
+    second = tmp_path / "b.wav"
+    first.write_bytes(b"audio")
+    second.write_bytes(b"audio")
+    key = TranscriptionCache.make_key(str(first), "base", {"language": None})
+    assert TranscriptionCache.make_key(str(second), "base", {"language": None}) == key
+    assert TranscriptionCache.make_key(str(first), "small", {"language": None}) != key
+    second.write_bytes(b"other audio")
+    assert TranscriptionCache.make_key(str(second), "base", {"language": None}) != key
+
+def test_eviction_counts_and_removes_referenced_files(tmp_path):
+    cache = TranscriptionCache(str(tmp_path / "cache"), max_bytes=7000)
+    old = stream_entry(tmp_path, "old", 500)
+    cache.put("old", old)
+    os.utime(cache._entry_path("old"), (1, 1))
+    recent = stream_entry(tmp_path, "recent", 500)
+    cache.put("recent", recent)
+    assert cache._entry_path("old").exists()
+
+    # JSON 條目本身很小，轉錄文件使總大小超出限制
+    cache.put("new", stream_entry(tmp_path, "new", 500))
+    assert cache.get("old") is None
+    assert not os.path.exists(old["transcript_path"]) and not os.path.exists(old["segments_path"])
+    assert cache.get("recent") is not None and os.path.exists(recent["transcript_path"])
+    assert cache.get("new") is not None
+
+def test_entry_just_written_is_kept(tmp_path):
+    cache = TranscriptionCache(str(tmp_path / "cache"), max_bytes=100)
+    entry = stream_entry(tmp_path, "large", 2000)
+    cache.put("large", entry)
+    assert cache.get("large") == entry
+    assert os.path.exists(entry["transcript_path"])
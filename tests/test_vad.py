@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from modules.vad import EnergyVAD, PlaybackAwareVAD, UtteranceSegmenter
+
+SAMPLE_RATE = 16000
+FRAME_MS = 30
+FRAME = SAMPLE_RATE * FRAME_MS // 1000
+
+def silence(ms, level=0.001):
+    rng = np.random.default_rng(0)
+    return [rng.normal(0, level, FRAME).astype(np.float32) for _ in range(ms // FRAME_MS)]
+
+def speech(ms, amplitude=0.3):
+    t = np.arange(FRAME) / SAMPLE_RATE
+    return [(amplitude * np.sin(2 * np.pi * 220 * t)).astype(np.float32) for _ in range(ms // FRAME_MS)]
+
+def feed_all(segmenter, frames):
+    segments = []
+    for frame in frames:
+        segments.extend(segmenter.feed(frame))
+    return segments
+
+def test_energy_vad_separates_speech_from_noise():
+    vad = EnergyVAD()
+    assert not any(vad.is_speech(frame) for frame in silence(300))
+    assert all(vad.is_speech(frame) for frame in speech(90))
+    assert not vad.is_speech(silence(30)[0])
+
+def test_segmenter_ends_utterance_after_silence():
+    segmenter = UtteranceSegmenter(EnergyVAD(), frame_ms=FRAME_MS, pre_roll_ms=90, end_silence_ms=600)
+    segments = feed_all(segmenter, silence(600) + speech(900) + silence(600))
+
+    assert segmenter.done
+    assert len(segments) == 1
+    # 保留語音前的 pre_roll 和語音後最多 200ms 的靜音
+    assert len(segments[0]) == (3 + 30 + 200 // FRAME_MS) * FRAME
+    # 結束後的音頻不再處理
+    assert segmenter.feed(speech(30)[0]) == []
+
+def test_segmenter_emits_intermediate_segments_on_pauses():
+    segmenter = UtteranceSegmenter(
+        EnergyVAD(), frame_ms=FRAME_MS, pre_roll_ms=0, segment_pause_ms=300,
+        min_segment_ms=1500, end_silence_ms=900
+    )
+    frames = silence(300) + speech(1800) + silence(390) + speech(600) + silence(900)
+    segments = feed_all(segmenter, frames)
+
+    assert segmenter.done
+    assert len(segments) == 2
+    # 完整的句子包含兩段語音和它們之間的停頓
+    assert len(segmenter.utterance()) == sum(len(frame) for frame in frames[300 // FRAME_MS:])
+
+def test_segmenter_without_speech_returns_nothing():
+    segmenter = UtteranceSegmenter(EnergyVAD(), frame_ms=FRAME_MS)
+    assert feed_all(segmenter, silence(3000)) == []
+    assert not segmenter.started
+    assert len(segmenter.utterance()) == 0
+
+def test_segmenter_caps_utterance_length():
+    segmenter = UtteranceSegmenter(EnergyVAD(), frame_ms=FRAME_MS, pre_roll_ms=0, max_utterance_ms=1500)
+    segments = feed_all(segmenter, silence(300) + speech(3000))
+    assert segmenter.done
+    assert len(segments) == 1
+
+@pytest.mark.parametrize("barge_in_ratio, expected", [(None, False), (2.0, True)])
+def test_playback_aware_vad(barge_in_ratio, expected):
+    playing = False
+    vad = PlaybackAwareVAD(lambda: playing, barge_in_ratio=barge_in_ratio)
+    for frame in silence(300):
+        vad.is_speech(frame)
+    playing = True
+    # 播放期間的答案回聲不算語音，只有足夠大聲的說話才能打斷
+    assert not vad.is_speech(speech(30, amplitude=0.015)[0])
+    assert vad.is_speech(speech(30, amplitude=0.5)[0]) is expected
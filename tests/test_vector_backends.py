@@ -0,0 +1,82 @@
+from pathlib import Path
+import pickle
+import shutil
+import pytest
+
+pytest.importorskip("faiss")
+pytest.importorskip("langchain_community")
+
+from modules.vector_backends import FaissBackend
+
+# 倉庫中已有的 FAISS 索引，由較新版本的 LangChain 寫入
+TRACKED_INDEX = Path(__file__).resolve().parent.parent / "vector_store" / "index"
+
+def faiss_backend(path, hash_embeddings, **options):
+    return FaissBackend(str(path), embedding_function=hash_embeddings.embed_documents, mmap=False, **options)
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+def test_faiss_upsert_delete_reload(tmp_path, hash_embeddings, index_type):
+    backend = faiss_backend(tmp_path, hash_embeddings, index_type=index_type)
+    backend.upsert(
+        ids=["a", "b", "c"],
+        documents=["photosynthesis light", "cell respiration", "dna replication"],
+        metadatas=[{"n": 1}, {"n": 2}, {"n": 3}]
+    )
+    backend.upsert(ids=["b"], documents=["cell respiration energy"], metadatas=[{"n": 20}])
+    backend.delete(ids=["c"])
+    assert backend.count() == 2
+
+    result = backend.query(query_texts=["cell respiration energy"], n_results=3)
+    assert result["ids"][0][0] == "b"
+    assert "c" not in result["ids"][0]
+    assert result["distances"][0][0] == pytest.approx(0.0, abs=1e-5)
+    backend.persist()
+
+    reloaded = faiss_backend(tmp_path, hash_embeddings, index_type=index_type)
+    assert reloaded.count() == 2
+    found = reloaded.get(ids=["a", "b", "c"])
+    assert dict(zip(found["ids"], found["metadatas"])) == {"a": {"n": 1}, "b": {"n": 20}}
+    assert reloaded.query(query_texts=["photosynthesis light"], n_results=1)["ids"] == [["a"]]
+
+    # 重新加載後繼續寫入不會重用已刪除向量的標籤
+    reloaded.upsert(ids=["d"], documents=["krebs cycle"], metadatas=[{"n": 4}])
+    assert reloaded.query(query_texts=["krebs cycle"], n_results=1)["ids"] == [["d"]]
+    assert reloaded.query(query_texts=["photosynthesis light"], n_results=1)["ids"] == [["a"]]
+
+def test_faiss_hnsw_compacts_orphans(tmp_path, hash_embeddings):
+    backend = faiss_backend(tmp_path, hash_embeddings, index_type="hnsw", max_orphan_ratio=0.25)
+    ids = [f"doc{i}" for i in range(8)]
+    backend.upsert(ids=ids, documents=[f"note {i}" for i in range(8)], metadatas=[{}] * 8)
+    backend.delete(ids=ids[:4])
+    assert backend.index.ntotal == backend.count() == 4
+
+def test_faiss_filtered_query(tmp_path, hash_embeddings):
+    backend = faiss_backend(tmp_path, hash_embeddings)
+    backend.upsert(
+        ids=["a", "b"],
+        documents=["energy", "energy"],
+        metadatas=[{"lecture_id": "L1", "start": 0.0, "end": 10.0}, {"lecture_id": "L2", "start": 0.0, "end": 10.0}]
+    )
+    result = backend.query(query_texts=["energy"], n_results=5, where={"lecture_id": "L2"})
+    assert result["ids"] == [["b"]]
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_tracked_index_loads(tmp_path, mmap):
+    index_dir = tmp_path / "index"
+    shutil.copytree(TRACKED_INDEX, index_dir)
+    backend = FaissBackend(str(index_dir), embedding_function=lambda texts: [[1.0] * 384 for _ in texts], mmap=mmap)
+    assert backend.count() == backend.index.ntotal > 0
+
+    found = backend.get(include=["documents", "metadatas", "embeddings"])
+    assert "初始化文檔" in found["documents"]
+    assert all(isinstance(metadata, dict) for metadata in found["metadatas"])
+    result = backend.query(query_embeddings=found["embeddings"][:1], n_results=1)
+    assert result["ids"] == [found["ids"][:1]]
+
+def test_unreadable_docstore_raises_clear_error(tmp_path):
+    index_dir = tmp_path / "index"
+    shutil.copytree(TRACKED_INDEX, index_dir)
+    with open(index_dir / "index.pkl", "wb") as f:
+        pickle.dump(["not", "a", "docstore"], f)
+    with pytest.raises(RuntimeError, match="無法讀取 FAISS 文檔存儲"):
+        FaissBackend(str(index_dir), embedding_function=lambda texts: [[1.0] * 384 for _ in texts])
@@ -0,0 +1,110 @@
+from pathlib import Path
+import asyncio
+import gc
+import shutil
+import weakref
+import pytest
+
+pytest.importorskip("faiss")
+pytest.importorskip("langchain_community")
+
+from langchain.callbacks.base import BaseCallbackHandler
+from modules.vector_store import LEGACY_ID_PATTERN, VectorStore
+
+def faiss_store(path, hash_embeddings, **options):
+    return VectorStore(str(path), backend="faiss", embedding=hash_embeddings, **options)
+
+def test_hybrid_search_fuses_lexical_and_dense_rankings(tmp_path, hash_embeddings):
+    store = faiss_store(tmp_path, hash_embeddings)
+    store.add_contents(
+        ["the calvin cycle fixes carbon", "plants use light energy", "the krebs cycle releases energy"],
+        [{"source": "a"}, {"source": "b"}, {"source": "c"}]
+    )
+    results = store.hybrid_search_many(["calvin cycle"], k=3)[0]
+    assert results[0]["content"] == "the calvin cycle fixes carbon"
+    assert [result["score"] for result in results] == sorted((result["score"] for result in results), reverse=True)
+    # 兩種檢索中都排第一的文檔得到兩份 RRF 分數
+    assert results[0]["score"] == pytest.approx(2 / 61)
+
+def test_from_texts_persists_without_explicit_flush(tmp_path, hash_embeddings):
+    VectorStore.from_texts(
+        ["photosynthesis", "respiration"], hash_embeddings,
+        metadatas=[{"source": "a"}, {"source": "b"}],
+        persist_directory=str(tmp_path), backend="faiss"
+    )
+    reopened = faiss_store(tmp_path, hash_embeddings)
+    assert reopened.backend.count() == 2
+
+def test_legacy_ids_are_migrated_without_doc_0(tmp_path, hash_embeddings):
+    store = faiss_store(tmp_path, hash_embeddings)
+    # 舊版集合中 doc_0 已被刪除，只剩下其他 doc_N
+    store.backend.upsert(
+        ids=["doc_1", "doc_2"],
+        documents=["photosynthesis", "respiration"],
+        metadatas=[{"source": "a"}, {"source": "b"}]
+    )
+    store.backend.persist()
+    (tmp_path / "store_meta.json").unlink()
+
+    reopened = faiss_store(tmp_path, hash_embeddings)
+    ids = reopened.backend.get()["ids"]
+    assert len(ids) == 2
+    assert not any(LEGACY_ID_PATTERN.match(doc_id) for doc_id in ids)
+    assert sorted(ids) == sorted(
+        VectorStore.generate_doc_id(text, {"source": source})
+        for text, source in [("photosynthesis", "a"), ("respiration", "b")]
+    )
+    assert sorted(reopened.lexical_index.doc_ids()) == sorted(ids)
+
+def test_tracked_faiss_index_opens(tmp_path, hash_embeddings):
+    shutil.copytree(Path(__file__).resolve().parent.parent / "vector_store" / "index", tmp_path / "index")
+    # 與倉庫中索引的向量維度一致
+    hash_embeddings.dimension = 384
+    store = faiss_store(tmp_path, hash_embeddings)
+    documents = store.get_all_documents()
+    assert len(documents) == store.backend.count() > 0
+    assert store.lexical_index.count() == len(documents)
+    assert len(store.search("初始化文檔", n_results=1)) == 1
+
+class RetrieverEvents(BaseCallbackHandler):
+    def __init__(self):
+        self.events = []
+
+    def on_retriever_start(self, serialized, query, **kwargs):
+        self.events.append(("start", query))
+
+    def on_retriever_end(self, documents, **kwargs):
+        self.events.append(("end", len(documents)))
+
+@pytest.mark.parametrize("search_type", ["similarity", "hybrid"])
+def test_retriever_goes_through_invoke(tmp_path, hash_embeddings, search_type):
+    store = faiss_store(tmp_path, hash_embeddings)
+    store.add_contents(
+        ["the calvin cycle fixes carbon", "plants use light energy", "the krebs cycle releases energy"],
+        [{"source": "a"}, {"source": "b"}, {"source": "c"}]
+    )
+    retriever = store.as_retriever(search_type=search_type, search_kwargs={"k": 2})
+    handler = RetrieverEvents()
+
+    documents = retriever.invoke("calvin cycle", config={"callbacks": [handler]})
+    assert documents[0].page_content == "the calvin cycle fixes carbon"
+    assert handler.events == [("start", "calvin cycle"), ("end", 2)]
+
+    async_documents = asyncio.run(retriever.ainvoke("calvin cycle", config={"callbacks": [handler]}))
+    assert async_documents == documents
+    assert handler.events[2:] == [("start", "calvin cycle"), ("end", 2)]
+
+    batches = retriever.get_relevant_documents_many(["calvin cycle", "light energy"])
+    assert [batch[0].page_content for batch in batches] == ["the calvin cycle fixes carbon", "plants use light energy"]
+
+def test_dropped_store_is_saved_and_released(tmp_path, hash_embeddings):
+    store = faiss_store(tmp_path, hash_embeddings, persist_interval=3600)
+    store.add_contents(["photosynthesis", "respiration"], [{"source": "a"}, {"source": "b"}])
+    assert not (tmp_path / "index" / "index.faiss").exists()
+
+    reference = weakref.ref(store)
+    del store
+    gc.collect()
+    # 不再使用的實例不會保留到進程退出，回收時保存尚未寫入磁盤的修改
+    assert reference() is None
+    assert faiss_store(tmp_path, hash_embeddings).backend.count() == 2